@@ -0,0 +1 @@
+"""Shared recording logic used by twitch-record.py, kick-record.py and record-supervisor.py."""
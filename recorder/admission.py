@@ -0,0 +1,429 @@
+"""Bandwidth-aware admission control for captures.
+
+When many channels go live at once every ``record_stream()`` loop starts a
+``best`` capture, and together they can saturate the uplink or the NAS link:
+then every recording drops segments instead of a few being recorded at a
+lower quality. With ``AdmissionControl`` enabled, a capture has to be
+admitted by the ``AdmissionController`` (one per process, shared by all
+channels) before it starts:
+
+* the free bandwidth is ``IngestBandwidth`` (default: the link speed of
+  ``AdmissionInterface``) minus what the interface is receiving right now
+  from anything other than this process's captures (``/proc/net/dev``, so
+  separate recorder processes see each other), minus what the running
+  captures need; ``WriteBandwidth`` caps the captures' total on top;
+* what a capture needs is the bitrate it was measured at last time for that
+  channel and quality (``state/bitrates.json``), scaled from its ``best``
+  bitrate or ``DefaultBitrate`` for qualities not seen yet;
+* a capture that fits starts at ``best``. Otherwise a channel with a higher
+  ``ChannelPriorities`` entry first makes lower-priority captures restart one
+  step down ``DegradeQualities``, then lowers its own quality, and if not
+  even the lowest fits it waits in a queue ordered by priority.
+
+A capture that was stepped down stays at the lower quality until its stream
+ends. ``CaptureLimits`` (``CaptureNice``, ``CaptureIOPriority``,
+``CaptureScope``) starts the streamlink/yt-dlp children under nice/ionice or
+in their own systemd scope with CPU and IO weights by priority.
+"""
+import os
+import re
+import json
+import time
+import fcntl
+import shlex
+import shutil
+import asyncio
+import itertools
+import contextlib
+
+from . import metrics
+from .common import STATE_DIR
+from .migrate import parse_size
+from .output import bytes_written
+
+BITRATES_PATH  = os.path.join(STATE_DIR, "bitrates.json")
+DEFAULT_LADDER = ("720p60", "720p", "480p", "worst")
+QUALITY_RE     = re.compile(r"^(\d{3,4})p(\d+)?")
+MIN_MEASURE    = 60             # seconds of data before a capture's bitrate is remembered
+SHARES         = {"best": 1.0, "source": 1.0, "worst": 0.05, "audio_only": 0.03, "audio": 0.03}
+
+
+class AdmissionHandover(Exception):
+    """The capture was stopped to restart at a lower quality, making room for a higher-priority channel."""
+
+
+def parse_priorities(raw):
+    """``"roflgator=10, kick:other=-1"`` -> ``{"roflgator": 10, "kick:other": -1}``."""
+    priorities = {}
+    for item in raw.split(","):
+        name, _, value = item.strip().partition("=")
+        if name and value.strip().lstrip("-").isdigit():
+            priorities[name.strip().lower()] = int(value)
+    return priorities
+
+
+def channel_priority(config, platform, name):
+    """Priority of ``platform:name`` from ``ChannelPriorities``; ``platform:name`` entries beat plain names."""
+    priorities = parse_priorities(config.get("Settings", "ChannelPriorities", fallback=""))
+    return priorities.get(f"{platform}:{name}".lower(), priorities.get(name.lower(), 0))
+
+
+def quality_share(quality):
+    """Rough bitrate of ``quality`` as a fraction of the source: 720p60 ~ 0.55, 480p ~ 0.2."""
+    name = quality.split(",", 1)[0].strip().lower()
+    if name in SHARES:
+        return SHARES[name]
+    match = QUALITY_RE.match(name)
+    if not match:
+        return 1.0
+    height, fps = int(match.group(1)), int(match.group(2) or 30)
+    return min(1.0, (height / 1080) ** 1.5 * (1.0 if fps > 30 else 0.7))
+
+
+def default_interface():
+    """Interface of the default route, from ``/proc/net/route``."""
+    try:
+        with open("/proc/net/route") as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if len(fields) > 1 and fields[1] == "00000000":
+                    return fields[0]
+    except OSError:
+        pass
+    return None
+
+
+class LinkMeter:
+    """Receive rate of a network interface, from the byte counters in ``/proc/net/dev``."""
+
+    def __init__(self, interface):
+        self.interface = interface
+        self.last      = None               # (monotonic, rx bytes)
+        self.rate      = None               # bytes/s between the last two samples
+
+    def speed(self):
+        """Link speed in bytes/s, or None when the driver doesn't report one (virtual interfaces)."""
+        try:
+            with open(f"/sys/class/net/{self.interface}/speed") as f:
+                mbit = int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+        return mbit * 125_000 if mbit > 0 else None
+
+    def _rx_bytes(self):
+        try:
+            with open("/proc/net/dev") as f:
+                for line in f:
+                    name, _, counters = line.partition(":")
+                    if name.strip() == self.interface:
+                        return int(counters.split()[0])
+        except (OSError, ValueError, IndexError):
+            pass
+        return None
+
+    def sample(self):
+        rx, now = self._rx_bytes(), time.monotonic()
+        if rx is None:
+            return None
+        if self.last is not None and now > self.last[0]:
+            self.rate = max(0.0, (rx - self.last[1]) / (now - self.last[0]))
+        self.last = (now, rx)
+        return self.rate
+
+    def age(self):
+        return time.monotonic() - self.last[0] if self.last else float("inf")
+
+
+class CaptureLimits:
+    """Prefix for capture commands: nice/ionice, or a systemd scope with weights by channel priority."""
+
+    def __init__(self, nice=0, io_priority=None, scope=""):
+        self.nice        = nice
+        self.io_priority = io_priority      # best-effort class level 0-7; idle would starve a live capture
+        self.scope       = scope            # "user" or "system": run in a transient systemd scope
+
+    @classmethod
+    def from_config(cls, config):
+        """Return limits if ``CaptureNice``, ``CaptureIOPriority`` or ``CaptureScope`` is set, else None."""
+        io_priority = config.get("Settings", "CaptureIOPriority", fallback="").strip()
+        limits = cls(
+            nice=config.getint("Settings", "CaptureNice", fallback=0),
+            io_priority=int(io_priority) if io_priority.isdigit() else None,
+            scope=config.get("Settings", "CaptureScope", fallback="").strip().lower(),
+        )
+        if limits.scope not in ("", "user", "system"):
+            limits.scope = ""
+        if not (limits.nice or limits.io_priority is not None or limits.scope):
+            return None
+        return limits
+
+    def prefix(self, priority=0):
+        cmd = []
+        if self.scope and shutil.which("systemd-run"):
+            weight = max(1, min(10000, 100 + 10 * priority))
+            cmd += ["systemd-run", "--scope", "--quiet", "--collect", *(["--user"] if self.scope == "user" else []),
+                    "-p", f"CPUWeight={weight}", "-p", f"IOWeight={weight}"]
+        if self.io_priority is not None and shutil.which("ionice"):
+            cmd += ["ionice", "-c", "2", "-n", str(min(self.io_priority, 7))]
+        if self.nice:
+            cmd += ["nice", "-n", str(self.nice)]
+        return cmd
+
+    def wrap(self, cmd, priority=0):
+        """``cmd`` (shell string or argv list) with the prefix in front."""
+        prefix = self.prefix(priority)
+        if isinstance(cmd, str):
+            return f"{shlex.join(prefix)} {cmd}" if prefix else cmd
+        return prefix + list(cmd)
+
+
+class Ticket:
+    """A running capture as the controller sees it."""
+
+    def __init__(self, key, priority, quality, level, need):
+        self.key       = key
+        self.priority  = priority
+        self.quality   = quality            # streamlink quality spec the capture runs at
+        self.level     = level              # index into the channel's quality ladder
+        self.need      = need               # estimated bytes/s
+        self.rate      = 0.0                # measured bytes/s
+        self.step_down = asyncio.Event()
+
+
+class AdmissionController:
+    def __init__(self, logger, ingest=0, write=0, default_bitrate=750 * 1024, ladder=DEFAULT_LADDER,
+                 interface=None, interval=5, path=BITRATES_PATH):
+        self.logger          = logger
+        self.meter           = LinkMeter(interface or default_interface())
+        self.ingest          = ingest or self.meter.speed() or 0     # bytes/s, 0 = not limited
+        self.write           = write                                 # bytes/s, 0 = not limited
+        self.default_bitrate = default_bitrate
+        self.ladder          = tuple(ladder)
+        self.interval        = interval
+        self.path            = path
+        self.active          = {}           # "platform:name" -> Ticket
+        self.waiting         = []           # (-priority, seq, key) in admission order
+        self.floors          = {}           # "platform:name" -> lowest ladder level allowed to start at
+        self.bitrates        = self._load()
+        self._seq            = itertools.count()
+        self._changed        = asyncio.Event()
+
+    @classmethod
+    def from_config(cls, config, logger, path=BITRATES_PATH):
+        """Return a controller if ``AdmissionControl`` is enabled, else None."""
+        if not config.getboolean("Settings", "AdmissionControl", fallback=False):
+            return None
+        get = lambda key: parse_size(config.get("Settings", key, fallback=""))
+        ladder = [q.strip() for q in config.get("Settings", "DegradeQualities", fallback="").split(",") if q.strip()]
+        controller = cls(
+            logger,
+            ingest=get("IngestBandwidth"),
+            write=get("WriteBandwidth"),
+            default_bitrate=get("DefaultBitrate") or 750 * 1024,
+            ladder=ladder or DEFAULT_LADDER,
+            interface=config.get("Settings", "AdmissionInterface", fallback="").strip() or None,
+            path=path,
+        )
+        logger.info(f"Admission control: ingest {controller.ingest / 1024 ** 2:.1f} MiB/s "
+                    f"({controller.meter.interface or 'no interface'}), write "
+                    + (f"{controller.write / 1024 ** 2:.1f} MiB/s" if controller.write else "unlimited"))
+        return controller
+
+    # ─── Bitrates ───────────────────────────────────────────────────────────────
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _remember(self, key, quality, rate):
+        """Blocking: fold a measured bitrate into the history, merging with other processes' entries."""
+        name = quality.split(",", 1)[0].strip().lower()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            bitrates = self._load()
+            old = bitrates.setdefault(key, {}).get(name)
+            bitrates[key][name] = round(rate if old is None else 0.7 * old + 0.3 * rate)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(bitrates, f)
+            os.replace(tmp, self.path)
+        self.bitrates = bitrates
+
+    def estimate(self, key, quality):
+        """Bytes/s a capture of ``key`` at ``quality`` is expected to need."""
+        known = self.bitrates.get(key, {})
+        name = quality.split(",", 1)[0].strip().lower()
+        if name in known:
+            return known[name]
+        return known.get("best", self.default_bitrate) * quality_share(quality)
+
+    # ─── Capacity ───────────────────────────────────────────────────────────────
+    def free(self):
+        """Bytes/s left for new captures (``inf`` when nothing is limited)."""
+        # Counters not sampled for a while (nothing captured) only give a long-term average
+        stale = self.meter.age() > 2 * self.interval
+        received = self.meter.sample()
+        committed = sum(max(t.need, t.rate) for t in self.active.values())
+        free = float("inf")
+        if self.ingest:
+            # Traffic that isn't one of our captures: other processes, other recorders, ...
+            other = 0.0 if stale else max(0.0, (received or 0.0) - sum(t.rate for t in self.active.values()))
+            free = self.ingest - other - committed
+        if self.write:
+            free = min(free, self.write - committed)
+        if free != float("inf"):
+            metrics.FREE_BANDWIDTH.set(max(free, 0))
+        return free
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _wait_change(self):
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._changed.wait(), self.interval)
+
+    def _ladder(self, channel):
+        """(quality spec, level) choices, best first. Each spec falls back to the lower ones if missing."""
+        if channel.quality != "best":
+            # Already lowered (simulcast backup): take it or wait, and never step it down further
+            return [(channel.quality, len(self.ladder))]
+        names = ["best", *self.ladder]
+        return [(name if name == "best" else ",".join(names[i:]), i) for i, name in enumerate(names)]
+
+    def _choose(self, channel, key, choices):
+        """(quality, level, need) to start at now, or None to keep waiting."""
+        free = self.free()
+        floor = self.floors.get(key, 0)
+        choices = [c for c in choices if c[1] >= floor] or choices[-1:]
+        quality, level = choices[0]
+        need = self.estimate(key, quality)
+        if need <= free:
+            return quality, level, need
+
+        # Make room by stepping down lower-priority captures, one level each
+        if any(t.step_down.is_set() for t in self.active.values()):
+            return None                         # captures are already restarting lower; wait for them
+        steps, saved = [], 0.0
+        for ticket in sorted(self.active.values(), key=lambda t: (t.priority, -t.need)):
+            if ticket.priority >= channel.priority or ticket.level >= len(self.ladder):
+                continue
+            lower = ",".join(self.ladder[ticket.level:])
+            steps.append(ticket)
+            saved += max(ticket.need, ticket.rate) - self.estimate(ticket.key, lower)
+            if need <= free + saved:
+                for step in steps:
+                    self.logger.info(f"Stepping {step.key} down from {step.quality.split(',')[0]} "
+                                     f"for {key} (priority {channel.priority} over {step.priority})")
+                    step.step_down.set()
+                return None
+
+        for quality, level in choices[1:]:
+            need = self.estimate(key, quality)
+            if need <= free:
+                return quality, level, need
+        return None
+
+    # ─── Admission ──────────────────────────────────────────────────────────────
+    @contextlib.asynccontextmanager
+    async def admit(self, channel):
+        """Wait until ``channel`` may capture; sets ``channel.quality`` to the quality it got."""
+        key = f"{channel.platform}:{channel.streamer_name}".lower()
+        choices = self._ladder(channel)
+        place = (-channel.priority, next(self._seq), key)
+        self.waiting.append(place)
+        self.waiting.sort()
+        queued_at = time.monotonic()
+        queued = False
+        try:
+            while True:
+                if self.waiting[0] == place:
+                    choice = self._choose(channel, key, choices)
+                    if choice is not None:
+                        break
+                if not queued:
+                    queued = True
+                    metrics.ADMISSION_QUEUED.inc()
+                    self.logger.warning(f"Not enough bandwidth for {key}, queued "
+                                        f"(priority {channel.priority}, {self.waiting.index(place)} ahead)")
+                await self._wait_change()
+        finally:
+            self.waiting.remove(place)
+            if queued:
+                metrics.ADMISSION_QUEUED.dec()
+            self._notify()
+
+        quality, level, need = choice
+        waited = time.monotonic() - queued_at
+        metrics.ADMISSION_WAIT.observe(waited)
+        metrics.ADMISSIONS.inc(quality="best" if level == 0 else "lowered")
+        if level or queued:
+            self.logger.info(f"Admitted {key} at {quality.split(',')[0]} after {waited:.0f}s "
+                             f"(needs ~{need / 1024:.0f} KiB/s)")
+        ticket = self.active[key] = Ticket(key, channel.priority, quality, level, need)
+        channel.quality = quality
+        try:
+            yield ticket
+        finally:
+            del self.active[key]
+            self._notify()
+
+    # ─── While capturing ────────────────────────────────────────────────────────
+    def guard(self, channel, attempt):
+        """Wrap ``attempt(output)`` to measure its bitrate and stop it with ``AdmissionHandover`` when stepped down."""
+        key = f"{channel.platform}:{channel.streamer_name}".lower()
+
+        async def guarded(output):
+            ticket = self.active.get(key)
+            if ticket is None:
+                return await attempt(output)
+            task = asyncio.create_task(attempt(output))
+            try:
+                stepped = await self._watch(ticket, output, task)
+            finally:
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+            if stepped:
+                self.floors[key] = ticket.level + 1
+                message = f"Restarting at {self.ladder[ticket.level]} to make room for a higher-priority channel"
+                metrics.ADMISSION_STEP_DOWNS.inc(platform=channel.platform)
+                if channel.session_record is not None:
+                    channel.session_record.event("admission", message)
+                raise AdmissionHandover(message)
+            self.floors.pop(key, None)          # the stream ended; next time starts at best again
+            return task.result()
+
+        return guarded
+
+    async def _watch(self, ticket, output, task):
+        """Sample the output's growth until ``task`` ends; True if the capture was asked to step down."""
+        stepper = asyncio.create_task(ticket.step_down.wait())
+        first = last = None                     # (monotonic, bytes)
+        try:
+            while not task.done():
+                await asyncio.wait({task, stepper}, timeout=self.interval, return_when=asyncio.FIRST_COMPLETED)
+                if task.done():
+                    break
+                if stepper.done():
+                    return True
+                written = await bytes_written(output, self.interval)
+                now = time.monotonic()
+                self.meter.sample()
+                if written is None:
+                    continue
+                if last is not None and now > last[0]:
+                    ticket.rate = max(0.0, (written - last[1]) / (now - last[0]))
+                last = (now, written)
+                if written and first is None:
+                    first = last
+        finally:
+            stepper.cancel()
+        if first and last and last[0] - first[0] >= MIN_MEASURE:
+            rate = (last[1] - first[1]) / (last[0] - first[0])
+            with contextlib.suppress(OSError):
+                await asyncio.to_thread(self._remember, ticket.key, ticket.quality, rate)
+        return False
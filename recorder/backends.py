@@ -0,0 +1,68 @@
+"""Per-channel memory of which capture backend works.
+
+Kick blocks streamlink and yt-dlp independently and per channel, and a block
+tends to last. Trying the blocked backend first on every cycle costs a full
+attempt and one more 403 on the bot detector's books. ``BackendMemory``
+scores each backend (+1 per success, -1 per 403, capped at ``MAX_SCORE``)
+and lets the scores decay towards zero with ``half_life``, so a channel goes
+straight to the backend that last worked and drifts back to the default
+order once the evidence is old. Scores are kept in ``state/`` so they survive restarts.
+"""
+import os
+import json
+import time
+
+MAX_SCORE = 3       # a long run of successes must not outweigh a fresh block for hours
+
+
+class BackendMemory:
+    def __init__(self, backends, half_life=6 * 3600, path=None):
+        self.backends  = list(backends)     # default order, first is preferred on a tie
+        self.half_life = half_life
+        self.path      = path
+        self.scores    = {}                 # backend -> (score, unix time of last update)
+        self._load()
+
+    @classmethod
+    def from_config(cls, config, backends, path=None):
+        """Return the memory, or None when ``BackendMemoryHalfLife`` is 0."""
+        half_life = config.getint("Settings", "BackendMemoryHalfLife", fallback=6 * 3600)
+        if half_life <= 0:
+            return None
+        return cls(backends, half_life, path)
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                self.scores = {k: (float(s), float(t)) for k, (s, t) in json.load(f).items() if k in self.backends}
+        except (OSError, ValueError, TypeError, AttributeError):
+            self.scores = {}
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(self.scores, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def score(self, backend, now=None):
+        now = time.time() if now is None else now
+        value, updated = self.scores.get(backend, (0.0, now))
+        return value * 0.5 ** (max(0.0, now - updated) / self.half_life)
+
+    def record(self, backend, ok, now=None):
+        now = time.time() if now is None else now
+        value = self.score(backend, now) + (1 if ok else -1)
+        self.scores[backend] = (max(-MAX_SCORE, min(MAX_SCORE, value)), now)
+        self._save()
+
+    def order(self, now=None):
+        """Backends best first; ties keep the default order."""
+        return sorted(self.backends, key=lambda b: -self.score(b, now))
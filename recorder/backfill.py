@@ -0,0 +1,350 @@
+"""Recover the start of a stream that polling missed.
+
+A capture starts however long after the go-live it took to notice it: up to
+``RetryTime``/``RetryTimeKick`` seconds when polling, a few seconds with push
+detection. With ``CaptureFromStart=true`` the recorder gets back as much of
+that as the platform still serves:
+
+* streamlink captures start at the oldest segment of the live playlist
+  (``--hls-live-restart``) instead of three segments behind the newest; where
+  the playlist keeps a DVR window (an ``EVENT`` playlist, or just a long one)
+  that goes back to the start of the stream;
+* captures that can't restart (yt-dlp) get the playlist's older segments
+  fetched in parallel right after their first data;
+* on Twitch, whatever is older than the playlist window is fetched from the
+  stream's archive VOD (for channels that keep VODs), ``BackfillWorkers``
+  segments at a time.
+
+Fetched segments go to ``<name>-backfill.ts`` next to the capture. It sorts
+before the session's other files, is catalogued, migrated and remuxed with
+them, and ``python -m recorder.concat`` puts it in front of a segmented
+session. Joins may repeat a second or two. How far into the stream the
+recording starts (after recovery) and how many seconds were recovered is
+logged, stored with the session in the catalog and exported as metrics.
+"""
+import os
+import re
+import json
+import time
+import shutil
+import asyncio
+import itertools
+import collections
+import urllib.error
+import urllib.request
+import concurrent.futures
+from datetime import datetime
+from urllib.parse import urljoin
+
+from . import metrics
+from .output import bytes_written, finish_file
+from .twitch_live import GQL_URL, WEB_CLIENT_ID
+
+LIVE_EDGE       = 3         # segments behind the newest where streamlink (and yt-dlp's ffmpeg) start
+LIVE_EDGE_RE    = re.compile(r"--hls-live-edge[=\s]+(\d+)")
+BANDWIDTH_RE    = re.compile(r"BANDWIDTH=(\d+)")
+VOD_URL         = "https://www.twitch.tv/videos/{id}"
+BACKFILL_SUFFIX = "-backfill"
+FETCH_RETRIES   = 3
+FETCH_TIMEOUT   = 15
+
+Segment = collections.namedtuple("Segment", "uri duration date")     # date: PROGRAM-DATE-TIME (unix) or None
+
+
+def parse_date(value):
+    try:
+        return datetime.fromisoformat(value.strip().replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+class Playlist:
+    """A parsed HLS playlist: the ``segments`` of a media playlist, or the ``variants`` of a multivariant one."""
+
+    def __init__(self, text, url):
+        self.url      = url
+        self.segments = []
+        self.variants = []              # (bandwidth, uri), best first
+        self.event    = False           # EVENT/VOD playlists start at the start of the stream
+        self.target   = 0.0
+        duration = date = bandwidth = None
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith("#EXTINF:"):
+                duration = float(line[8:].split(",", 1)[0] or 0)
+            elif line.startswith("#EXT-X-PROGRAM-DATE-TIME:"):
+                date = parse_date(line[25:])
+            elif line.startswith("#EXT-X-TARGETDURATION:"):
+                self.target = float(line[22:])
+            elif line.startswith("#EXT-X-PLAYLIST-TYPE:"):
+                self.event = line[21:] in ("EVENT", "VOD")
+            elif line.startswith("#EXT-X-STREAM-INF:"):
+                match = BANDWIDTH_RE.search(line)
+                bandwidth = int(match.group(1)) if match else 0
+            elif line and not line.startswith("#"):
+                if bandwidth is not None:
+                    self.variants.append((bandwidth, urljoin(url, line)))
+                elif duration is not None:
+                    self.segments.append(Segment(urljoin(url, line), duration, date))
+                duration = date = bandwidth = None
+        self.variants.sort(reverse=True)
+
+    def starts(self, fetched_at):
+        """Wall-clock start of every segment: from PROGRAM-DATE-TIME where tagged, else counted back from ``fetched_at``."""
+        tagged = next((i for i, s in enumerate(self.segments) if s.date is not None), None)
+        if tagged is None:
+            t = fetched_at - sum(s.duration for s in self.segments)
+        else:
+            t = self.segments[tagged].date - sum(s.duration for s in self.segments[:tagged])
+        starts = []
+        for segment in self.segments:
+            if segment.date is not None:
+                t = segment.date
+            starts.append(t)
+            t += segment.duration
+        return starts
+
+
+# ─── Blocking HTTP side (runs in worker threads) ────────────────────────────────
+def fetch(url, headers=None, data=None):
+    """GET (or POST ``data``) with a few retries; a 403/404/410 is final."""
+    for attempt in range(1, FETCH_RETRIES + 1):
+        try:
+            request = urllib.request.Request(url, data=data, headers=headers or {})
+            with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as resp:
+                return resp.read()
+        except OSError as e:
+            gone = isinstance(e, urllib.error.HTTPError) and e.code in (403, 404, 410)
+            if gone or attempt == FETCH_RETRIES:
+                raise
+            time.sleep(attempt)
+
+
+def load_playlist(url, headers=None):
+    """(media playlist, unix time it was fetched); a multivariant playlist is followed to its best variant."""
+    playlist = Playlist(fetch(url, headers).decode(errors="replace"), url)
+    if playlist.variants and not playlist.segments:
+        playlist = Playlist(fetch(playlist.variants[0][1], headers).decode(errors="replace"), playlist.variants[0][1])
+    return playlist, time.time()
+
+
+def download(segments, path, headers=None, workers=4):
+    """Fetch ``segments`` ``workers`` at a time and append them to ``path`` in order.
+
+    Segments that can't be fetched are skipped. Returns the seconds of media written.
+    """
+    written = 0.0
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool, open(path, "ab") as out:
+        # A bounded batch at a time, so a slow disk doesn't pile fetched segments up in memory
+        for start in range(0, len(segments), workers * 2):
+            batch = segments[start:start + workers * 2]
+            futures = [pool.submit(fetch, segment.uri, headers) for segment in batch]
+            for segment, future in zip(batch, futures):
+                try:
+                    out.write(future.result())
+                except OSError:
+                    continue
+                written += segment.duration
+    return written
+
+
+def archive_video(gql_url, login, token=None):
+    """(stream start as unix time or None, archive VOD id or None) of a live Twitch channel."""
+    query = f'query {{ u0: user(login: {json.dumps(login)}) {{ stream {{ createdAt archiveVideo {{ id }} }} }} }}'
+    headers = {"Client-ID": WEB_CLIENT_ID, "Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"OAuth {token}"
+    payload = json.loads(fetch(gql_url, headers, json.dumps({"query": query}).encode()))
+    stream = (((payload.get("data") or {}).get("u0") or {}).get("stream")) or {}
+    created = parse_date(stream["createdAt"]) if stream.get("createdAt") else None
+    return created, (stream.get("archiveVideo") or {}).get("id")
+
+
+# ─── Recovery ───────────────────────────────────────────────────────────────────
+class StartRecovery:
+    """Shared by every channel: finds where a capture starts in its stream and backfills the start."""
+
+    def __init__(self, logger, workers=4, archive=True, max_seconds=1800, gql_url=GQL_URL, vod_url=VOD_URL):
+        self.logger      = logger
+        self.workers     = workers
+        self.archive     = archive              # Twitch: fetch what the live window lacks from the archive VOD
+        self.max_seconds = max_seconds          # backfill at most this much before the capture
+        self.gql_url     = gql_url
+        self.vod_url     = vod_url
+
+    @classmethod
+    def from_config(cls, config, logger):
+        """Return a recovery helper if ``CaptureFromStart`` is enabled, else None."""
+        if not config.getboolean("Settings", "CaptureFromStart", fallback=False):
+            return None
+        return cls(
+            logger,
+            workers=max(1, config.getint("Settings", "BackfillWorkers", fallback=4)),
+            archive=config.getboolean("Settings", "BackfillFromArchive", fallback=True),
+            max_seconds=config.getint("Settings", "BackfillMaxMinutes", fallback=30) * 60,
+            gql_url=config.get("Settings", "TwitchGQLURL", fallback="") or GQL_URL,
+            vod_url=config.get("Settings", "TwitchVODURL", fallback="") or VOD_URL,
+        )
+
+    def guard(self, channel, attempt):
+        """Wrap ``attempt(output)`` to recover the stream start once its first data arrives.
+
+        Only the first attempt that produces data is looked at; a restart
+        after a stall continues the same session. Until then
+        ``channel.live_restart`` is set, so only that attempt starts at the
+        oldest segment of the playlist.
+        """
+        looked = False
+
+        async def guarded(output):
+            nonlocal looked
+            if looked:
+                return await attempt(output)
+            channel.live_restart = True
+            task = asyncio.create_task(attempt(output))
+            recovery = None
+            try:
+                while not task.done():
+                    await asyncio.wait({task}, timeout=1)
+                    if not task.done() and await bytes_written(output, 5):
+                        looked = True
+                        channel.live_restart = False
+                        recovery = asyncio.create_task(self.recover(channel, output))
+                        break
+                await asyncio.wait({task})
+                if recovery is not None:
+                    await recovery          # the stream may end before the backfill does
+                return task.result()
+            finally:
+                channel.live_restart = False
+                for pending in (task, recovery):
+                    if pending is not None and not pending.done():
+                        pending.cancel()
+                        await asyncio.gather(pending, return_exceptions=True)
+
+        return guarded
+
+    async def recover(self, channel, output):
+        """Measure where ``channel``'s capture into ``output`` starts in the stream and fetch what it missed."""
+        ua = getattr(channel, "streamlink_ua", None)
+        headers = {"User-Agent": ua} if ua else {}
+        try:
+            url = await channel.playlist_url()
+            if url is None:
+                raise OSError("no HLS playlist found")
+            live, fetched_at = await asyncio.to_thread(load_playlist, url, headers)
+        except (OSError, ValueError) as e:
+            channel.logger.warning(f"Cannot read the live playlist, not recovering the stream start: {e}")
+            return
+        if not live.segments:
+            return
+
+        # The capture itself starts at the oldest segment with live-restart, else at the live edge
+        starts = live.starts(fetched_at)
+        edge = max(0, len(live.segments) - live_edge(channel))
+        restarted = channel.backend.startswith("streamlink")
+        window = [] if restarted else live.segments[:edge]
+        recovered = {"restart": starts[edge] - starts[0] if restarted else 0.0}
+
+        stream_start, video_id = channel.stream_started_at, None
+        if channel.platform == "twitch" and self.archive:
+            try:
+                created, video_id = await asyncio.to_thread(
+                    archive_video, self.gql_url, channel.streamer_name,
+                    channel.config.get("Settings", "TwitchToken", fallback="") or None)
+                stream_start = stream_start or created
+            except (OSError, ValueError) as e:
+                channel.logger.warning(f"Cannot look up the archive VOD: {e}")
+        if stream_start is None and live.event:
+            stream_start = starts[0]
+        gap = starts[0] - stream_start if stream_start is not None else 0.0
+
+        directory, stem = _target(channel, output)
+        path = os.path.join(directory, f"{stem}{BACKFILL_SUFFIX}.ts")
+        partial = os.path.join(directory, f".{stem}{BACKFILL_SUFFIX}.ts.part")
+        window_partial = partial + ".window"
+        try:
+            # Window segments drop out of the live playlist within seconds: those first
+            if window:
+                recovered["window"] = await asyncio.to_thread(
+                    download, window, window_partial, headers, self.workers)
+            if video_id and gap > max(live.target, 1.0):
+                recovered["archive"] = await self._from_archive(channel, video_id, gap, partial, headers)
+            if await asyncio.to_thread(_combine, partial, window_partial, path):
+                finish_file(channel, path, channel.session_record)
+        except OSError as e:
+            channel.logger.warning(f"Backfill failed: {e}")
+        finally:
+            await asyncio.to_thread(_remove, partial, window_partial)
+        self._report(channel, stream_start, starts[edge], recovered, os.path.basename(path))
+
+    async def _from_archive(self, channel, video_id, gap, partial, headers):
+        """Fetch the first ``gap`` seconds of the stream (at most ``max_seconds`` up to it) from its VOD."""
+        try:
+            url = await channel.playlist_url(self.vod_url.format(id=video_id))
+            if url is None:
+                raise OSError("no HLS playlist found")
+            vod, _ = await asyncio.to_thread(load_playlist, url, headers)
+        except (OSError, ValueError) as e:
+            channel.logger.warning(f"Cannot read archive VOD {video_id}: {e}")
+            return 0.0
+        # VOD time 0 is the stream start; the last segment may overlap the live window a little
+        offsets = itertools.accumulate((s.duration for s in vod.segments), initial=0.0)
+        wanted = [s for s, at in zip(vod.segments, offsets) if gap - self.max_seconds - s.duration < at < gap]
+        if not wanted:
+            return 0.0
+        channel.logger.info(f"Backfilling {gap:.0f}s from archive VOD {video_id} ({len(wanted)} segments)")
+        written = await asyncio.to_thread(download, wanted, partial, headers, self.workers)
+        return min(written, gap)
+
+    def _report(self, channel, stream_start, polled_start, recovered, name):
+        total = sum(recovered.values())
+        offset = max(0.0, polled_start - total - stream_start) if stream_start is not None else None
+        sources = ", ".join(f"{seconds:.0f}s {source}" for source, seconds in recovered.items() if seconds > 0)
+        channel.logger.info(
+            (f"Recording starts {offset:.0f}s into the stream" if offset is not None else "Stream start unknown")
+            + (f", {total:.0f}s recovered ({sources})" if total > 0 else ", nothing recovered"))
+        labels = {"platform": channel.platform, "channel": channel.streamer_name}
+        if offset is not None:
+            metrics.START_OFFSET.observe(offset, **labels)
+        for source, seconds in recovered.items():
+            if seconds > 0:
+                metrics.RECOVERED_SECONDS.inc(seconds, source=source, **labels)
+        record = channel.session_record
+        if record is not None:
+            record.recovery(offset, total)
+            if recovered.get("window") or recovered.get("archive"):
+                record.event("backfill", f"{name}: {sources}")
+
+
+def live_edge(channel):
+    """Segments behind the newest a capture starts at without live-restart (``--hls-live-edge`` in ExtraArgs)."""
+    match = LIVE_EDGE_RE.search(getattr(channel, "extra_args", "") or "")
+    return int(match.group(1)) if match else LIVE_EDGE
+
+
+def _target(channel, output):
+    """(directory, session name) the backfill of a capture into ``output`` goes to."""
+    if isinstance(output, str):
+        return os.path.dirname(output), os.path.splitext(os.path.basename(output))[0]
+    directory = os.path.dirname(output.current.path) if output.current is not None else output.fallback_dir
+    return directory, os.path.splitext(output.session)[0]
+
+
+def _combine(partial, window_partial, path):
+    """Blocking: archive part, then window part, as ``path``. False if nothing was fetched."""
+    if os.path.exists(window_partial):
+        with open(window_partial, "rb") as src, open(partial, "ab") as dest:
+            shutil.copyfileobj(src, dest, 8 * 1024 * 1024)
+    if not os.path.exists(partial) or not os.path.getsize(partial):
+        return False
+    os.replace(partial, path)
+    return True
+
+
+def _remove(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
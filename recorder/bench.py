@@ -0,0 +1,446 @@
+"""Offline end-to-end benchmark: the real channel loops against local stand-ins.
+
+Usage::
+
+    python -m recorder.bench --platform twitch --channels 1,4,16,32 --live-seconds 30
+    python -m recorder.bench --platform kick --channels 8 --scenario forbidden
+    python -m recorder.bench --channels 16 --set MidStreamFailover=false --json result.json
+
+The synthetic HLS origin (and, for Twitch, the GQL API) from
+``recorder.standins`` run as child processes, so their CPU is not counted.
+For each channel count N, channels ``bench000``, ``bench001``, ... run their
+unmodified ``record_stream()`` loops in this process, with streamlink/yt-dlp
+exactly as settings.config sets them up (``--set Key=Value`` overrides it),
+recording into a temporary directory:
+
+1. every channel polls while offline for ``--idle-seconds``,
+2. all go live at once and stay live for ``--live-seconds``
+   (``--scenario slow`` delays every stand-in response by ``--delay``,
+   ``--scenario forbidden`` answers the stream with 403 instead),
+3. the streams end and the captures are given time to finish.
+
+With ``--push`` a push stand-in also announces the go-live over a WebSocket
+(``PushDetection``), so the first-byte latency shows how much sooner the
+capture starts than with polling (try a long ``--interval`` to see the gap).
+
+Reported per N: go-live to first byte on disk (median/p90/max) and to the
+first segment fetched from the origin, CPU of this process and all its
+children (streamlink, yt-dlp, curl, ...) as % of one core while idle and
+while recording, RSS added per channel, throughput written vs served, and
+stand-in requests per second. Linux only (reads /proc).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import logging
+import resource
+import tempfile
+import statistics
+import subprocess
+import configparser
+import urllib.request
+
+from . import kick, twitch
+from .admission import AdmissionController
+from .backfill import StartRecovery
+from .common import BASE_DIR, CONFIG_PATH
+from .migrate import parse_size
+from .push import KickPusher, TwitchEventSub
+from .sl_session import StreamlinkSession
+from .twitch_live import TwitchLiveProber
+
+CLOCK_TICKS     = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE       = os.sysconf("SC_PAGE_SIZE")
+SAMPLE_INTERVAL = 0.5
+SCAN_INTERVAL   = 0.1
+SCENARIOS       = ("live", "slow", "forbidden")
+LOG_FORMAT      = '%(asctime)s - %(levelname)s - [%(name)s] %(message)s'
+
+
+# ─── Stand-ins ──────────────────────────────────────────────────────────────────
+class StandinProcess:
+    """``python -m recorder.standins ...`` in a child process, controlled over HTTP."""
+
+    def __init__(self, *args):
+        self.proc = subprocess.Popen([sys.executable, "-m", "recorder.standins", *args],
+                                     cwd=BASE_DIR, stdout=subprocess.PIPE, text=True)
+        line = self.proc.stdout.readline()
+        if " on " not in line:
+            self.proc.kill()
+            raise RuntimeError(f"stand-in {args[0]} did not start")
+        self.url = line.split(" on ", 1)[1].strip()
+        self.base_url = "/".join(self.url.split("/")[:3])
+
+    @property
+    def pid(self):
+        return self.proc.pid
+
+    def _call(self, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=10) as resp:
+            return json.load(resp)
+
+    async def control(self, **changes):
+        return await asyncio.to_thread(self._call, "/_control", changes)
+
+    async def stats(self):
+        return await asyncio.to_thread(self._call, "/_stats")
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+
+# ─── Resource usage ─────────────────────────────────────────────────────────────
+def _proc_stat(pid):
+    """(ppid, cpu seconds incl. reaped children, rss bytes) of a live process, or None."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (OSError, IndexError):
+        return None
+    ticks = sum(int(v) for v in fields[11:15])      # utime, stime, cutime, cstime
+    return int(fields[1]), ticks / CLOCK_TICKS, int(fields[21]) * PAGE_SIZE
+
+
+class ResourceSampler:
+    """CPU time and RSS of this process plus all its descendants, except the ``exclude`` pids."""
+
+    def __init__(self, exclude=()):
+        self.exclude = set(exclude)
+
+    def _descendants(self):
+        stats = {}
+        for entry in os.listdir("/proc"):
+            if entry.isdigit() and (st := _proc_stat(int(entry))) is not None:
+                stats[int(entry)] = st
+        children = {}
+        for pid, (ppid, _, _) in stats.items():
+            children.setdefault(ppid, []).append(pid)
+        found, todo = [], list(children.get(os.getpid(), []))
+        while todo:
+            pid = todo.pop()
+            if pid in self.exclude:
+                continue
+            found.append(stats[pid])
+            todo += children.get(pid, [])
+        return found
+
+    def sample(self):
+        """(cpu seconds, rss bytes) right now."""
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        # Children that already exited and were waited for; live ones are read from /proc
+        gone = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = own.ru_utime + own.ru_stime + gone.ru_utime + gone.ru_stime
+        rss = _proc_stat(os.getpid())[2]
+        for _, child_cpu, child_rss in self._descendants():
+            cpu += child_cpu
+            rss += child_rss
+        return cpu, rss
+
+    async def measure(self, seconds):
+        """Sample for ``seconds``. Returns (cpu % of one core, peak rss bytes)."""
+        cpu0, peak = self.sample()
+        started = time.monotonic()
+        while (left := seconds - (time.monotonic() - started)) > 0:
+            await asyncio.sleep(min(SAMPLE_INTERVAL, left))
+            cpu, rss = await asyncio.to_thread(self.sample)
+            peak = max(peak, rss)
+        return (cpu - cpu0) / (time.monotonic() - started) * 100, peak
+
+
+# ─── Output watching ────────────────────────────────────────────────────────────
+def output_sizes(dirs):
+    """{filename: size} of every capture file in ``dirs``."""
+    sizes = {}
+    for directory in dirs:
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            try:
+                sizes[entry.name] = entry.stat().st_size
+            except OSError:
+                pass
+    return sizes
+
+
+async def watch_first_bytes(names, dirs, since, result):
+    """Fill ``result[name]`` with seconds from ``since`` until ``name``'s first byte is on disk."""
+    while len(result) < len(names):
+        now = time.monotonic()
+        for filename, size in output_sizes(dirs).items():
+            name = filename.split("-", 1)[0]
+            if size and name in names and name not in result:
+                result[name] = now - since
+        await asyncio.sleep(SCAN_INTERVAL)
+
+
+async def wait_settled(dirs, quiet, timeout):
+    """Wait until no capture file has grown for ``quiet`` seconds (or ``timeout``)."""
+    last, quiet_since = None, time.monotonic()
+    deadline = quiet_since + timeout
+    while time.monotonic() < deadline:
+        sizes = output_sizes(dirs)
+        if sizes != last:
+            last, quiet_since = sizes, time.monotonic()
+        elif time.monotonic() - quiet_since >= quiet:
+            return
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+# ─── One round ──────────────────────────────────────────────────────────────────
+def bench_config(origin, gql, workdir, args, push=None):
+    """``args.config`` pointed at the stand-ins; anything that would reach the internet is off."""
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    if not config.has_section("Settings"):
+        config.add_section("Settings")
+    header_file = os.path.join(workdir, "bench.header")
+    open(header_file, "w").close()
+    overrides = {
+        "TwitchToken": "", "ClientID": "", "ExtraArgs": "", "YtDlpArgs": "",
+        "RestartStreamIfBetterQualityIsAvailable": "",
+        "BatchedLiveCheck": "true",
+        "TwitchGQLURL": gql.url if gql else "",
+        "TwitchStreamURL": f"{origin.base_url}/{{name}}/index.m3u8",
+        "KickStreamURL": f"{origin.base_url}/{{name}}/index.m3u8",
+        "TwitchVODURL": f"{origin.base_url}/{{id}}/vod.m3u8",
+        "KickCookieURL": f"{origin.base_url}/",
+        "CurlConfig": shutil.which("curl") or "curl",
+        "CurlHeaders": header_file,
+        "RetryTime": str(args.interval), "RetryTimeKick": str(args.interval),
+        "AdaptivePolling": "false", "BackendMemoryHalfLife": "0",
+        "RecordLocalFirst": "false", "MetricsPort": "0", "MetricsTextfileDir": "",
+        "PushDetection": "false",
+    }
+    if push is not None:
+        ws_url = push.base_url.replace("http://", "ws://")
+        overrides.update({
+            "PushDetection": "true",
+            "TwitchToken": "standin",       # EventSub wants one; the stand-ins don't check it
+            "TwitchEventSubURL": f"{ws_url}/eventsub",
+            "TwitchHelixURL": f"{push.base_url}/helix",
+            "KickPusherURL": f"{ws_url}/app/standin?protocol=7",
+            "KickChannelsURL": f"{push.base_url}/api/v2/channels/{{name}}",
+        })
+    for item in args.set:
+        key, _, value = item.partition("=")
+        overrides[key.strip()] = value.strip()
+    for key, value in overrides.items():
+        config.set("Settings", key, value.replace("%", "%%"))
+    return config
+
+
+def build_channels(platform, names, config, external_dir, fallback_dir, workdir):
+    """Channels wired up the way twitch-record.py / kick-record.py do it (without migrator/remuxer).
+
+    Returns (channels, live prober or None, push listener or None).
+    """
+    admission = AdmissionController.from_config(config, logging.getLogger("admission"),
+                                                path=os.path.join(workdir, "bitrates.json"))
+    recovery = StartRecovery.from_config(config, logging.getLogger("backfill"))
+    if platform == "twitch":
+        prober = TwitchLiveProber.from_config(config)
+        session = StreamlinkSession.from_config(config, logging.getLogger("twitch"))
+        push = TwitchEventSub.from_config(config, logging.getLogger("push.twitch"))
+        channels = [twitch.TwitchChannel(name, config, logging.getLogger(f"twitch.{name}"), external_dir,
+                                         fallback_dir, live_prober=prober, sl_session=session, push=push,
+                                         admission=admission, recovery=recovery)
+                    for name in names]
+        return channels, prober, push
+    cookies_file = os.path.join(workdir, "cookies.txt")
+    session = StreamlinkSession.from_config(config, logging.getLogger("kick"),
+                                            http_headers={"User-Agent": kick.STREAMLINK_UA},
+                                            cookies_file=cookies_file)
+    push = KickPusher.from_config(config, logging.getLogger("push.kick"), cookies_file,
+                                  ids_path=os.path.join(workdir, "kick-channel-ids.json"))
+    channels = [kick.KickChannel(name, config, logging.getLogger(f"kick.{name}"), external_dir, fallback_dir,
+                                 cookies_file, sl_session=session, push=push, admission=admission, recovery=recovery)
+                for name in names]
+    return channels, None, push
+
+
+async def run_round(n, args, origin, gql, push=None):
+    names = [f"bench{i:03d}" for i in range(n)]
+    workdir = tempfile.mkdtemp(prefix="recorder-bench-")
+    dirs = [os.path.join(workdir, "external"), os.path.join(workdir, "fallback")]
+    for directory in dirs:
+        os.makedirs(directory)
+    config = bench_config(origin, gql, workdir, args, push)
+    channels, prober, listener = build_channels(args.platform, names, config, dirs[0], dirs[1], workdir)
+    standins = [s for s in (origin, gql, push) if s is not None]
+
+    sampler = ResourceSampler(exclude=[s.pid for s in standins])
+    _, rss_base = sampler.sample()
+    requests0 = await _requests(standins)
+    tasks = [asyncio.create_task(channel.record_stream()) for channel in channels]
+    if listener is not None:
+        tasks.append(asyncio.create_task(listener.run()))
+    try:
+        # 1. Offline polling
+        idle_cpu, _ = await sampler.measure(args.idle_seconds)
+        requests1 = await _requests(standins)
+        served0 = (await origin.stats())["bytes_served"]
+
+        # 2. Go live
+        state = "forbidden" if args.scenario == "forbidden" else "live"
+        delay = args.delay if args.scenario == "slow" else 0.0
+        for standin in standins:
+            await standin.control(delay=delay)
+        live_at = time.monotonic()
+        await origin.control(channels=names, state=state)
+        if gql is not None:
+            await gql.control(channels=names, state="live")
+        if push is not None:
+            await push.control(channels=names, state="live")
+        first_bytes = {}
+        watcher = asyncio.create_task(watch_first_bytes(set(names), dirs, live_at, first_bytes))
+        live_cpu, rss_peak = await sampler.measure(args.live_seconds)
+        live_seconds = time.monotonic() - live_at
+        watcher.cancel()
+        origin_stats = await origin.stats()
+        requests2 = await _requests(standins)
+
+        # 3. End of stream
+        await origin.control(channels=names, state="ended")
+        if gql is not None:
+            await gql.control(channels=names, state="offline")
+        if push is not None:
+            await push.control(channels=names, state="offline")
+        await wait_settled(dirs, quiet=max(3.0, 2 * args.segment_seconds), timeout=args.drain_seconds)
+        # Both sides counted until the captures have caught up with the end of the stream
+        served = (await origin.stats())["bytes_served"] - served0
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if prober is not None:
+            prober.close()
+        for standin in standins:
+            await standin.control(channels=names, state="offline", delay=0.0)
+
+    written = sum(output_sizes(dirs).values())
+    if args.keep:
+        print(f"  recordings kept in {workdir}", file=sys.stderr)
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = sorted(first_bytes.values())
+    origin_first = sorted(v for k, v in origin_stats["first_segment"].items() if k in names)
+    return {
+        "channels": n,
+        "captured": len(latencies),
+        "first_byte": _summary(latencies),
+        "first_segment": _summary(origin_first),
+        "idle_cpu_percent": idle_cpu,
+        "live_cpu_percent": live_cpu,
+        "rss_per_channel": max(rss_peak - rss_base, 0) / n,
+        "written_bytes_per_sec": written / live_seconds,
+        "served_bytes_per_sec": served / live_seconds,
+        "idle_requests_per_sec": (requests1 - requests0) / args.idle_seconds,
+        "live_requests_per_sec": (requests2 - requests1) / live_seconds,
+    }
+
+
+async def _requests(standins):
+    total = 0
+    for standin in standins:
+        total += (await standin.stats())["requests"]
+    return total
+
+
+def _summary(values):
+    if not values:
+        return None
+    return {
+        "median": statistics.median(values),
+        "p90": values[int(0.9 * (len(values) - 1))],
+        "max": values[-1],
+    }
+
+
+def _report_header(args):
+    print(f"== {args.platform}, scenario {args.scenario}, {args.live_seconds}s live, "
+          f"{args.segment_seconds}s segments at {args.bitrate}bit/s, "
+          f"{'push detection' if args.push else f'polling every {args.interval}s'} ==")
+    print(f"{'N':>4} {'captured':>8}  {'first byte med/p90/max (s)':>26}  {'1st seg':>7}  "
+          f"{'CPU% idle':>9} {'live':>6} {'/ch':>5}  {'RSS/ch':>7}  {'MiB/s wr':>8} {'served':>7}  "
+          f"{'req/s idle':>10} {'live':>6}")
+
+
+def _report_row(row):
+    fb, fs = row["first_byte"], row["first_segment"]
+    lat = f"{fb['median']:6.2f} {fb['p90']:6.2f} {fb['max']:6.2f}" if fb else "-"
+    first_seg = f"{fs['median']:7.2f}" if fs else "-"
+    n = row["channels"]
+    print(f"{n:>4} {row['captured']:>4}/{n:<3}  {lat:>26}  {first_seg:>7}  "
+          f"{row['idle_cpu_percent']:9.1f} {row['live_cpu_percent']:6.1f} {row['live_cpu_percent'] / n:5.1f}  "
+          f"{row['rss_per_channel'] / 1024 ** 2:5.1f}Mi  "
+          f"{row['written_bytes_per_sec'] / 1024 ** 2:8.2f} {row['served_bytes_per_sec'] / 1024 ** 2:7.2f}  "
+          f"{row['idle_requests_per_sec']:10.1f} {row['live_requests_per_sec']:6.1f}")
+
+
+async def run(args):
+    origin = StandinProcess("hls", "--segment-seconds", str(args.segment_seconds), "--bitrate", args.bitrate)
+    gql = StandinProcess("twitch-gql") if args.platform == "twitch" else None
+    push = StandinProcess("push") if args.push else None
+    rows = []
+    try:
+        _report_header(args)
+        for n in args.channels:
+            row = await run_round(n, args, origin, gql, push)
+            rows.append(row)
+            _report_row(row)
+    finally:
+        for standin in (origin, gql, push):
+            if standin is not None:
+                standin.stop()
+    return rows
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the recorder against local HLS/API stand-ins.")
+    parser.add_argument("--platform", choices=("twitch", "kick"), default="twitch")
+    parser.add_argument("--channels", default="1,4,16",
+                        help="comma-separated channel counts, one round each (default: 1,4,16)")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="live")
+    parser.add_argument("--delay", type=float, default=1.0, help="response delay for --scenario slow")
+    parser.add_argument("--idle-seconds", type=float, default=15)
+    parser.add_argument("--live-seconds", type=float, default=30)
+    parser.add_argument("--drain-seconds", type=float, default=30,
+                        help="max wait for captures to finish after the streams end")
+    parser.add_argument("--interval", type=int, default=5, help="RetryTime / RetryTimeKick for the round")
+    parser.add_argument("--push", action="store_true",
+                        help="detect go-live from the push stand-in's events (PushDetection) instead of polling alone")
+    parser.add_argument("--segment-seconds", type=float, default=2.0)
+    parser.add_argument("--bitrate", default="3M", help="stream bitrate in bits/s (K/M suffixes)")
+    parser.add_argument("--config", default=CONFIG_PATH, help="settings.config to start from")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override a [Settings] key (repeatable)")
+    parser.add_argument("--json", metavar="FILE", help="also write the results as JSON")
+    parser.add_argument("--keep", action="store_true", help="keep the recordings of every round")
+    parser.add_argument("-v", "--verbose", action="store_true", help="show the channels' own log output")
+    args = parser.parse_args(argv)
+    args.channels = [int(n) for n in args.channels.split(",") if n.strip()]
+    parse_size(args.bitrate)        # reject a bad value before starting anything
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR, format=LOG_FORMAT)
+    rows = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"platform": args.platform, "scenario": args.scenario, "push": args.push, "rounds": rows},
+                      f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+"""SQLite catalog of recording sessions.
+
+Without it the only record of what was captured is the file names on the
+NAS and in the fallback folders. With ``Catalog=true`` every session that
+produced data is written to ``state/catalog.sqlite`` (``CatalogPath``):
+
+* ``sessions``: platform, channel, start/end/duration, quality, backend
+  (streamlink, yt-dlp), outcome and total bytes, and with
+  ``CaptureFromStart`` how far into the stream the recording starts and how
+  many seconds of the start were recovered,
+* ``files``: every file of a session (segments, ``-resume`` files,
+  quality-upgrade parts) with its current path, kept up to date when the
+  remuxer turns a ``.ts`` into an ``.mp4``, the migrator moves it to the NAS
+  or retention deletes it,
+* ``events``: NAS skipped, mid-stream failover, stalls, 403s, quality upgrades,
+  backfills.
+
+All writes go through one background thread, so neither a busy database
+(several recorder processes share it, in WAL mode) nor a stat() on a slow
+NAS ever holds up the event loop. ``python -m recorder.catalog`` lists and
+shows sessions and imports files that were recorded before the catalog
+existed (or outside of it)::
+
+    python -m recorder.catalog list --channel roflgator --since 7d
+    python -m recorder.catalog show 42
+    python -m recorder.catalog import                       # NAS + fallback dirs of both platforms
+    python -m recorder.catalog import twitch:/mnt/old-disk/Twitch
+"""
+import os
+import re
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+
+from .common import STATE_DIR
+from .migrate import SPOOL_PART_RE
+
+CATALOG_PATH = os.path.join(STATE_DIR, "catalog.sqlite")
+NAME_RE      = re.compile(r"^(?P<channel>.+?)-(?P<ts>\d{8}-\d{6})")     # <streamer>-<YYYYmmdd-HHMMSS>...
+MEDIA_EXTS   = {".ts", ".mp4", ".mkv", ".flv"}
+QUALITY_RE   = re.compile(r"Opening stream: (\S+)")                     # streamlink's log line
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id       INTEGER PRIMARY KEY,
+    platform TEXT NOT NULL,
+    channel  TEXT NOT NULL,
+    name     TEXT NOT NULL,             -- <streamer>-<YYYYmmdd-HHMMSS>, shared by all files of the session
+    started  REAL NOT NULL,
+    ended    REAL,
+    duration REAL,
+    quality  TEXT,
+    backend  TEXT,
+    outcome  TEXT,                      -- NULL while recording
+    bytes    INTEGER NOT NULL DEFAULT 0,
+    source   TEXT NOT NULL DEFAULT 'recorder',
+    start_offset REAL,                  -- seconds into the stream the recording starts (CaptureFromStart)
+    recovered    REAL,                  -- seconds of that start recovered by live-restart/backfill
+    UNIQUE (platform, name)
+);
+CREATE INDEX IF NOT EXISTS sessions_channel ON sessions (channel, started);
+CREATE INDEX IF NOT EXISTS sessions_started ON sessions (started);
+CREATE TABLE IF NOT EXISTS files (
+    id         INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    path       TEXT NOT NULL UNIQUE,
+    bytes      INTEGER NOT NULL,
+    mtime      REAL
+);
+CREATE INDEX IF NOT EXISTS files_session ON files (session_id);
+CREATE TABLE IF NOT EXISTS events (
+    id         INTEGER PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    time       REAL NOT NULL,
+    kind       TEXT NOT NULL,
+    detail     TEXT
+);
+CREATE INDEX IF NOT EXISTS events_session ON events (session_id);
+"""
+# Columns added after the first release: (table, column, type), added to older databases on open
+ADDED_COLUMNS = (
+    ("sessions", "start_offset", "REAL"),
+    ("sessions", "recovered", "REAL"),
+)
+
+UPDATE_BYTES = "UPDATE sessions SET bytes = (SELECT COALESCE(SUM(bytes), 0) FROM files WHERE session_id = ?) WHERE id = ?"
+
+
+def parse_quality(output):
+    """Quality streamlink reported opening (e.g. ``1080p60``), or None."""
+    match = QUALITY_RE.search(output or "")
+    return match.group(1) if match else None
+
+
+class SessionRecord:
+    """One capture session of a channel. Only written to the catalog once it has produced data.
+
+    Every method just queues work for the catalog's writer thread, so they
+    are safe to call from the event loop and from the spool's threads. The
+    attributes ``quality`` and ``backend`` are read when the session finishes.
+    """
+
+    def __init__(self, catalog, platform, channel, filename, started=None):
+        self.catalog  = catalog
+        self.platform = platform
+        self.channel  = channel
+        self.name     = os.path.splitext(filename)[0]
+        self.started  = started or time.time()
+        self.quality  = None
+        self.backend  = None
+        self.id       = None        # set by the writer thread on the first data
+        self._events  = []          # events from before that
+
+    def begin(self, when=None):
+        """The first data has arrived (at ``when``)."""
+        self.catalog.submit(lambda conn: self._begin(conn, when))
+
+    def event(self, kind, detail=""):
+        when = time.time()
+        self.catalog.submit(lambda conn: self._event(conn, when, kind, detail))
+
+    def add_file(self, path):
+        """A file of this session is finished (or has a new segment); empty or missing files are ignored."""
+        if path:
+            self.catalog.submit(lambda conn: self._file(conn, path))
+
+    def recovery(self, start_offset, recovered):
+        """Where the recording starts in the stream (None if unknown) and the seconds recovered before that."""
+        self.catalog.submit(lambda conn: self._recovery(conn, start_offset, recovered))
+
+    def finish(self, outcome):
+        ended, quality, backend = time.time(), self.quality, self.backend
+        self.catalog.submit(lambda conn: self._finish(conn, ended, outcome, quality, backend))
+
+    # ─── Writer thread ──────────────────────────────────────────────────────────
+    def _begin(self, conn, when=None):
+        if self.id is not None:
+            return
+        self.started = when or self.started
+        conn.execute(
+            "INSERT OR IGNORE INTO sessions (platform, channel, name, started, quality, backend) VALUES (?, ?, ?, ?, ?, ?)",
+            (self.platform, self.channel, self.name, self.started, self.quality, self.backend))
+        self.id = conn.execute("SELECT id FROM sessions WHERE platform = ? AND name = ?",
+                               (self.platform, self.name)).fetchone()[0]
+        for event in self._events:
+            self._event(conn, *event)
+        self._events = []
+
+    def _event(self, conn, when, kind, detail):
+        if self.id is None:
+            self._events.append((when, kind, detail))
+            return
+        conn.execute("INSERT INTO events (session_id, time, kind, detail) VALUES (?, ?, ?, ?)",
+                     (self.id, when, kind, detail))
+
+    def _file(self, conn, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        if not st.st_size:
+            return
+        self._begin(conn)
+        conn.execute(
+            "INSERT INTO files (session_id, path, bytes, mtime) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET bytes = excluded.bytes, mtime = excluded.mtime",
+            (self.id, os.path.abspath(path), st.st_size, st.st_mtime))
+        conn.execute(UPDATE_BYTES, (self.id, self.id))
+
+    def _recovery(self, conn, start_offset, recovered):
+        self._begin(conn)
+        conn.execute("UPDATE sessions SET start_offset = ?, recovered = ? WHERE id = ?",
+                     (start_offset, recovered, self.id))
+
+    def _finish(self, conn, ended, outcome, quality, backend):
+        if self.id is None:
+            return          # nothing was recorded
+        conn.execute(
+            "UPDATE sessions SET ended = ?, duration = ? - started, outcome = ?, "
+            "quality = COALESCE(?, quality), backend = COALESCE(?, backend) WHERE id = ?",
+            (ended, ended, outcome, quality, backend, self.id))
+
+
+class Catalog:
+    def __init__(self, path, logger):
+        self.path    = path
+        self.logger  = logger
+        self._lock   = threading.Lock()
+        self._queue  = queue.Queue()
+        self._thread = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+            for table, column, kind in ADDED_COLUMNS:
+                if column in {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}:
+                    continue
+                try:
+                    self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+                except sqlite3.OperationalError as e:
+                    if "duplicate column" not in str(e):      # another recorder process was first
+                        raise
+
+    @classmethod
+    def from_config(cls, config, logger, migrator=None, remuxer=None, storage=None):
+        """Return a catalog if ``Catalog`` is enabled, else None.
+
+        The migrator, remuxer and storage manager report moved, remuxed and
+        deleted files to it.
+        """
+        if not config.getboolean("Settings", "Catalog", fallback=False):
+            return None
+        catalog = cls(config.get("Settings", "CatalogPath", fallback="") or CATALOG_PATH, logger)
+        for component in (migrator, remuxer, storage):
+            if component is not None:
+                component.catalog = catalog
+        atexit.register(catalog.close)
+        return catalog
+
+    def session(self, platform, channel, filename, started=None):
+        return SessionRecord(self, platform, channel, filename, started)
+
+    # ─── Writer thread ──────────────────────────────────────────────────────────
+    def submit(self, job):
+        """Run ``job(conn)`` in a transaction on the writer thread."""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="catalog", daemon=True)
+                    self._thread.start()
+        self._queue.put(job)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                with self._lock, self._conn:
+                    job(self._conn)
+            except (sqlite3.Error, OSError) as e:
+                self.logger.warning(f"Catalog update failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        """Block until every queued update is written."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    # ─── File changes ───────────────────────────────────────────────────────────
+    def move_file(self, src, dest):
+        """``src`` is now ``dest`` (migrated to the NAS, or remuxed to ``.mp4``)."""
+        def job(conn):
+            try:
+                st = os.stat(dest)
+            except OSError:
+                return
+            row = conn.execute("SELECT session_id FROM files WHERE path = ?", (os.path.abspath(src),)).fetchone()
+            if row is None:
+                return
+            conn.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(dest),))
+            conn.execute("UPDATE files SET path = ?, bytes = ?, mtime = ? WHERE path = ?",
+                         (os.path.abspath(dest), st.st_size, st.st_mtime, os.path.abspath(src)))
+            conn.execute(UPDATE_BYTES, (row[0], row[0]))
+        self.submit(job)
+
+    def remove_file(self, path):
+        """``path`` was deleted (retention)."""
+        def job(conn):
+            row = conn.execute("SELECT session_id FROM files WHERE path = ?", (os.path.abspath(path),)).fetchone()
+            if row is None:
+                return
+            conn.execute("DELETE FROM files WHERE path = ?", (os.path.abspath(path),))
+            conn.execute(UPDATE_BYTES, (row[0], row[0]))
+            conn.execute("INSERT INTO events (session_id, time, kind, detail) VALUES (?, ?, 'deleted', ?)",
+                         (row[0], time.time(), path))
+        self.submit(job)
+
+    # ─── Import ─────────────────────────────────────────────────────────────────
+    def import_dir(self, platform, directory):
+        """Blocking: add recordings in ``directory`` the catalog doesn't know yet. Returns the number of files added or updated.
+
+        Files already in the catalog with the same size and mtime are
+        skipped without touching the database, so re-running it is cheap.
+        Sessions created here get their end time from the newest file.
+        """
+        directory = os.path.abspath(directory)
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            self.logger.warning(f"Cannot import {directory}: {e}")
+            return 0
+        prefix = directory + os.sep
+        with self._lock:
+            known = {path: (size, mtime) for path, size, mtime in self._conn.execute(
+                "SELECT path, bytes, mtime FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))}
+
+        changed = []
+        for entry in entries:
+            stem, ext = os.path.splitext(entry.name)
+            match = NAME_RE.match(entry.name)
+            if (ext not in MEDIA_EXTS or entry.name.startswith(".") or match is None
+                    or SPOOL_PART_RE.search(stem)):
+                continue
+            try:
+                st = entry.stat()
+                started = time.mktime(time.strptime(match.group("ts"), "%Y%m%d-%H%M%S"))
+            except (OSError, ValueError):
+                continue
+            if not st.st_size or known.get(entry.path) == (st.st_size, st.st_mtime):
+                continue
+            changed.append((match.group("channel"), match.group(0), started, entry.path, st))
+
+        with self._lock, self._conn:
+            sessions = set()
+            for channel, name, started, path, st in changed:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO sessions (platform, channel, name, started, source) VALUES (?, ?, ?, ?, 'import')",
+                    (platform, channel, name, started))
+                session_id = self._conn.execute("SELECT id FROM sessions WHERE platform = ? AND name = ?",
+                                                (platform, name)).fetchone()[0]
+                self._conn.execute(
+                    "INSERT INTO files (session_id, path, bytes, mtime) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (path) DO UPDATE SET bytes = excluded.bytes, mtime = excluded.mtime",
+                    (session_id, path, st.st_size, st.st_mtime))
+                sessions.add(session_id)
+            for session_id in sessions:
+                self._conn.execute(UPDATE_BYTES, (session_id, session_id))
+                self._conn.execute(
+                    "UPDATE sessions SET ended = (SELECT MAX(mtime) FROM files WHERE session_id = sessions.id), "
+                    "duration = (SELECT MAX(mtime) FROM files WHERE session_id = sessions.id) - started "
+                    "WHERE id = ? AND source = 'import'", (session_id,))
+        return len(changed)
+
+    # ─── Queries ────────────────────────────────────────────────────────────────
+    def sessions(self, channel=None, platform=None, since=None, until=None, limit=50):
+        """Newest first: rows of (id, platform, channel, started, duration, bytes, quality, backend, outcome, start_offset, files, location)."""
+        where, params = [], []
+        for clause, value in (("channel = ?", channel), ("platform = ?", platform),
+                              ("started >= ?", since), ("started < ?", until)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        sql = (
+            "SELECT s.id, s.platform, s.channel, s.started, s.duration, s.bytes, s.quality, s.backend, s.outcome, s.start_offset, "
+            "(SELECT COUNT(*) FROM files WHERE session_id = s.id), "
+            "(SELECT path FROM files WHERE session_id = s.id ORDER BY path LIMIT 1) "
+            f"FROM sessions s {'WHERE ' + ' AND '.join(where) if where else ''} "
+            "ORDER BY s.started DESC LIMIT ?"
+        )
+        with self._lock:
+            return self._conn.execute(sql, params + [limit]).fetchall()
+
+    def session_detail(self, session_id):
+        """(session row as dict, [(path, bytes)], [(time, kind, detail)]), or None."""
+        with self._lock:
+            cur = self._conn.execute("SELECT * FROM sessions WHERE id = ?", (session_id,))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            session = dict(zip((d[0] for d in cur.description), row))
+            files = self._conn.execute("SELECT path, bytes FROM files WHERE session_id = ? ORDER BY path",
+                                       (session_id,)).fetchall()
+            events = self._conn.execute("SELECT time, kind, detail FROM events WHERE session_id = ? ORDER BY time",
+                                        (session_id,)).fetchall()
+        return session, files, events
+
+
+# ─── CLI ────────────────────────────────────────────────────────────────────────
+def _parse_time(value):
+    """``7d`` / ``12h`` ago, or a date/time like ``2026-03-01`` or ``2026-03-01 19:00``."""
+    if value is None:
+        return None
+    units = {"m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+    if value[:-1].isdigit() and value[-1] in units:
+        return time.time() - int(value[:-1]) * units[value[-1]]
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    raise ValueError(f"Cannot parse time {value!r}")
+
+
+def _fmt_time(ts):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts)) if ts else "-"
+
+
+def _fmt_duration(seconds):
+    if seconds is None:
+        return "-"
+    return f"{int(seconds // 3600)}:{int(seconds % 3600 // 60):02d}"
+
+
+def main(argv=None):
+    import argparse
+    import logging
+
+    from . import kick, twitch
+    from .common import CONFIG_PATH, load_config
+
+    parser = argparse.ArgumentParser(description="Query the recording catalog.")
+    parser.add_argument("--db", help=f"catalog file (default: CatalogPath from settings.config or {CATALOG_PATH})")
+    sub = parser.add_subparsers(dest="command", required=True)
+    lst = sub.add_parser("list", help="list sessions, newest first")
+    lst.add_argument("-c", "--channel")
+    lst.add_argument("-p", "--platform", choices=("twitch", "kick"))
+    lst.add_argument("--since", help="e.g. 7d, 12h or 2026-03-01")
+    lst.add_argument("--until")
+    lst.add_argument("-n", "--limit", type=int, default=50)
+    show = sub.add_parser("show", help="files and events of one session")
+    show.add_argument("id", type=int)
+    imp = sub.add_parser("import", help="add existing recordings the catalog doesn't know yet")
+    imp.add_argument("dirs", nargs="*", metavar="PLATFORM:DIR",
+                     help="directories to import (default: NAS and fallback dirs of both platforms)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logger = logging.getLogger("catalog")
+    path = args.db
+    if path is None and os.path.isfile(CONFIG_PATH):
+        path = load_config(logger).get("Settings", "CatalogPath", fallback="")
+    catalog = Catalog(path or CATALOG_PATH, logger)
+
+    if args.command == "import":
+        dirs = [spec.split(":", 1) for spec in args.dirs] or [
+            ("twitch", twitch.EXTERNAL_DIR), ("twitch", twitch.FALLBACK_DIR),
+            ("kick", kick.EXTERNAL_DIR), ("kick", kick.FALLBACK_DIR),
+        ]
+        for platform, directory in dirs:
+            added = catalog.import_dir(platform, directory)
+            print(f"{platform}:{directory}: {added} file(s) added or updated")
+
+    elif args.command == "list":
+        try:
+            since, until = _parse_time(args.since), _parse_time(args.until)
+        except ValueError as e:
+            parser.error(str(e))
+        rows = catalog.sessions(args.channel, args.platform, since, until, args.limit)
+        print(f"{'ID':>6}  {'platform':8} {'channel':20} {'started':16} {'length':>9} {'GiB':>7}  "
+              f"{'quality':10} {'backend':10} {'outcome':8} {'from':>6} location")
+        for (sid, platform, channel, started, duration, size, quality, backend, outcome, start_offset,
+             files, first) in rows:
+            location = os.path.dirname(first) if first else "-"
+            if files > 1:
+                location += f" ({files} files)"
+            offset = f"+{start_offset:.0f}s" if start_offset is not None else "-"
+            print(f"{sid:>6}  {platform:8} {channel:20} {_fmt_time(started):16} {_fmt_duration(duration):>9} "
+                  f"{size / 1024 ** 3:7.2f}  {quality or '-':10} {backend or '-':10} {outcome or '-':8} {offset:>6} "
+                  f"{location}")
+
+    elif args.command == "show":
+        detail = catalog.session_detail(args.id)
+        if detail is None:
+            parser.exit(1, f"No session {args.id}\n")
+        session, files, events = detail
+        for key, value in session.items():
+            if key in ("started", "ended"):
+                value = _fmt_time(value)
+            elif key == "duration" and value is not None:
+                value = _fmt_duration(value)
+            elif key in ("start_offset", "recovered") and value is not None:
+                value = f"{value:.1f}s"
+            print(f"{key:>12}: {value if value is not None else '-'}")
+        print("       files:")
+        for path, size in files:
+            print(f"              {path} ({size / 1024 ** 2:.0f} MiB)")
+        if events:
+            print("      events:")
+            for when, kind, detail in events:
+                print(f"              {_fmt_time(when)} {kind} {detail or ''}")
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
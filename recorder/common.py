@@ -0,0 +1,163 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import configparser
+from logging.handlers import RotatingFileHandler
+
+from . import logs, metrics
+
+# ─── Paths ──────────────────────────────────────────────────────────────────────
+BASE_DIR    = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_PATH = os.path.join(BASE_DIR, "settings.config")
+STATE_DIR   = os.path.join(BASE_DIR, "state")
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+def get_timestamp():
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+def ensure_dirs(fallback_dir, log_dir):
+    """Create the fallback and log directories. Exits if the fallback directory cannot be created."""
+    for path in (fallback_dir, log_dir):
+        try:
+            os.makedirs(path, exist_ok=True)
+        except Exception as e:
+            if path == log_dir:
+                print(f"[WARNING] Cannot create log directory {path}: {e} — continuing without file logging.")
+            else:
+                print(f"[ERROR] Cannot create directory {path}: {e}")
+                sys.exit(1)
+
+
+def setup_logging(log_file, level=logging.INFO, file_level=None, console_level=None, fmt=LOG_FORMAT,
+                  config_path=CONFIG_PATH):
+    """Log through the root logger's queue to a rotating file and stdout (see ``recorder.logs``).
+
+    ``LogFormat`` and the secrets to mask are read from ``config_path`` right
+    away, so they apply from the first line.
+    """
+    handlers = []
+
+    # Rotating file handler: max 1MB per file, 3 backups
+    try:
+        fh = RotatingFileHandler(log_file, maxBytes=1_000_000, backupCount=3)
+        if file_level is not None:
+            fh.setLevel(file_level)
+        handlers.append(fh)
+    except Exception as e:
+        print(f"[WARNING] Could not open rotating log file {log_file}: {e}")
+
+    # Console handler
+    ch = logging.StreamHandler(sys.stdout)
+    if console_level is not None:
+        ch.setLevel(console_level)
+    handlers.append(ch)
+
+    pipeline = logs.start(handlers, level, fmt)
+    config = configparser.ConfigParser()
+    try:
+        config.read(config_path)
+    except configparser.Error:
+        pass                                # load_config reports it
+    pipeline.apply_config(config)
+    return logging.getLogger()
+
+
+def load_config(logger, path=CONFIG_PATH):
+    if not os.path.isfile(path):
+        logger.error(f"Config not found: {path}")
+        sys.exit(1)
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+def pick_target_path(external_dir, fallback_dir, filename, logger, fallback_msg="NAS unavailable, using Fallback"):
+    """Determine the best available path BEFORE starting a capture."""
+    # We check os.path.exists and os.access to see if the NAS is actually there
+    if os.path.exists(external_dir) and os.access(external_dir, os.W_OK):
+        target_path = os.path.join(external_dir, filename)
+        logger.info(f"→ Primary (NAS): {target_path}")
+    else:
+        target_path = os.path.join(fallback_dir, filename)
+        logger.warning(f"→ {fallback_msg}: {target_path}")
+    return target_path
+
+
+async def run_all(*coros):
+    """Run the given coroutines (None entries are skipped) until all of them finish."""
+    await asyncio.gather(*(c for c in coros if c is not None))
+
+
+async def spawn(cmd, **kwargs):
+    """Start ``cmd`` (shell string or argv list) as an asyncio subprocess.
+
+    Shell strings are run with ``exec`` so the shell is replaced by the
+    command: terminating the returned process then stops streamlink/yt-dlp
+    itself rather than only the ``sh`` wrapper around it.
+    """
+    start = time.monotonic()
+    if isinstance(cmd, str):
+        proc = await asyncio.create_subprocess_shell(f"exec {cmd}", **kwargs)
+        command = cmd.split(None, 1)[0]
+    else:
+        proc = await asyncio.create_subprocess_exec(*cmd, **kwargs)
+        command = cmd[0]
+    metrics.SPAWN_SECONDS.observe(time.monotonic() - start, command=os.path.basename(command))
+    return proc
+
+
+async def watch_output(proc, stream, abort_on=None, chunk_size=4096, armed=None):
+    """Collect ``stream`` while ``proc`` runs, terminating it as soon as the output matches ``abort_on``.
+
+    ``abort_on`` is a compiled bytes regex. The stream is read in chunks rather
+    than lines since progress output (yt-dlp) is ``\\r``-separated. ``armed``
+    (an async callable) is asked on a match: once it returns false, e.g.
+    after the first byte was recorded, ``abort_on`` is dropped for good.
+    """
+    data = bytearray()
+    while chunk := await stream.read(chunk_size):
+        # Re-scan a little of the previous chunk in case a match straddles the boundary
+        scan_from = max(0, len(data) - 256)
+        data += chunk
+        if abort_on is not None and proc.returncode is None and abort_on.search(data, scan_from):
+            if armed is None or await armed():
+                proc.terminate()
+            abort_on = None
+    return bytes(data)
+
+
+async def run_child(cmd, capture_output=False, abort_on=None, armed=None):
+    """Run a child process without blocking the event loop.
+
+    ``cmd`` is either a shell string or an argv list. Returns
+    ``(returncode, stdout, stderr)``; the output strings are empty unless
+    ``capture_output`` or ``abort_on`` is set. With ``abort_on`` (a bytes regex)
+    the output is watched as it comes and the child is terminated on the first
+    match instead of running to its own end (while ``armed``, see
+    ``watch_output``). If the awaiting task is cancelled
+    the child is terminated instead of being left running as an orphan.
+    """
+    pipe = asyncio.subprocess.PIPE if capture_output or abort_on is not None else None
+    proc = await spawn(cmd, stdout=pipe, stderr=pipe)
+    try:
+        if abort_on is None:
+            stdout, stderr = await proc.communicate()
+        else:
+            stdout, stderr = await asyncio.gather(watch_output(proc, proc.stdout, abort_on, armed=armed),
+                                                  watch_output(proc, proc.stderr, abort_on, armed=armed))
+            await proc.wait()
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.terminate()
+            await proc.wait()
+        raise
+    return (
+        proc.returncode,
+        (stdout or b"").decode(errors="replace"),
+        (stderr or b"").decode(errors="replace"),
+    )
@@ -0,0 +1,96 @@
+"""Rebuild a full recording from a segmented session.
+
+``python -m recorder.concat <name>.manifest.json`` finds the session's
+segments (next to the manifest, or in ``--search`` directories, e.g. the
+fallback folder) and joins them in order, after the session's
+``<name>-backfill.ts`` if ``CaptureFromStart`` recovered the stream start.
+``.ts`` segments are simply concatenated; once the remuxer has turned them
+into ``.mp4`` they are joined with ffmpeg's concat demuxer instead (stream
+copy, no re-encode).
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+
+from .backfill import BACKFILL_SUFFIX
+from .remux import MP4_EXT
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def locate(name, dirs):
+    """Path of segment ``name`` (or its remuxed ``.mp4``) in the first dir that has it."""
+    candidates = [name, os.path.splitext(name)[0] + MP4_EXT]
+    for directory in dirs:
+        for candidate in candidates:
+            path = os.path.join(directory, candidate)
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def concat_bytes(paths, out):
+    with open(out, "wb") as dst:
+        for path in paths:
+            with open(path, "rb") as src:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def concat_ffmpeg(paths, out, ffmpeg="ffmpeg"):
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as listing:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            listing.write(f"file '{escaped}'\n")
+    try:
+        subprocess.run([ffmpeg, "-hide_banner", "-loglevel", "error", "-y", "-f", "concat", "-safe", "0",
+                        "-i", listing.name, "-map", "0:v?", "-map", "0:a?", "-c", "copy", "-movflags", "+faststart",
+                        out], check=True)
+    finally:
+        os.remove(listing.name)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Join the segments of a recorded session back into one file.")
+    parser.add_argument("manifest", help="<name>.manifest.json written while recording")
+    parser.add_argument("-o", "--output", help="output file (default: the session name next to the manifest)")
+    parser.add_argument("--search", action="append", default=[], metavar="DIR",
+                        help="also look for segments here (repeatable)")
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    args = parser.parse_args(argv)
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    dirs = [os.path.dirname(os.path.abspath(args.manifest))] + args.search
+
+    paths, missing = [], []
+    for segment in manifest["segments"]:
+        path = locate(segment["file"], dirs)
+        (paths if path else missing).append(path or segment["file"])
+    if missing:
+        sys.exit(f"Missing segments: {', '.join(missing)}")
+    backfill = locate(f"{os.path.splitext(manifest['session'])[0]}{BACKFILL_SUFFIX}.ts", dirs)
+    if backfill:
+        paths.insert(0, backfill)
+    if not manifest.get("complete"):
+        print("Warning: the session was still recording when this manifest was written", file=sys.stderr)
+
+    exts = {os.path.splitext(p)[1] for p in paths}
+    output = args.output or os.path.join(dirs[0], manifest["session"])
+    if MP4_EXT in exts:
+        # All or some segments already remuxed: MP4 can't be joined byte-wise
+        output = os.path.splitext(output)[0] + MP4_EXT
+        concat_ffmpeg(paths, output, args.ffmpeg)
+    else:
+        concat_bytes(paths, output)
+
+    duration = sum(s.get("duration", 0) for s in manifest["segments"])
+    print(f"Joined {len(manifest['segments'])} segments ({duration / 60:.1f} min{' + backfill' if backfill else ''}) into {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Shared Kick cookie jar.
+
+All Kick channels (one process each, or many inside the supervisor) read the
+same Netscape ``kickcomcookies.txt``. ``CookieJar`` keeps refreshing it cheap
+and safe:
+
+* expiry is read from the jar itself and the jar is refreshed
+  ``CookieRefreshMargin`` seconds before its first cookie runs out, instead
+  of waiting for a 403;
+* only one refresh runs at a time, across processes too (``flock`` on
+  ``<jar>.lock``). Channels that waited for it reuse the new jar instead of
+  refreshing again;
+* a refresh writes to a temp file that is renamed over the jar, so nobody
+  ever reads a half-written one.
+"""
+import os
+import time
+import fcntl
+import shutil
+import asyncio
+import contextlib
+
+from . import metrics
+from .common import run_child
+from .logs import argv
+
+LOCK_EXT = ".lock"
+HTTPONLY_PREFIX = "#HttpOnly_"
+
+_local_locks = {}       # jar path -> asyncio.Lock, for channels sharing one process
+
+
+def parse_jar(path):
+    """``[(domain, name, expires), ...]`` from a Netscape cookie jar; [] if missing."""
+    cookies = []
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(HTTPONLY_PREFIX):
+                    line = line[len(HTTPONLY_PREFIX):]
+                elif line.startswith("#") or not line.strip():
+                    continue
+                fields = line.rstrip("\r\n").split("\t")
+                if len(fields) != 7:
+                    continue
+                try:
+                    expires = int(fields[4])
+                except ValueError:
+                    continue
+                cookies.append((fields[0], fields[5], expires))
+    except OSError:
+        return []
+    return cookies
+
+
+class CookieJar:
+    """Expiry tracking and single-flight refresh for one cookie file."""
+
+    def __init__(self, path, logger, refresh_margin=300, max_age=3600):
+        self.path           = path
+        self.logger         = logger
+        self.refresh_margin = refresh_margin
+        self.max_age        = max_age
+        self._retry_after   = 0      # no proactive refresh until then after one failed
+
+    @classmethod
+    def from_config(cls, config, logger, path):
+        return cls(path, logger,
+                   refresh_margin=config.getint("Settings", "CookieRefreshMargin", fallback=300),
+                   max_age=config.getint("Settings", "CookieMaxAge", fallback=3600))
+
+    def mtime(self):
+        try:
+            return os.path.getmtime(self.path)
+        except OSError:
+            return 0
+
+    def expires_at(self):
+        """When the jar goes stale: its first cookie expiry, or ``max_age`` after it was written."""
+        written = self.mtime()
+        if not written:
+            return 0
+        # Cookies already expired when the jar was written are deletions, not state
+        expiries = [e for _, _, e in parse_jar(self.path) if e > written]
+        return min(expiries + [written + self.max_age])
+
+    def needs_refresh(self, now=None):
+        now = time.time() if now is None else now
+        return now >= self.expires_at() - self.refresh_margin
+
+    async def ensure_fresh(self, method, build_cmd):
+        """Refresh ahead of expiry so captures don't have to hit a 403 first."""
+        if self.needs_refresh() and time.time() >= self._retry_after:
+            self.logger.info("Kick cookies are about to expire, refreshing")
+            if not await self.refresh(method, build_cmd):
+                self._retry_after = time.time() + self.refresh_margin
+
+    async def refresh(self, method, build_cmd, since=None):
+        """Run ``build_cmd(tmp_path)`` to refresh the jar, unless someone else just did.
+
+        ``since`` is when the caller last used the jar (e.g. the start of the
+        attempt that got a 403). If the jar was rewritten after that, the
+        caller's problem has already been dealt with and it is reused as is.
+        Returns True when the jar is newer than ``since``.
+        """
+        since = time.time() if since is None else since
+        lock = _local_locks.setdefault(os.path.realpath(self.path), asyncio.Lock())
+        async with lock:
+            lock_file = await asyncio.to_thread(self._acquire)
+            try:
+                if self.mtime() > since:
+                    self.logger.info("Kick cookies were just refreshed by another channel, reusing them")
+                    return True
+                return await self._run(method, build_cmd)
+            finally:
+                lock_file.close()
+
+    def _acquire(self):
+        lock_file = open(self.path + LOCK_EXT, "a")
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    async def _run(self, method, build_cmd):
+        metrics.COOKIE_REFRESHES.inc(method=method)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        # yt-dlp reads and updates its jar; curl -c just overwrites it
+        if os.path.exists(self.path):
+            shutil.copy2(self.path, tmp)
+        before = os.path.getmtime(tmp) if os.path.exists(tmp) else 0
+
+        cmd = build_cmd(tmp)
+        self.logger.debug(f"Refreshing cookies with {method}", extra={"cmd": argv(cmd)})
+        returncode, _, stderr = await run_child(cmd, capture_output=True)
+
+        written = os.path.exists(tmp) and os.path.getmtime(tmp) != before
+        if written and parse_jar(tmp):
+            os.replace(tmp, self.path)
+            self.logger.info(f"Kick cookies refreshed via {method}")
+            return True
+
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        self.logger.error(f"Cookie refresh via {method} failed (Code {returncode}): {stderr.strip()[:200]}")
+        return False
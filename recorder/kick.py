@@ -0,0 +1,352 @@
+import os
+import re
+import time
+import asyncio
+import contextlib
+from urllib.parse import urlsplit
+
+from . import metrics
+from .admission import AdmissionHandover, CaptureLimits, channel_priority
+from .backends import BackendMemory
+from .catalog import parse_quality
+from .common import BASE_DIR, STATE_DIR, get_timestamp, run_child
+from .logs import ChannelLogger, argv
+from .output import before_first_byte, bytes_written
+from .cookies import CookieJar
+from .push import wait_for_poll
+from .remux import TS_EXT, capture_ext
+from .scheduler import PollScheduler
+from .simulcast import SimulcastHandover
+from .sl_session import pick_stream
+from .spool import SpoolWriter, pump_child, reconcile_pending
+from .storage import StorageFull
+from .watchdog import CaptureWatchdog, run_watched
+
+# ─── Paths ──────────────────────────────────────────────────────────────────────
+LOG_DIR      = "/tmp/kick-record-logs"
+EXTERNAL_DIR = "/mnt/NAS/Videos/Kick"
+FALLBACK_DIR = os.path.join(BASE_DIR, "kick")
+COOKIES_FILE = os.path.join(BASE_DIR, "kickcomcookies.txt")
+
+# ``KickStreamURL`` / ``KickCookieURL`` override these, e.g. to point at the local stand-ins
+STREAM_URL = "https://www.kick.com/{name}"
+COOKIE_URL = "https://kick.com/"
+
+BACKENDS = ("streamlink", "yt-dlp")   # default order
+# Seen while the child is still running and before it recorded anything: stop
+# it instead of letting it retry. Later on a 403 is one fragment, not a block
+FORBIDDEN_RE = re.compile(rb"403 client error|http error 403|\bforbidden\b", re.IGNORECASE)
+
+STREAMLINK_UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/145.0.0.0 Safari/537.36"
+
+
+def ytdlp_format(quality):
+    """yt-dlp ``-f`` for a streamlink quality spec: ``720p60,720p,worst`` -> at most 720 lines, else the smallest."""
+    name = quality.split(",", 1)[0].strip().lower()
+    if name in ("best", "source"):
+        return ""
+    height = re.match(r"(\d{3,4})p", name)
+    return f'-f "best[height<={height.group(1)}]/worst"' if height else "-f worst"
+
+
+class KickChannel:
+    """Recording loop for a single Kick channel: streamlink first, yt-dlp on 403 (or whichever last worked)."""
+
+    platform = "kick"
+
+    def __init__(self, streamer_name, config, logger, external_dir=EXTERNAL_DIR, fallback_dir=FALLBACK_DIR,
+                 cookies_file=COOKIES_FILE, sl_session=None, migrator=None, remuxer=None, storage=None,
+                 catalog=None, push=None, simulcast=None, admission=None, recovery=None):
+        self.streamer_name = streamer_name
+        self.config        = config
+        self.logger        = ChannelLogger(logger, {"channel": streamer_name, "platform": self.platform})
+        self.sl_session    = sl_session
+        self.migrator      = migrator
+        self.remuxer       = remuxer
+        self.storage       = storage
+        self.catalog       = catalog
+        self.push          = push
+        self.simulcast     = simulcast
+        self.admission     = admission
+        self.recovery      = recovery
+        self.live_restart  = False              # set by StartRecovery.guard until the session's first data
+        self.backend       = None               # of the running capture attempt
+        self.quality       = "best"             # lowered for a simulcast backup or by admission control
+        self.session_record = None
+        self.retiring      = False              # set by retire(): stop polling, finish the current capture
+        self.capturing     = False
+        self.external_dir  = external_dir
+        self.fallback_dir  = fallback_dir
+        self.cookies_file  = cookies_file
+        self.cookies       = CookieJar.from_config(config, self.logger, cookies_file)
+        self.streamlink_ua = STREAMLINK_UA
+        self.backends = BackendMemory.from_config(
+            config, BACKENDS, os.path.join(STATE_DIR, f"backends-kick-{streamer_name}.json"))
+        # Set from a go-live event; without push detection the capture start stands in for it
+        self.stream_started_at = None
+        self.apply_config(config)
+        if push is not None:
+            push.watch(streamer_name)
+
+    def apply_config(self, config):
+        """(Re)read the settings kept in attributes; called again when settings.config changes."""
+        streamer_name = self.streamer_name
+        self.priority      = channel_priority(config, self.platform, streamer_name)
+        self.limits        = CaptureLimits.from_config(config)
+        self.ext           = capture_ext(config)
+        self.watchdog      = CaptureWatchdog.from_config(
+            config, self.logger, labels={"platform": self.platform, "channel": streamer_name})
+
+        self.retry_time    = config.getint("Settings", "RetryTimeKick", fallback=120)
+        self.curl_bin      = config.get("Settings", "CurlConfig", fallback="/usr/bin/curl")
+        self.curl_headers  = config.get("Settings", "CurlHeaders", fallback=None)
+        self.ytdlp_args    = config.get("Settings", "YtDlpArgs", fallback="")
+        self.cookie_url    = config.get("Settings", "KickCookieURL", fallback="") or COOKIE_URL
+
+        if not self.curl_bin or not self.curl_headers:
+            self.logger.warning("Curl config or headers not set; cookie refresh may fail.")
+
+        # Go-live history is in its state file, so a rebuilt scheduler keeps it
+        self.scheduler = PollScheduler.from_config(
+            config, self.retry_time, os.path.join(STATE_DIR, f"schedule-kick-{streamer_name}.json"),
+            suffix="Kick", default_fast=20)
+
+        stream_url = (config.get("Settings", "KickStreamURL", fallback="") or STREAM_URL).format(name=streamer_name)
+        if stream_url != getattr(self, "stream_url", None):
+            self.stream_url = stream_url
+            self.logger.info(f"Stream URL: {self.stream_url}")
+
+    def _curl_cmd(self, jar):
+        return f"{self.curl_bin} --header @{self.curl_headers} {self.cookie_url} -c {jar}"
+
+    def _ytdlp_cookie_cmd(self, jar):
+        return f"yt-dlp --cookies {jar} --impersonate chrome --cookies-from-browser chrome {self.cookie_url} --preview"
+
+    async def refresh_cookies_curl(self, since=None):
+        """Refresh the shared jar via curl-impersonate, unless another channel already did since ``since``."""
+        if not self.curl_headers:
+            self.logger.error("No CurlHeaders defined in settings.config.")
+            return
+        self.logger.info("Refreshing cookies via Curl...")
+        await self.cookies.refresh("curl", self._curl_cmd, since)
+
+    async def refresh_cookies_ytdlp(self, since=None):
+        self.logger.info("Attempting heavy yt-dlp cookie refresh...")
+        await self.cookies.refresh("yt-dlp", self._ytdlp_cookie_cmd, since)
+
+    def _streamlink_headers(self):
+        args = ["--http-header", f"User-Agent={self.streamlink_ua}"]
+        if os.path.exists(self.cookies_file):
+            args.extend(["--http-cookies", self.cookies_file])
+        return args
+
+    async def playlist_url(self, url=None):
+        """HLS media playlist of ``url`` (default: the live stream) at the capture quality, or None."""
+        url = url or self.stream_url
+        if urlsplit(url).path.endswith(".m3u8"):
+            return url
+        if self.sl_session is not None:
+            stream = pick_stream(await self.sl_session.probe(url), self.quality)
+            return getattr(stream, "url", None)
+        returncode, stdout, _ = await run_child(
+            ["streamlink", "--stream-url", url, self.quality, *self._streamlink_headers()], capture_output=True)
+        return stdout.strip().splitlines()[-1] if returncode == 0 and stdout.strip() else None
+
+    async def run_streamlink(self, output):
+        """Attempt recording with Streamlink, to a path or through a SpoolWriter"""
+        spooled = isinstance(output, SpoolWriter)
+        # CaptureFromStart: begin at the oldest segment the playlist still has (new sessions only)
+        live_restart = self.live_restart
+        if self.sl_session is not None:
+            self.logger.debug(f"Running Streamlink in-process: {self.stream_url} {self.quality} -> {output.filename if spooled else output}")
+            returncode, message = await self.sl_session.record_async(self.stream_url, output, self.quality,
+                                                                     live_restart=live_restart)
+            return returncode, "", message
+
+        cmd = [
+            "streamlink",
+            self.stream_url,
+            self.quality,
+            *(["-O"] if spooled else ["-o", output]),
+            *(["--hls-live-restart"] if live_restart else []),
+            *self._streamlink_headers(),
+        ]
+        if self.limits is not None:
+            cmd = self.limits.wrap(cmd, self.priority)
+
+        self.logger.debug("Running Streamlink", extra={"backend": "streamlink", "cmd": argv(cmd)})
+        if spooled:
+            return await pump_child(cmd, output, abort_on=FORBIDDEN_RE)
+        return await run_child(cmd, capture_output=True, abort_on=FORBIDDEN_RE,
+                               armed=lambda: before_first_byte(output))
+
+    async def run_ytdlp(self, output):
+        ytdlp_args = f"{self.ytdlp_args} {ytdlp_format(self.quality)}".strip()
+        if isinstance(output, SpoolWriter):
+            cmd = f"yt-dlp {ytdlp_args} --cookies {self.cookies_file} {self.stream_url} -o -"
+        else:
+            # Without this yt-dlp muxes HLS into an MP4 that is unreadable if the capture is cut
+            hls_ts = " --hls-use-mpegts" if self.ext == TS_EXT else ""
+            cmd = f"yt-dlp {ytdlp_args}{hls_ts} --cookies {self.cookies_file} {self.stream_url} -o \"{output}\""
+        if self.limits is not None:
+            cmd = self.limits.wrap(cmd, self.priority)
+        self.logger.debug("Running yt-dlp Fallback", extra={"backend": "yt-dlp", "cmd": argv(cmd)})
+        if isinstance(output, SpoolWriter):
+            return await pump_child(cmd, output, abort_on=FORBIDDEN_RE)
+        return await run_child(cmd, capture_output=True, abort_on=FORBIDDEN_RE,
+                               armed=lambda: before_first_byte(output))
+
+    async def record_stream(self, slots=None):
+        """Main loop. ``slots`` optionally caps concurrent recordings across channels.
+
+        Returns once ``retiring`` is set (see ``reload.retire``).
+        """
+        if slots is None:
+            slots = contextlib.nullcontext()
+
+        if self.config.getboolean("Settings", "MidStreamFailover", fallback=False):
+            await asyncio.to_thread(reconcile_pending, self.fallback_dir, self.logger)
+
+        outcome = None
+        while not self.retiring:
+            # The other platform may already be recording this stream (SimulcastLinks)
+            self.quality = self.simulcast.quality_for(self) if self.simulcast is not None else "best"
+            if self.quality is None:
+                delay = self.scheduler.next_delay("live") if self.scheduler is not None else self.retry_time
+                if self.push is not None:
+                    delay = self.push.poll_delay(self.streamer_name, delay)
+                self.logger.info(f"Simulcast is recorded from Twitch. Sleeping {delay:.0f}s...")
+                await wait_for_poll(self.push, self.streamer_name, delay)
+                continue
+
+            # Waits for bandwidth, and may lower self.quality (AdmissionControl)
+            admission = self.admission.admit(self) if self.admission is not None else contextlib.nullcontext()
+            # After a handover the stream's start is already in the previous session
+            recover = outcome not in ("simulcast", "downgrade")
+            async with slots, admission:
+                if self.retiring:
+                    return
+                self.capturing = True
+                started = time.time()
+                self.stream_started_at = self.push and self.push.started_at(self.streamer_name)
+                try:
+                    outcome = await self.record_once(recover)
+                finally:
+                    self.capturing = False
+            if outcome in ("simulcast", "downgrade"):
+                continue        # straight back: held off, or restarted at another quality
+
+            if self.scheduler is not None:
+                if outcome == "live":
+                    self.scheduler.record_go_live(self.stream_started_at or started)
+                delay = self.scheduler.next_delay(outcome)
+            else:
+                delay = self.retry_time
+            if self.push is not None and outcome in ("live", "offline"):
+                delay = self.push.poll_delay(self.streamer_name, delay)
+            self.logger.info(f"Sleeping {delay:.0f}s...")
+            await wait_for_poll(self.push, self.streamer_name, delay)
+
+    async def record_once(self, recover=True):
+        """One capture attempt. Returns "live", "offline", "blocked", "simulcast", "downgrade" or "error".
+
+        With ``recover`` (and ``CaptureFromStart``) the part of the stream before
+        the capture is backfilled.
+        """
+        ts = get_timestamp()
+        filename = f"{self.streamer_name}-{ts}{self.ext}"
+
+        record = self.session_record = self.catalog and self.catalog.session(self.platform, self.streamer_name, filename)
+        outcome = "error"
+        # --- NAS FALLBACK CHECK --- (or spool / local-first / storage, see capture_output)
+        try:
+            attempt = self._attempt
+            if recover and self.recovery is not None:
+                attempt = self.recovery.guard(self, attempt)
+            if self.simulcast is not None:
+                attempt = self.simulcast.guard(self, attempt)
+            if self.admission is not None:
+                attempt = self.admission.guard(self, attempt)
+            outcome = await run_watched(self, filename, attempt, fallback_msg="NAS OFFLINE! Fallback to")
+        except StorageFull as e:
+            self.logger.error(f"Not recording: {e}")
+        except SimulcastHandover as e:
+            self.logger.warning(str(e))
+            outcome = "simulcast"
+        except AdmissionHandover as e:
+            self.logger.warning(str(e))
+            outcome = "downgrade"
+        except asyncio.CancelledError:
+            outcome = "stopped"         # SIGTERM drain; the output is already closed
+            raise
+        finally:
+            if record:
+                record.finish(outcome)
+                self.session_record = None
+        return outcome
+
+    async def _attempt(self, target_path):
+        labels = {"platform": self.platform, "channel": self.streamer_name}
+
+        if self.curl_headers:
+            await self.cookies.ensure_fresh("curl", self._curl_cmd)
+
+        # Go straight to whichever backend last worked for this channel
+        backends = self.backends.order() if self.backends else list(BACKENDS)
+        run = {"streamlink": self.run_streamlink, "yt-dlp": self.run_ytdlp}
+
+        for backend in backends:
+            jar_used_at = time.time()
+            attempt_started = time.monotonic()
+            record = self.session_record
+            self.backend = backend
+            if record:
+                record.backend = backend
+            code, stdout, stderr = await run[backend](target_path)
+            if record:
+                record.quality = parse_quality(stdout + stderr) or record.quality
+            result = {"backend": backend, "exit_code": code, "latency": round(time.monotonic() - attempt_started, 3)}
+
+            if code == 0:
+                self.logger.info(f"Recording finished successfully ({backend}).", extra=result)
+                self._remember(backend, True)
+                return "live"
+
+            err = (stdout + stderr).lower()
+            self.logger.debug(f"{backend} Exit Code: {code}", extra=result)
+            # On Kick a failed capture run *is* the probe
+            blocked = "403" in err or "forbidden" in err
+            if blocked and await bytes_written(target_path, 5):
+                # The backend got in; a 403 on some fragment later on says nothing about the cookies
+                self.logger.warning(f"{backend} ended with a 403 after recording; not treating it as blocked", extra=result)
+                self._remember(backend, True)
+                return "live"
+            metrics.PROBE_SECONDS.observe(time.monotonic() - attempt_started, kind=backend, **labels)
+            metrics.PROBES.inc(kind=backend, outcome="blocked" if blocked else "offline", **labels)
+
+            if not blocked:
+                # Streamlink failing without a 403 is usually just 'No streams found' (Offline)
+                if backend == "streamlink" or "offline" in err or "not live" in err:
+                    self.logger.info("Streamer appears to be offline.", extra=result)
+                    # Log the first bit of error just in case it's something else
+                    if stderr:
+                        self.logger.debug(f"{backend} info: {stderr.strip()[:100]}")
+                    return "offline"
+                self.logger.error(f"{backend} failure: {stderr.strip()[:200]}", extra=result)
+                return "error"
+
+            self.logger.warning(f"BLOCKED (403) on {backend}. Full error: {(stdout + stderr).strip()[:200]}", extra=result)
+            metrics.FORBIDDEN.inc(backend=backend, **labels)
+            if record:
+                record.event("blocked", backend)
+            self._remember(backend, False)
+            if backend != backends[-1]:
+                await self.refresh_cookies_curl(since=jar_used_at)
+
+        self.logger.error("All backends blocked. Triggering heavy refresh.")
+        await self.refresh_cookies_ytdlp(since=jar_used_at)
+        return "blocked"
+
+    def _remember(self, backend, ok):
+        if self.backends is not None:
+            self.backends.record(backend, ok)
@@ -0,0 +1,227 @@
+"""Non-blocking, structured logging.
+
+Logging used to write the rotating file and stdout from whichever coroutine
+logged, so a slow disk or a journald backlog held up the recording loop. Now
+the root logger only puts records on a queue; one ``QueueListener`` thread
+formats them and writes the file and stdout. If the queue fills up anyway,
+records are dropped (and counted in ``recorder_log_records_dropped_total``)
+rather than waited for.
+
+With ``LogFormat=json`` (the default) every line is one JSON object: time,
+level, logger, message and the event's fields, e.g. ``channel``,
+``platform``, ``backend``, ``exit_code``, ``latency`` and ``cmd`` (a child
+process's argv). Channels log through a ``ChannelLogger``, which adds
+``channel``/``platform`` to everything they log; call sites pass the rest
+with ``extra=``. ``LogFormat=text`` keeps the one-line format, with the
+fields appended as ``key=value``.
+
+Secrets are removed once per record, before it is queued, by ``Redactor``:
+fields named like a secret, ``Authorization``/``Cookie`` header values in an
+argv, and the configured ``TwitchToken`` wherever it still shows up.
+"""
+import copy
+import json
+import queue
+import shlex
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime
+
+from . import metrics
+
+QUEUE_SIZE     = 10_000
+# Every LogRecord has these; anything else came with ``extra=`` and is a field
+RECORD_ATTRS   = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+SECRET_FIELDS  = {"token", "authorization", "cookie", "cookies", "password", "secret", "client_secret"}
+HEADER_FLAGS   = {"--twitch-api-header", "--http-header", "--add-header", "--header", "-H"}
+SECRET_HEADERS = {"authorization", "cookie", "proxy-authorization"}
+SECRET_KEYS    = ("TwitchToken",)       # settings masked wherever their value appears in a record
+MIN_SECRET     = 8                      # shorter values (empty, placeholders) aren't masked
+HIDDEN         = "HIDDEN"
+TEXT_SKIP      = {"channel", "platform"}    # already in the logger name or the per-channel log file
+
+_pipeline = None
+
+
+def fields(record):
+    """The ``extra=`` fields of ``record``."""
+    return {key: value for key, value in vars(record).items() if key not in RECORD_ATTRS and not key.startswith("_")}
+
+
+def argv(cmd):
+    """A command as an argv list, for the ``cmd`` field; shell strings are split like the shell would."""
+    if not isinstance(cmd, str):
+        return [str(arg) for arg in cmd]
+    try:
+        return shlex.split(cmd)
+    except ValueError:
+        return [cmd]
+
+
+class ChannelLogger(logging.LoggerAdapter):
+    """Adds the adapter's fields (``channel``, ``platform``) to every record, keeping the call's own ``extra``."""
+
+    def process(self, msg, kwargs):
+        kwargs["extra"] = {**self.extra, **(kwargs.get("extra") or {})}
+        return msg, kwargs
+
+
+# ─── Redaction ──────────────────────────────────────────────────────────────────
+class Redactor(logging.Filter):
+    """Removes secrets from a record's fields and message, once, before it is queued."""
+
+    def __init__(self):
+        super().__init__()
+        self.secrets = set()
+
+    def apply_config(self, config):
+        self.secrets = {value for key in SECRET_KEYS
+                        if len(value := config.get("Settings", key, fallback="") or "") >= MIN_SECRET}
+
+    def filter(self, record):
+        for key, value in fields(record).items():
+            setattr(record, key, self.clean(key, value))
+        if self.secrets:
+            message = record.getMessage()
+            masked = self.mask(message)
+            if masked != message:
+                record.msg, record.args = masked, None
+        return True
+
+    def clean(self, key, value):
+        if key.lower() in SECRET_FIELDS:
+            return HIDDEN
+        if isinstance(value, dict):
+            return {k: self.clean(k, v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self.mask(arg) for arg in self.hide_headers(value)]
+        if isinstance(value, str):
+            return self.mask(value)
+        return value
+
+    def mask(self, text):
+        if not isinstance(text, str):
+            return text
+        for secret in self.secrets:
+            text = text.replace(secret, HIDDEN)
+        return text
+
+    @staticmethod
+    def hide_headers(args):
+        """``--http-header "Authorization=OAuth x"`` -> ``--http-header Authorization=HIDDEN`` (also ``Name: value``)."""
+        cleaned, after_flag = [], False
+        for arg in map(str, args):
+            flag, joined, header = arg.partition("=")
+            if after_flag:
+                arg = _hide_header(arg)
+            elif joined and flag.startswith("--") and flag in HEADER_FLAGS:
+                arg = f"{flag}={_hide_header(header)}"
+            cleaned.append(arg)
+            after_flag = arg in HEADER_FLAGS
+        return cleaned
+
+
+def _hide_header(header):
+    """``Name=value`` or ``Name: value``, with the value hidden if it is a credential."""
+    cut = min((i for i in (header.find("="), header.find(":")) if i > 0), default=-1)
+    if cut > 0 and header[:cut].strip().lower() in SECRET_HEADERS:
+        return header[:cut + 1] + HIDDEN
+    return header
+
+
+# ─── Formatters ─────────────────────────────────────────────────────────────────
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        event = {
+            "time":    datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level":   record.levelname,
+            "logger":  record.name,
+            "message": record.getMessage(),
+        }
+        event.update(fields(record))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            event["exception"] = record.exc_text
+        return json.dumps(event, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """``fmt`` with the record's fields appended as ``key=value``."""
+
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        extra = [f"{key}={shlex.join(value) if isinstance(value, list) else value}"
+                 for key, value in fields(record).items() if key not in TEXT_SKIP]
+        return " ".join([line, *extra])
+
+
+# ─── Pipeline ───────────────────────────────────────────────────────────────────
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never waits for the writer: a record that doesn't fit in the queue is dropped and counted."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_DROPPED.inc()
+
+    def prepare(self, record):
+        # Like the base class, but the fields survive and the traceback stays apart for the JSON formatter
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogPipeline:
+    """The root logger's queue and the listener thread that writes ``handlers``."""
+
+    def __init__(self, handlers, level=logging.INFO, fmt=None, queue_size=QUEUE_SIZE):
+        self.handlers = list(handlers)
+        self.fmt      = fmt
+        self.redactor = Redactor()
+        self.queue    = queue.Queue(queue_size)
+        self.handler  = DroppingQueueHandler(self.queue)
+        self.handler.addFilter(self.redactor)
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(self.handler)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def apply_config(self, config):
+        """``LogFormat`` and the secrets to mask; also called when settings.config changes."""
+        if config.get("Settings", "LogFormat", fallback="json").strip().lower() == "text":
+            formatter = TextFormatter(self.fmt)
+        else:
+            formatter = JSONFormatter()
+        for handler in self.handlers:
+            handler.setFormatter(formatter)
+        self.redactor.apply_config(config)
+
+    def stop(self):
+        """Write out what is queued and stop the listener."""
+        if self.listener is not None:
+            logging.getLogger().removeHandler(self.handler)
+            self.listener.stop()
+            self.listener = None
+
+
+def start(handlers, level=logging.INFO, fmt=None):
+    global _pipeline
+    if _pipeline is not None:
+        _pipeline.stop()
+    _pipeline = LogPipeline(handlers, level, fmt)
+    return _pipeline
+
+
+def apply_config(config):
+    """Hand a (re)loaded settings.config to the running pipeline, if there is one."""
+    if _pipeline is not None:
+        _pipeline.apply_config(config)
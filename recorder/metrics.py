@@ -0,0 +1,273 @@
+"""Prometheus-style metrics without extra dependencies.
+
+Metrics are module-level objects that any part of the recorder can update::
+
+    from . import metrics
+    metrics.BYTES_WRITTEN.inc(len(chunk), platform="twitch", channel="roflgator")
+
+``start_exporters()`` serves them in the Prometheus text format on
+``MetricsPort`` (``GET /metrics``) and/or writes them to
+``MetricsTextfileDir/<name>.prom`` for node_exporter's textfile collector.
+Every series carries an ``instance="<name>"`` label, so the files of the
+per-channel recorder processes don't repeat each other's series. Only one
+process can listen on ``MetricsPort``, so it is served by the supervisor
+alone; the per-channel recorders use the textfile.
+"""
+import os
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STARTUP_BUCKETS = (1, 2, 5, 10, 15, 30, 60, 120, 300, 600)
+
+_registry = []
+_lock = threading.Lock()
+_constant = ()          # labels on every series: the exporting process's instance name
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels, extra=()):
+    items = list(_constant) + list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _fmt_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        with _lock:
+            _registry.append(self)
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = list(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_fmt_labels(key)} {_fmt_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with _lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts, total, n = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0, 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value, n + 1)
+
+    def time(self, **labels):
+        """Context manager observing the elapsed wall time of its block."""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with _lock:
+            items = [(key, (list(c), t, n)) for key, (c, t, n) in self.values.items()]
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_fmt_labels(key, [('le', _fmt_value(float(bound)))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_fmt_labels(key)} {_fmt_value(total)}")
+            lines.append(f"{self.name}_count{_fmt_labels(key)} {n}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start, **self.labels)
+
+
+def render():
+    with _lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ─── Recorder metrics ───────────────────────────────────────────────────────────
+PROBE_SECONDS = Histogram(
+    "recorder_probe_duration_seconds", "Time taken by a live/quality probe.")
+PROBES = Counter(
+    "recorder_probes_total", "Live/quality probes by outcome.")
+GOLIVE_TO_FIRST_BYTE = Histogram(
+    "recorder_golive_to_first_byte_seconds", "Time from the stream going live to its first byte on disk.",
+    buckets=STARTUP_BUCKETS)
+BYTES_WRITTEN = Counter(
+    "recorder_bytes_written_total", "Bytes written to recordings; use rate() for bytes per second.")
+WRITE_SECONDS = Histogram(
+    "recorder_write_duration_seconds", "Latency of a single chunk write, by storage target (nas/fallback).")
+SPAWN_SECONDS = Histogram(
+    "recorder_subprocess_spawn_seconds", "Time to start a streamlink/yt-dlp/curl child process.")
+FORBIDDEN = Counter(
+    "recorder_http_403_total", "Captures or probes rejected with HTTP 403.")
+COOKIE_REFRESHES = Counter(
+    "recorder_cookie_refreshes_total", "Kick cookie refreshes by method.")
+ACTIVE_RECORDINGS = Gauge(
+    "recorder_active_recordings", "Recordings currently running.")
+CAPTURE_RATE = Gauge(
+    "recorder_capture_bytes_per_second", "Output growth of the running capture, as sampled by the stall watchdog.")
+STALLS = Counter(
+    "recorder_capture_stalls_total", "Captures stopped and restarted because their output stopped growing.")
+STALL_RECOVERY_SECONDS = Histogram(
+    "recorder_stall_recovery_seconds", "Time from a stall being detected to the restarted capture's first data.",
+    buckets=STARTUP_BUCKETS)
+FREE_BYTES = Gauge(
+    "recorder_free_bytes", "Free space on the filesystem of each recording directory.")
+CAPTURES_REFUSED = Counter(
+    "recorder_captures_refused_total", "Captures not started because every directory was low on space.")
+RETENTION_DELETED = Counter(
+    "recorder_retention_deleted_total", "Fallback recordings deleted by the retention policy.")
+REMUX_BYTES = Counter(
+    "recorder_remux_bytes_total", "MPEG-TS bytes remuxed to MP4; use rate() for throughput.")
+REMUX_PENDING = Gauge(
+    "recorder_remux_pending", "Captures waiting to be remuxed.")
+PUSH_CONNECTED = Gauge(
+    "recorder_push_connected", "1 while the go-live push connection (EventSub/Pusher) is up.")
+PUSH_EVENTS = Counter(
+    "recorder_push_events_total", "Go-live/go-offline events received over the push connection.")
+PUSH_DELAY = Histogram(
+    "recorder_push_event_delay_seconds", "Time from the platform's stream start to its go-live event arriving.",
+    buckets=STARTUP_BUCKETS)
+SIMULCAST_DUPLICATES = Counter(
+    "recorder_simulcast_duplicates_total", "Captures stopped or downgraded because the other platform records the same stream.")
+ADMISSIONS = Counter(
+    "recorder_admissions_total", "Captures admitted by admission control, at best or a lowered quality.")
+ADMISSION_QUEUED = Gauge(
+    "recorder_admission_queued", "Captures waiting for bandwidth.")
+ADMISSION_WAIT = Histogram(
+    "recorder_admission_wait_seconds", "Time a capture waited for admission before it started.",
+    buckets=STARTUP_BUCKETS)
+ADMISSION_STEP_DOWNS = Counter(
+    "recorder_admission_step_downs_total", "Captures restarted at a lower quality to make room for a higher-priority channel.")
+FREE_BANDWIDTH = Gauge(
+    "recorder_free_bandwidth_bytes_per_second", "Ingest/write bandwidth left for new captures, as estimated by admission control.")
+START_OFFSET = Histogram(
+    "recorder_start_offset_seconds", "How far into the stream a session's recording starts, after live-restart and backfill.",
+    buckets=STARTUP_BUCKETS)
+RECOVERED_SECONDS = Counter(
+    "recorder_recovered_seconds_total", "Seconds of stream start recovered, by source (restart, window, archive).")
+LOG_DROPPED = Counter(
+    "recorder_log_records_dropped_total", "Log records dropped because the log writer fell behind.")
+
+
+# ─── Exporters ──────────────────────────────────────────────────────────────────
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def write_textfile(path):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+def start_exporters(config, logger, name, interval=15, serve=True):
+    """Start the HTTP endpoint and/or textfile writer configured in settings.config.
+
+    Series are labelled ``instance=name``. ``serve=False`` (the per-channel
+    recorders) leaves ``MetricsPort`` to the supervisor.
+    """
+    global _constant
+    _constant = (("instance", name),)
+    port = config.getint("Settings", "MetricsPort", fallback=0)
+    if port and not serve:
+        logger.info("MetricsPort is only served by record-supervisor.py; use MetricsTextfileDir here")
+    elif port:
+        try:
+            server = ThreadingHTTPServer((config.get("Settings", "MetricsAddress", fallback="127.0.0.1"), port), _Handler)
+        except OSError as e:
+            logger.warning(f"Cannot serve metrics on port {port}: {e}")
+        else:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            logger.info(f"Serving metrics on http://{server.server_address[0]}:{port}/metrics")
+
+    textfile_dir = config.get("Settings", "MetricsTextfileDir", fallback="").strip()
+    if textfile_dir:
+        path = os.path.join(textfile_dir, f"{name}.prom")
+
+        def loop():
+            while True:
+                try:
+                    write_textfile(path)
+                except OSError as e:
+                    logger.warning(f"Cannot write metrics to {path}: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=loop, name="metrics-textfile", daemon=True).start()
+        logger.info(f"Writing metrics to {path} every {interval}s")
@@ -0,0 +1,244 @@
+"""Record locally, move to the NAS later.
+
+With ``RecordLocalFirst=true`` every capture lands in the platform's
+``fallback_dir`` on local disk and is queued here once it finishes. The
+``Migrator`` copies queued files to ``external_dir`` in the background:
+
+* at most ``MigrateBandwidthLimit`` bytes/s, in ``MigrateChunkSize`` chunks,
+* into ``<name>.partial`` on the NAS, so an interrupted copy resumes where
+  it stopped (after a restart too),
+* then reads the copy back and compares SHA-256 before the ``.partial`` is
+  renamed into place and the local file is deleted.
+
+The queue is a JSON file in ``state/`` so it survives restarts, and the
+fallback directories are rescanned periodically, which also picks up files
+left behind by past NAS outages.
+"""
+import os
+import re
+import json
+import time
+import fcntl
+import asyncio
+import hashlib
+import threading
+
+from .common import STATE_DIR
+from .spool import SIDECAR_EXT
+
+PARTIAL_EXT = ".partial"
+SPOOL_PART_RE = re.compile(r"\.part\d+$")     # spool failover parts, joined by the spool itself
+MIN_AGE     = 120           # seconds since last modification before a scanned file counts as finished
+RESCAN_TIME = 600
+RETRY_TIME  = 300
+
+
+def parse_size(value, default=0):
+    """'20M' -> 20971520. Accepts K/M/G suffixes; empty means ``default``."""
+    value = (value or "").strip().upper()
+    if not value:
+        return default
+    mult = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}.get(value[-1], 1)
+    return int(float(value.rstrip("KMG")) * mult)
+
+
+class MigrationQueue:
+    """Persistent list of ``{"src": ..., "dest_dir": ...}`` jobs."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.jobs = []
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.jobs = json.load(f)
+            except (OSError, ValueError):
+                self.jobs = []
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.jobs, f)
+        os.replace(tmp, self.path)
+
+    def add(self, src, dest_dir):
+        src = os.path.abspath(src)
+        with self.lock:
+            if any(job["src"] == src for job in self.jobs):
+                return False
+            self.jobs.append({"src": src, "dest_dir": dest_dir, "not_before": 0})
+            self._save()
+            return True
+
+    def next_ready(self, now=None, exclude=()):
+        now = time.time() if now is None else now
+        with self.lock:
+            return next((dict(job) for job in self.jobs
+                         if job.get("not_before", 0) <= now and job["src"] not in exclude), None)
+
+    def defer(self, src, seconds):
+        with self.lock:
+            for job in self.jobs:
+                if job["src"] == src:
+                    job["not_before"] = time.time() + seconds
+            self._save()
+
+    def remove(self, src):
+        with self.lock:
+            self.jobs = [job for job in self.jobs if job["src"] != src]
+            self._save()
+
+
+class Migrator:
+    def __init__(self, queue, logger, bandwidth_limit=0, chunk_size=8 * 1024 * 1024, dirs=()):
+        self.queue           = queue
+        self.logger          = logger
+        self.bandwidth_limit = bandwidth_limit      # bytes/s, 0 = unlimited
+        self.chunk_size      = chunk_size
+        self.dirs            = list(dirs)           # (fallback_dir, external_dir) pairs to rescan
+        self.active          = set()                # paths still being recorded
+        self.skip_exts       = set()                # left to someone else first (e.g. .ts awaiting remux)
+        self.catalog         = None                 # told about every file moved (see catalog.py)
+        self.bytes_copied    = 0
+
+    @classmethod
+    def from_config(cls, config, logger, name, dirs=()):
+        """Return a migrator if ``RecordLocalFirst`` is enabled, else None."""
+        if not config.getboolean("Settings", "RecordLocalFirst", fallback=False):
+            return None
+        return cls(
+            MigrationQueue(os.path.join(STATE_DIR, f"migrate-{name}.json")),
+            logger,
+            bandwidth_limit=parse_size(config.get("Settings", "MigrateBandwidthLimit", fallback="")),
+            chunk_size=parse_size(config.get("Settings", "MigrateChunkSize", fallback=""), 8 * 1024 * 1024),
+            dirs=dirs,
+        )
+
+    # ─── Producers ──────────────────────────────────────────────────────────────
+    def enqueue(self, path, dest_dir):
+        self.active.discard(path)
+        if path and os.path.splitext(path)[1] in self.skip_exts:
+            return
+        if path and os.path.isfile(path) and self.queue.add(path, dest_dir):
+            self.logger.info(f"Queued for migration: {path} -> {dest_dir}")
+
+    def scan(self):
+        """Queue finished files sitting in the fallback dirs (e.g. from old NAS outages)."""
+        now = time.time()
+        for fallback_dir, dest_dir in self.dirs:
+            if not os.path.isdir(fallback_dir):
+                continue
+            names = os.listdir(fallback_dir)
+            # Parts waiting to be reconciled belong to the spool, not to us
+            pending = {n[:-len(SIDECAR_EXT)] for n in names if n.endswith(SIDECAR_EXT)}
+            for name in names:
+                path = os.path.join(fallback_dir, name)
+                stem, ext = os.path.splitext(name)
+                if (name.startswith(".") or name.endswith((SIDECAR_EXT, ".tmp")) or ext in self.skip_exts
+                        or name in pending or SPOOL_PART_RE.search(stem) or path in self.active):
+                    continue
+                try:
+                    if not os.path.isfile(path) or now - os.path.getmtime(path) < MIN_AGE:
+                        continue
+                except OSError:
+                    continue
+                self.enqueue(path, dest_dir)
+
+    # ─── Copy ───────────────────────────────────────────────────────────────────
+    def _throttle(self, started, copied):
+        if self.bandwidth_limit:
+            ahead = copied / self.bandwidth_limit - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def _hash_file(self, path, limit=None):
+        h = hashlib.sha256()
+        remaining = limit
+        with open(path, "rb") as f:
+            while remaining is None or remaining > 0:
+                chunk = f.read(self.chunk_size if remaining is None else min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                h.update(chunk)
+                if remaining is not None:
+                    remaining -= len(chunk)
+        return h
+
+    def migrate(self, src, dest_dir):
+        """Blocking: copy, verify, then delete ``src``. Returns True when the file is on the NAS."""
+        dest = os.path.join(dest_dir, os.path.basename(src))
+        partial = dest + PARTIAL_EXT
+        with open(src, "rb") as f:
+            # Another recorder process may be migrating the same fallback file
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+
+            size = os.fstat(f.fileno()).st_size
+            offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+            if offset > size:
+                offset = 0
+            if offset:
+                self.logger.info(f"Resuming migration of {src} at {offset}/{size} bytes")
+            # Seed the source hash with the part that is already on the NAS
+            src_hash = self._hash_file(src, offset)
+
+            started = time.monotonic()
+            copied = 0
+            f.seek(offset)
+            with open(partial, "ab" if offset else "wb") as out:
+                while chunk := f.read(self.chunk_size):
+                    out.write(chunk)
+                    src_hash.update(chunk)
+                    copied += len(chunk)
+                    self.bytes_copied += len(chunk)
+                    self._throttle(started, copied)
+                out.flush()
+                os.fsync(out.fileno())
+
+            if self._hash_file(partial).digest() != src_hash.digest():
+                self.logger.error(f"Checksum mismatch for {dest}, starting over")
+                os.remove(partial)
+                return False
+            os.replace(partial, dest)
+            os.remove(src)
+
+        elapsed = time.monotonic() - started
+        rate = copied / elapsed / 1024 ** 2 if elapsed > 0 else 0
+        self.logger.info(f"Migrated {src} -> {dest} ({size / 1024 ** 2:.0f} MiB, {rate:.1f} MiB/s, sha256 verified)")
+        return True
+
+    async def run(self):
+        last_scan = 0
+        while True:
+            if time.time() - last_scan > RESCAN_TIME:
+                await asyncio.to_thread(self.scan)
+                last_scan = time.time()
+
+            job = self.queue.next_ready()
+            if job is None:
+                await asyncio.sleep(30)
+                continue
+
+            src, dest_dir = job["src"], job["dest_dir"]
+            if not os.path.exists(src):
+                self.queue.remove(src)
+                continue
+            if not (os.path.isdir(dest_dir) and os.access(dest_dir, os.W_OK)):
+                self.logger.debug(f"NAS {dest_dir} unavailable, retrying {src} later")
+                self.queue.defer(src, RETRY_TIME)
+                continue
+            try:
+                done = await asyncio.to_thread(self.migrate, src, dest_dir)
+            except OSError as e:
+                self.logger.warning(f"Migration of {src} interrupted: {e}")
+                done = False
+            if done:
+                self.queue.remove(src)
+                if self.catalog is not None:
+                    self.catalog.move_file(src, os.path.join(dest_dir, os.path.basename(src)))
+            else:
+                self.queue.defer(src, RETRY_TIME)
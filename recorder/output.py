@@ -0,0 +1,122 @@
+"""Where a capture's bytes go: shared by the Twitch and Kick recorders."""
+import os
+import time
+import asyncio
+import contextlib
+
+from . import metrics
+from .common import pick_target_path
+from .spool import SpoolWriter
+
+
+async def bytes_written(output, timeout):
+    """Bytes written so far: counted by the spool, or the file size (without hanging on the NAS)."""
+    if not isinstance(output, str):
+        return output.bytes_written
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(os.path.getsize, output), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+
+
+async def before_first_byte(output):
+    """True until ``output`` has data (or while its size can't be read)."""
+    return not await bytes_written(output, 5)
+
+
+def finish_file(channel, path, record=None):
+    """Hand a finished file of ``channel`` to the catalog, migrator and remuxer. Thread-safe."""
+    if record is not None:
+        record.add_file(path)
+    if channel.migrator is not None:
+        channel.migrator.enqueue(path, channel.external_dir)
+    if channel.remuxer is not None:
+        channel.remuxer.enqueue(path, channel.external_dir if channel.migrator is not None else None)
+
+
+@contextlib.asynccontextmanager
+async def capture_output(channel, filename, fallback_msg="NAS unavailable, using Fallback", on_low=None):
+    """Yield the output for one capture: a file path, or a started SpoolWriter.
+
+    With ``RecordLocalFirst`` (``channel.migrator`` set) the capture always
+    goes to ``fallback_dir`` on local disk and is queued for migration to
+    ``external_dir`` when it ends. A finished ``.ts`` capture is queued for
+    remuxing when ``channel.remuxer`` is set. With ``channel.storage`` a NAS
+    that is low on space is skipped, and ``StorageFull`` is raised when the
+    fallback dir is too; ``on_low()`` is called if the disk the capture
+    writes to runs low later on. Files, the first byte and failovers are
+    reported to ``channel.session_record`` (the catalog) when set.
+    """
+    migrator = channel.migrator
+    remuxer = channel.remuxer
+    storage = channel.storage
+    record = channel.session_record
+    external_dir = channel.external_dir if migrator is None else channel.fallback_dir
+    if storage is not None:
+        external_dir = await storage.choose(external_dir, channel.fallback_dir)
+        if record is not None and migrator is None and external_dir != channel.external_dir:
+            record.event("fallback", f"{channel.external_dir} low on space")
+    local_path = os.path.join(channel.fallback_dir, filename)
+    candidates = {local_path, os.path.join(external_dir, filename)}
+    if migrator is not None:
+        migrator.active.add(local_path)
+    if remuxer is not None:
+        remuxer.active.update(candidates)
+    final_path = None
+
+    labels = {"platform": channel.platform, "channel": channel.streamer_name}
+    capture_started = time.time()
+    recording = False
+
+    def on_first_byte():
+        # The spool knows when data actually arrives; count the recording from then on
+        nonlocal recording
+        recording = True
+        metrics.ACTIVE_RECORDINGS.inc(platform=channel.platform)
+        went_live = getattr(channel, "stream_started_at", None) or capture_started
+        metrics.GOLIVE_TO_FIRST_BYTE.observe(time.time() - went_live, **labels)
+        if record is not None:
+            record.begin(time.time())
+
+    def on_finished(path):
+        # Also called from the spool's threads for every finished segment
+        finish_file(channel, path, record)
+
+    key = object()
+    try:
+        spool = SpoolWriter.from_config(channel.config, filename, external_dir, channel.fallback_dir, channel.logger,
+                                        labels=labels, on_first_byte=on_first_byte, on_segment=on_finished)
+        if spool is not None:
+            spool.start()
+            if storage is not None:
+                storage.register(key, lambda: spool.current.path if spool.current else None, on_low)
+            try:
+                yield spool
+            finally:
+                final_path = await spool.aclose()
+                if record is not None and spool.failed_over:
+                    record.event("failover", f"continued in {spool.current.path}")
+        else:
+            # Without the spool there's no first-byte signal; count the whole capture
+            recording = True
+            metrics.ACTIVE_RECORDINGS.inc(platform=channel.platform)
+            if migrator is not None:
+                channel.logger.info(f"→ Local (migrated to NAS later): {local_path}")
+                final_path = local_path
+            elif external_dir == channel.fallback_dir:
+                final_path = local_path     # the storage manager has said why
+            else:
+                final_path = pick_target_path(external_dir, channel.fallback_dir, filename, channel.logger, fallback_msg)
+            if storage is not None:
+                storage.register(key, lambda: final_path, on_low)
+            yield final_path
+    finally:
+        if storage is not None:
+            storage.unregister(key)
+        if recording:
+            metrics.ACTIVE_RECORDINGS.dec(platform=channel.platform)
+        if remuxer is not None:
+            remuxer.active.difference_update(candidates)
+        if migrator is not None:
+            migrator.active.discard(local_path)
+        on_finished(final_path or local_path)
@@ -0,0 +1,472 @@
+"""Event-driven go-live detection over a persistent push connection.
+
+Polling finds a stream that went live up to ``RetryTime`` (Twitch) or
+``RetryTimeKick`` seconds late, and that gap is footage lost from the start
+of every stream. With ``PushDetection=true`` one WebSocket per platform
+(shared by all channels of a process) is told when a stream starts:
+
+* Twitch: EventSub ``stream.online`` / ``stream.offline`` subscriptions
+  (needs ``TwitchToken`` to be a user access token of the app in ``ClientID``);
+* Kick: the public Pusher channel ``channel.<id>`` of every streamer, with
+  its ``StreamerIsLive`` / ``StopStreamBroadcast`` events.
+
+A channel waiting between polls is woken as soon as its go-live event
+arrives and starts the capture straight away. While the connection is up
+polling only continues as a slow safety net every ``PushSafetyInterval``
+(``PushSafetyIntervalKick``) seconds; when it drops, the channels fall back
+to their normal interval until it is back.
+"""
+import os
+import json
+import time
+import asyncio
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+from . import metrics
+from .common import STATE_DIR, run_child
+from .twitch_live import WEB_CLIENT_ID
+from .ws import ConnectionClosed, connect
+
+EVENTSUB_URL = "wss://eventsub.wss.twitch.tv/ws"
+HELIX_URL    = "https://api.twitch.tv/helix"
+PUSHER_URL   = "wss://ws-us2.pusher.com/app/32cbd69e4b950bf97679?protocol=7&client=js&version=8.4.0&flash=false"
+CHANNELS_URL = "https://kick.com/api/v2/channels/{name}"
+
+KICK_IDS_PATH = os.path.join(STATE_DIR, "kick-channel-ids.json")
+KICK_LIVE     = "App\\Events\\StreamerIsLive"
+KICK_OFFLINE  = "App\\Events\\StopStreamBroadcast"
+
+RETRY_AFTER_EVENT = 5           # seconds between checks while a go-live event isn't visible to the probe yet
+MAX_BACKOFF       = 60
+
+
+def parse_time(value):
+    """Unix time of an ISO 8601 timestamp (UTC if it has no offset, as Kick's), or None."""
+    if not value:
+        return None
+    try:
+        when = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (ValueError, AttributeError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return when.timestamp()
+
+
+class PushListener:
+    """Base class: reconnect loop, per-channel wake-ups and metrics. Subclasses speak the protocol."""
+
+    platform = None
+
+    def __init__(self, logger, url, safety_interval=300, grace=60):
+        self.logger          = logger
+        self.url             = url
+        self.safety_interval = safety_interval
+        self.grace           = grace            # seconds a go-live event keeps the channel on quick retries
+        self.connected       = False
+        self.logins          = set()
+        self.subscribed      = set()
+        self.live            = {}               # login -> (stream start (unix) or None, event received (monotonic))
+        self._wakeups        = {}               # login -> asyncio.Event
+        self._changed        = asyncio.Event()  # set when a login is added while connected
+
+    # ─── Channel side ───────────────────────────────────────────────────────────
+    def watch(self, login):
+        login = login.lower()
+        self.logins.add(login)
+        self._wakeups.setdefault(login, asyncio.Event())
+        self._changed.set()
+
+    def recently_live(self, login):
+        """True while a go-live event for ``login`` is fresh and no go-offline followed it."""
+        entry = self.live.get(login.lower())
+        return entry is not None and time.monotonic() - entry[1] < self.grace
+
+    def started_at(self, login):
+        entry = self.live.get(login.lower())
+        return entry[0] if entry else None
+
+    def poll_delay(self, login, delay):
+        """``delay`` shortened right after a go-live event, or stretched to the safety interval while connected."""
+        if self.recently_live(login):
+            return min(delay, RETRY_AFTER_EVENT)
+        if self.connected:
+            return max(delay, self.safety_interval)
+        return delay
+
+    async def wait(self, login, delay):
+        """Sleep up to ``delay`` seconds. True if woken early by an event (or a lost connection)."""
+        event = self._wakeups[login.lower()]
+        try:
+            await asyncio.wait_for(event.wait(), delay)
+        except asyncio.TimeoutError:
+            return False
+        event.clear()
+        return True
+
+    # ─── Events ─────────────────────────────────────────────────────────────────
+    def went_live(self, login, started_at=None):
+        login = login.lower()
+        if login not in self.logins:
+            return
+        received = time.time()
+        labels = {"platform": self.platform}
+        metrics.PUSH_EVENTS.inc(kind="online", **labels)
+        if started_at:
+            metrics.PUSH_DELAY.observe(max(received - started_at, 0.0), **labels)
+        self.logger.info(f"Go-live event for {login}"
+                         + (f" ({received - started_at:.1f}s after stream start)" if started_at else ""))
+        self.live[login] = (started_at, time.monotonic())
+        self._wakeups[login].set()
+
+    def went_offline(self, login):
+        login = login.lower()
+        if login not in self.logins:
+            return
+        metrics.PUSH_EVENTS.inc(kind="offline", platform=self.platform)
+        self.logger.info(f"Go-offline event for {login}")
+        self.live.pop(login, None)
+
+    def _set_connected(self, connected):
+        if connected == self.connected:
+            return
+        self.connected = connected
+        metrics.PUSH_CONNECTED.set(1 if connected else 0, platform=self.platform)
+        if not connected:
+            # Waiting channels go back to their normal interval until we're back
+            for event in self._wakeups.values():
+                event.set()
+
+    # ─── Connection ─────────────────────────────────────────────────────────────
+    async def run(self):
+        url, backoff, previous = self.url, 1, None
+        while True:
+            sock = reconnect_url = None
+            opened = time.monotonic()
+            try:
+                sock = await connect(url)
+                reconnect_url = await self._session(sock, previous)
+            except (ConnectionClosed, OSError, asyncio.TimeoutError, ValueError, KeyError) as e:
+                if time.monotonic() - opened > MAX_BACKOFF:
+                    backoff = 1     # it was up for a while: not a persistent failure
+                self.logger.warning(f"Push connection lost: {e!r}. Reconnecting in {backoff}s")
+            finally:
+                if previous is not None:
+                    await previous.close()
+                previous = None
+                if sock is not None and not reconnect_url:
+                    await sock.close()
+            if reconnect_url:
+                # Server-initiated move: the subscriptions come along, the old socket is closed once we're welcomed
+                url, previous = reconnect_url, sock
+                continue
+            self._set_connected(False)
+            self.subscribed.clear()
+            url = self.url
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+    async def _session(self, sock, previous=None):
+        """Handshake, keep subscriptions in sync and dispatch messages. Returns a reconnect URL or None."""
+        keepalive = await self._hello(sock)
+        if previous is not None:
+            await previous.close()
+        self._set_connected(True)
+        subscriber = asyncio.create_task(self._keep_subscribed(sock))
+        try:
+            while True:
+                if subscriber.done():
+                    subscriber.result()     # re-raise what broke it
+                try:
+                    message = await asyncio.wait_for(sock.recv(), keepalive)
+                except asyncio.TimeoutError:
+                    if not await self._idle(sock):
+                        raise ConnectionClosed(f"nothing received for {keepalive}s")
+                    continue
+                try:
+                    message = json.loads(message)
+                except ValueError:
+                    continue
+                if not isinstance(message, dict):
+                    continue
+                reconnect_url = await self._handle(sock, message)
+                if reconnect_url:
+                    return reconnect_url
+        finally:
+            subscriber.cancel()
+            await asyncio.gather(subscriber, return_exceptions=True)
+
+    async def _keep_subscribed(self, sock):
+        while True:
+            self._changed.clear()
+            new = sorted(self.logins - self.subscribed)
+            if new:
+                await self._subscribe(sock, new)
+            await self._changed.wait()
+
+    async def _hello(self, sock):
+        """Read the server's greeting; return seconds of silence after which the connection counts as dead."""
+        raise NotImplementedError
+
+    async def _subscribe(self, sock, logins):
+        raise NotImplementedError
+
+    async def _handle(self, sock, message):
+        raise NotImplementedError
+
+    async def _idle(self, sock):
+        """Called after ``keepalive`` seconds without a message; False gives up the connection."""
+        return False
+
+
+def _request_json(url, headers, payload=None, timeout=10):
+    """Blocking JSON request (POST when ``payload`` is given). Returns (status, body)."""
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={**headers, "Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.load(resp)
+    except urllib.error.HTTPError as e:
+        try:
+            body = json.load(e)
+        except ValueError:
+            body = {}
+        return e.code, body
+
+
+# ─── Twitch ─────────────────────────────────────────────────────────────────────
+class TwitchEventSub(PushListener):
+    platform = "twitch"
+
+    def __init__(self, logger, token, client_id=WEB_CLIENT_ID, url=EVENTSUB_URL, helix_url=HELIX_URL, **kwargs):
+        super().__init__(logger, url, **kwargs)
+        self.helix_url  = helix_url.rstrip("/")
+        self.headers    = {"Authorization": f"Bearer {token}", "Client-Id": client_id}
+        self.user_ids   = {}                    # login -> broadcaster user id
+        self.session_id = None
+
+    @classmethod
+    def from_config(cls, config, logger):
+        """Return a listener if ``PushDetection`` is on and a ``TwitchToken`` is set, else None."""
+        if not config.getboolean("Settings", "PushDetection", fallback=False):
+            return None
+        token = config.get("Settings", "TwitchToken", fallback="").strip()
+        if not token:
+            logger.warning("PushDetection needs TwitchToken for Twitch EventSub; polling only.")
+            return None
+        return cls(
+            logger, token,
+            client_id=config.get("Settings", "ClientID", fallback="").strip() or WEB_CLIENT_ID,
+            url=config.get("Settings", "TwitchEventSubURL", fallback="") or EVENTSUB_URL,
+            helix_url=config.get("Settings", "TwitchHelixURL", fallback="") or HELIX_URL,
+            safety_interval=config.getint("Settings", "PushSafetyInterval", fallback=300),
+        )
+
+    def apply_config(self, config):
+        """Use a changed ``TwitchToken``/``ClientID`` for the next lookups and subscriptions."""
+        token = config.get("Settings", "TwitchToken", fallback="").strip()
+        if token:
+            self.headers = {"Authorization": f"Bearer {token}",
+                            "Client-Id": config.get("Settings", "ClientID", fallback="").strip() or WEB_CLIENT_ID}
+
+    async def _hello(self, sock):
+        message = json.loads(await asyncio.wait_for(sock.recv(), 10))
+        if message.get("metadata", {}).get("message_type") != "session_welcome":
+            raise ConnectionClosed(f"expected session_welcome, got {message.get('metadata')}")
+        session = message["payload"]["session"]
+        self.session_id = session["id"]
+        self.logger.info(f"EventSub connected (session {self.session_id})")
+        # Twitch closes the session if nothing is subscribed within 10s; _keep_subscribed does that now
+        return (session.get("keepalive_timeout_seconds") or 10) + 5
+
+    async def _lookup(self, logins):
+        missing = [login for login in logins if login not in self.user_ids]
+        for i in range(0, len(missing), 100):
+            query = "&".join(f"login={login}" for login in missing[i:i + 100])
+            status, body = await asyncio.to_thread(_request_json, f"{self.helix_url}/users?{query}", self.headers)
+            if status != 200:
+                raise ConnectionClosed(f"Helix user lookup failed ({status}): {body.get('message', '')}")
+            for user in body.get("data", []):
+                self.user_ids[user["login"].lower()] = user["id"]
+
+    async def _subscribe(self, sock, logins):
+        await self._lookup(logins)
+        for login in logins:
+            user_id = self.user_ids.get(login)
+            if user_id is None:
+                self.logger.warning(f"EventSub: no Twitch user {login!r}, polling only")
+                self.subscribed.add(login)
+                continue
+            for kind in ("stream.online", "stream.offline"):
+                payload = {
+                    "type": kind, "version": "1",
+                    "condition": {"broadcaster_user_id": user_id},
+                    "transport": {"method": "websocket", "session_id": self.session_id},
+                }
+                status, body = await asyncio.to_thread(
+                    _request_json, f"{self.helix_url}/eventsub/subscriptions", self.headers, payload)
+                if status in (401, 403):
+                    raise ConnectionClosed(f"EventSub subscription refused ({status}): {body.get('message', '')}. "
+                                           f"TwitchToken must be a user access token of the ClientID app")
+                if status not in (202, 409):        # 409: already subscribed on this session
+                    self.logger.warning(f"EventSub {kind} for {login} failed ({status}): {body.get('message', '')}")
+            self.subscribed.add(login)
+        self.logger.info(f"EventSub: watching {len(self.subscribed)} channel(s)")
+
+    async def _handle(self, sock, message):
+        kind = message.get("metadata", {}).get("message_type")
+        payload = message.get("payload") or {}
+        if kind == "notification":
+            event = payload.get("event") or {}
+            login = event.get("broadcaster_user_login", "")
+            if payload.get("subscription", {}).get("type") == "stream.online":
+                self.went_live(login, parse_time(event.get("started_at")))
+            elif payload.get("subscription", {}).get("type") == "stream.offline":
+                self.went_offline(login)
+        elif kind == "session_reconnect":
+            self.logger.info("EventSub asked to reconnect")
+            return payload["session"]["reconnect_url"]
+        elif kind == "revocation":
+            condition = payload.get("subscription", {}).get("condition", {})
+            for login, user_id in self.user_ids.items():
+                if user_id == condition.get("broadcaster_user_id"):
+                    self.logger.warning(f"EventSub subscription for {login} revoked, polling only")
+        return None
+
+
+# ─── Kick ───────────────────────────────────────────────────────────────────────
+class KickPusher(PushListener):
+    platform = "kick"
+
+    def __init__(self, logger, url=PUSHER_URL, channels_url=CHANNELS_URL, curl_bin="curl", curl_headers=None,
+                 cookies_file=None, ids_path=KICK_IDS_PATH, **kwargs):
+        super().__init__(logger, url, **kwargs)
+        self.channels_url = channels_url
+        self.curl_bin     = curl_bin
+        self.curl_headers = curl_headers
+        self.cookies_file = cookies_file
+        self.ids_path     = ids_path
+        self.channel_ids  = self._load_ids()     # slug -> Kick channel id
+        self.activity     = 120
+
+    @classmethod
+    def from_config(cls, config, logger, cookies_file=None, ids_path=KICK_IDS_PATH):
+        """Return a listener if ``PushDetection`` is on, else None."""
+        if not config.getboolean("Settings", "PushDetection", fallback=False):
+            return None
+        return cls(
+            logger,
+            url=config.get("Settings", "KickPusherURL", fallback="") or PUSHER_URL,
+            channels_url=config.get("Settings", "KickChannelsURL", fallback="") or CHANNELS_URL,
+            curl_bin=config.get("Settings", "CurlConfig", fallback="/usr/bin/curl"),
+            curl_headers=config.get("Settings", "CurlHeaders", fallback=None),
+            cookies_file=cookies_file,
+            ids_path=ids_path,
+            safety_interval=config.getint("Settings", "PushSafetyIntervalKick", fallback=600),
+        )
+
+    def _load_ids(self):
+        try:
+            with open(self.ids_path) as f:
+                return {k: int(v) for k, v in json.load(f).items()}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def _save_ids(self):
+        tmp = self.ids_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.ids_path), exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(self.channel_ids, f)
+            os.replace(tmp, self.ids_path)
+        except OSError:
+            pass
+
+    async def _lookup(self, login):
+        """Kick's channel id for ``login`` through curl-impersonate (the API sits behind the bot check)."""
+        cmd = [self.curl_bin, "-s", "-f", "--max-time", "15"]
+        if self.curl_headers:
+            cmd += ["--header", f"@{self.curl_headers}"]
+        if self.cookies_file and os.path.exists(self.cookies_file):
+            cmd += ["-b", self.cookies_file]
+        returncode, stdout, _ = await run_child(cmd + [self.channels_url.format(name=login)], capture_output=True)
+        try:
+            return int(json.loads(stdout)["id"]) if returncode == 0 else None
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    async def _hello(self, sock):
+        message = json.loads(await asyncio.wait_for(sock.recv(), 10))
+        if message.get("event") != "pusher:connection_established":
+            raise ConnectionClosed(f"expected pusher:connection_established, got {message.get('event')}")
+        data = json.loads(message.get("data") or "{}")
+        self.activity = data.get("activity_timeout") or 120
+        self.logger.info(f"Pusher connected (socket {data.get('socket_id')})")
+        return self.activity
+
+    async def _subscribe(self, sock, logins):
+        changed = False
+        for login in logins:
+            if login not in self.channel_ids:
+                channel_id = await self._lookup(login)
+                if channel_id is None:
+                    # Try again on the next connection; until then the channel just polls
+                    self.logger.warning(f"Pusher: could not look up Kick channel id of {login}, polling only")
+                    continue
+                self.channel_ids[login] = channel_id
+                changed = True
+            await sock.send(json.dumps({"event": "pusher:subscribe",
+                                        "data": {"auth": "", "channel": f"channel.{self.channel_ids[login]}"}}))
+            self.subscribed.add(login)
+        if changed:
+            await asyncio.to_thread(self._save_ids)
+        self.logger.info(f"Pusher: watching {len(self.subscribed)} channel(s)")
+
+    async def _idle(self, sock):
+        # Pusher protocol: ping after activity_timeout, the server answers with pusher:pong
+        await sock.send(json.dumps({"event": "pusher:ping", "data": {}}))
+        try:
+            message = await asyncio.wait_for(sock.recv(), 30)
+        except asyncio.TimeoutError:
+            return False
+        try:
+            message = json.loads(message)
+        except ValueError:
+            return True
+        if isinstance(message, dict) and message.get("event") != "pusher:pong":
+            await self._handle(sock, message)
+        return True
+
+    async def _handle(self, sock, message):
+        event = message.get("event")
+        if event == "pusher:ping":
+            await sock.send(json.dumps({"event": "pusher:pong", "data": {}}))
+            return None
+        if event == "pusher:error":
+            self.logger.warning(f"Pusher error: {message.get('data')}")
+            return None
+        if event not in (KICK_LIVE, KICK_OFFLINE):
+            return None
+        channel_id = message.get("channel", "").rpartition(".")[2]
+        login = next((login for login, cid in self.channel_ids.items() if str(cid) == channel_id), None)
+        if login is None:
+            return None
+        if event == KICK_LIVE:
+            try:
+                livestream = json.loads(message.get("data") or "{}").get("livestream") or {}
+            except (ValueError, AttributeError):
+                livestream = {}
+            self.went_live(login, parse_time(livestream.get("created_at")))
+        else:
+            self.went_offline(login)
+        return None
+
+
+async def wait_for_poll(push, login, delay):
+    """Sleep ``delay`` seconds, or until ``push`` reports ``login`` going live. True if woken early."""
+    if push is None:
+        await asyncio.sleep(delay)
+        return False
+    return await push.wait(login, delay)
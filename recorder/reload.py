@@ -0,0 +1,259 @@
+"""Live reload of settings.config and the channel list, and draining on SIGTERM.
+
+Changing a setting or adding a streamer used to mean restarting the
+recorder, killing every capture in progress. ``ConfigReloader`` watches
+``settings.config`` (and the supervisor's channel list) with inotify, or by
+polling mtimes where inotify isn't available, and applies changes in place:
+
+* the shared ``ConfigParser`` is updated, so everything that reads it per
+  capture (spool, segments, ...) sees the new values at the next capture;
+* the log pipeline switches ``LogFormat`` and picks up a new token to mask;
+* channels re-read the settings they keep in attributes (``apply_config``):
+  tokens, ``ExtraArgs``/``YtDlpArgs``, retry times, stream URLs, target
+  qualities, priorities and capture limits are used from the next probe on;
+* settings of the shared components (metrics, migrator, remuxer, storage,
+  push, simulcast, admission, start recovery, concurrency cap) are logged as
+  needing a restart.
+
+A removed channel stops polling at once but finishes the recording it is in.
+On SIGTERM every channel stops polling and running captures get up to
+``DrainTimeout`` seconds to end on their own before they are stopped, which
+closes their files, spools and catalog entries properly.
+"""
+import os
+import time
+import ctypes
+import signal
+import struct
+import asyncio
+import ctypes.util
+import configparser
+
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO    = 0x080
+IN_CREATE      = 0x100
+IN_DELETE      = 0x200
+IN_NONBLOCK    = 0o4000
+IN_CLOEXEC     = 0o2000000
+EVENT_HEADER   = struct.Struct("iIII")      # wd, mask, cookie, name length
+
+# Settings the channels pick up live; anything else changed is reported as needing a restart
+LIVE_KEYS = {
+    "twitchtoken", "clientid", "retrytime", "retrytimekick", "extraargs", "ytdlpargs", "curlconfig", "curlheaders",
+    "restartstreamifbetterqualityisavailable", "restartstreamifbetterqualitycheckdelaytime",
+    "upgradequalitywhilerecording", "upgradequalityoverlap",
+    "twitchstreamurl", "kickstreamurl", "kickcookieurl", "recordasts", "stallwatchdog", "stallminrate",
+    "stalltimeout", "stallsampleinterval", "channelpriorities", "capturenice", "captureiopriority", "capturescope",
+    "midstreamfailover", "segmentminutes", "nasstalltimeout", "draintimeout", "adaptivepolling",
+    "adaptivepollingfastinterval", "adaptivepollingmaxinterval", "adaptivepollingfastintervalkick",
+    "adaptivepollingmaxintervalkick", "logformat",
+}
+
+
+def _load_inotify():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        return libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError, TypeError):
+        return None
+
+
+_inotify = _load_inotify()
+
+
+class FileWatcher:
+    """Waits until one of ``paths`` is written, replaced, created or deleted.
+
+    Watches the directories rather than the files: editors and ``sed -i``
+    replace a file with a new one, which a watch on the old inode would miss.
+    Without inotify the files' mtime/size are polled every ``interval`` seconds.
+    """
+
+    def __init__(self, paths, interval=5, settle=0.5):
+        self.paths    = {os.path.abspath(p) for p in paths}
+        self.interval = interval
+        self.settle   = settle              # editors write in several steps; wait for the last one
+        self.changed  = set()
+        self.fd       = None
+        self.dirs     = {}                  # watch descriptor -> directory
+        self._event   = asyncio.Event()
+        self._start_inotify()
+
+    def _start_inotify(self):
+        if _inotify is None:
+            return
+        init, add_watch = _inotify
+        fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+        for directory in {os.path.dirname(p) for p in self.paths}:
+            wd = add_watch(fd, os.fsencode(directory), mask)
+            if wd >= 0:
+                self.dirs[wd] = directory
+        if not self.dirs:
+            os.close(fd)
+            return
+        self.fd = fd
+        asyncio.get_running_loop().add_reader(fd, self._read)
+
+    def _read(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            path = os.path.join(self.dirs.get(wd, ""), name)
+            if path in self.paths:
+                self.changed.add(path)
+                self._event.set()
+
+    def _signatures(self):
+        signatures = {}
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                signatures[path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+            except OSError:
+                signatures[path] = None
+        return signatures
+
+    async def wait(self):
+        """The set of paths that changed since the last call."""
+        if self.fd is None:
+            before = self._signatures()
+            while True:
+                await asyncio.sleep(self.interval)
+                after = self._signatures()
+                changed = {p for p in self.paths if before[p] != after[p]}
+                if changed:
+                    return changed
+        await self._event.wait()
+        await asyncio.sleep(self.settle)
+        self._event.clear()
+        changed, self.changed = self.changed, set()
+        return changed
+
+    def close(self):
+        if self.fd is not None:
+            asyncio.get_running_loop().remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = None
+
+
+class ConfigReloader:
+    """Applies changes to ``config_path`` to ``config`` in place, then calls ``listeners(config)``.
+
+    ``channels_path`` and ``on_channels`` (a coroutine function) do the same
+    for the supervisor's channel list.
+    """
+
+    def __init__(self, logger, config, config_path, listeners=(), channels_path=None, on_channels=None):
+        self.logger        = logger
+        self.config        = config
+        self.config_path   = os.path.abspath(config_path)
+        self.listeners     = list(listeners)
+        self.channels_path = channels_path and os.path.abspath(channels_path)
+        self.on_channels   = on_channels
+
+    async def run(self):
+        watcher = FileWatcher([p for p in (self.config_path, self.channels_path) if p])
+        self.logger.info(f"Watching {self.config_path}" + (f" and {self.channels_path}" if self.channels_path else "")
+                         + (" (inotify)" if watcher.fd is not None else f" (every {watcher.interval}s)"))
+        try:
+            while True:
+                changed = await watcher.wait()
+                if self.config_path in changed:
+                    self.reload()
+                if self.channels_path in changed and self.on_channels is not None:
+                    await self.on_channels()
+        finally:
+            watcher.close()
+
+    def reload(self):
+        """Re-read the config file. A file that doesn't parse is reported and ignored."""
+        fresh = configparser.ConfigParser()
+        try:
+            if not fresh.read(self.config_path):
+                raise OSError(f"cannot read {self.config_path}")
+        except (OSError, configparser.Error) as e:
+            self.logger.error(f"Not reloading settings: {e}")
+            return set()
+
+        old = dict(self.config["Settings"]) if self.config.has_section("Settings") else {}
+        new = dict(fresh["Settings"]) if fresh.has_section("Settings") else {}
+        changed = {key for key in old.keys() | new.keys() if old.get(key) != new.get(key)}
+        if not changed:
+            return changed
+        for section in self.config.sections():
+            self.config.remove_section(section)
+        self.config.read_dict(fresh)
+
+        for listener in self.listeners:
+            try:
+                listener(self.config)
+            except Exception as e:
+                self.logger.error(f"Applying reloaded settings failed: {e!r}")
+        self.logger.info(f"Reloaded settings: {', '.join(sorted(changed))}")
+        restart = sorted(changed - LIVE_KEYS)
+        if restart:
+            self.logger.warning(f"Changed settings that only apply after a restart: {', '.join(restart)}")
+        return changed
+
+
+# ─── Stopping channels ──────────────────────────────────────────────────────────
+async def retire(channel, task, timeout=None):
+    """Stop ``channel``'s ``record_stream`` task: at once if it's idle, else once its capture ends.
+
+    With ``timeout`` a capture still running after that many seconds is
+    stopped; its output is closed the same way as at the end of a stream.
+    """
+    channel.retiring = True
+    if channel.capturing:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        channel.logger.info("Finishing the current recording before stopping"
+                            + (f" (at most {timeout:.0f}s)" if timeout is not None else ""))
+        while channel.capturing and not task.done():
+            if deadline is not None and time.monotonic() >= deadline:
+                channel.logger.warning("Recording still running, stopping it")
+                break
+            await asyncio.sleep(1)
+    if not task.done():
+        task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def drain_timeout(config):
+    return config.getint("Settings", "DrainTimeout", fallback=120)
+
+
+async def run_service(logger, config, channel, *background, reloader=None):
+    """Run one channel with its background jobs (None entries are skipped) until SIGTERM, then drain.
+
+    Like ``run_all`` an exception in any of them ends the whole run.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    task = asyncio.create_task(channel.record_stream())
+    others = [asyncio.create_task(c) for c in (*background, reloader and reloader.run()) if c is not None]
+    everything = asyncio.gather(task, *others)
+    stopper = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait({everything, stopper}, return_when=asyncio.FIRST_COMPLETED)
+        if everything.done():
+            return everything.result()
+        logger.info("SIGTERM received, draining")
+        await retire(channel, task, drain_timeout(config))
+        for other in others:
+            other.cancel()
+        await asyncio.gather(everything, return_exceptions=True)
+        logger.info("Stopped")
+    finally:
+        stopper.cancel()
+        loop.remove_signal_handler(signal.SIGTERM)
@@ -0,0 +1,229 @@
+"""Capture to MPEG-TS, remux to MP4 afterwards.
+
+An MP4 written live by streamlink/yt-dlp is unplayable or seeks badly when
+the capture is killed (systemd restart, NAS drop, OOM). MPEG-TS survives any
+cut, so with ``RecordAsTS=true`` captures are written as ``.ts`` and the
+``Remuxer`` turns each finished one into an ``.mp4`` afterwards:
+
+* ``ffmpeg -c copy -movflags +faststart`` (no re-encode) of the video and
+  audio streams (Twitch's ID3 data stream can't go into MP4), into a hidden
+  temp file that is renamed into place; the ``.ts`` is deleted only after
+  ffmpeg succeeded,
+* at most ``RemuxWorkers`` at a time (never more than the CPU count), under
+  ``nice``/``ionice -c 3`` so remuxing never takes I/O or CPU from a live
+  capture,
+* jobs are kept in ``state/`` so they survive restarts, and the recording
+  directories are rescanned for ``.ts`` files left over from crashes,
+* the ``.ts`` is ``flock``ed while it is remuxed, so of the recorder
+  processes that all scan the same directories only one takes it,
+* progress and throughput are logged while ffmpeg runs.
+
+With ``RecordLocalFirst`` the remux happens on local disk and the ``.mp4``
+is then handed to the migrator.
+"""
+import os
+import time
+import fcntl
+import shutil
+import asyncio
+
+from . import metrics
+from .common import STATE_DIR, spawn
+from .migrate import MIN_AGE, RESCAN_TIME, SPOOL_PART_RE, MigrationQueue
+from .spool import SIDECAR_EXT
+
+TS_EXT = ".ts"
+MP4_EXT = ".mp4"
+RETRY_TIME = 1800
+PROGRESS_INTERVAL = 30
+
+
+def capture_ext(config):
+    """File extension new captures are written with."""
+    return TS_EXT if config.getboolean("Settings", "RecordAsTS", fallback=False) else MP4_EXT
+
+
+class Remuxer:
+    def __init__(self, queue, logger, workers=1, nice=10, idle_io=True, dirs=(), migrator=None, ffmpeg="ffmpeg"):
+        self.queue    = queue
+        self.logger   = logger
+        self.workers  = max(1, min(workers, os.cpu_count() or 1))
+        self.nice     = nice
+        self.idle_io  = idle_io
+        self.dirs     = list(dirs)              # (fallback_dir, external_dir) pairs to rescan
+        self.migrator = migrator
+        self.ffmpeg   = ffmpeg
+        self.active   = set()                   # paths still being recorded
+        self.running  = set()                   # sources a worker is remuxing right now
+        self.catalog  = None
+        if migrator is not None:
+            # The migrator moves the .mp4 once we're done, not the .ts
+            migrator.skip_exts.add(TS_EXT)
+
+    @classmethod
+    def from_config(cls, config, logger, name, dirs=(), migrator=None):
+        """Return a remuxer if captures are written as TS and ``RemuxToMP4`` is on, else None."""
+        if capture_ext(config) != TS_EXT or not config.getboolean("Settings", "RemuxToMP4", fallback=True):
+            return None
+        workers = config.getint("Settings", "RemuxWorkers", fallback=0) or max(1, (os.cpu_count() or 2) // 2)
+        return cls(
+            MigrationQueue(os.path.join(STATE_DIR, f"remux-{name}.json")),
+            logger,
+            workers=workers,
+            nice=config.getint("Settings", "RemuxNice", fallback=10),
+            idle_io=config.getboolean("Settings", "RemuxIdleIO", fallback=True),
+            dirs=dirs,
+            migrator=migrator,
+        )
+
+    # ─── Producers ──────────────────────────────────────────────────────────────
+    def enqueue(self, path, dest_dir=None):
+        """Queue a finished ``.ts``; ``dest_dir`` is where the migrator should move the ``.mp4``."""
+        self.active.discard(path)
+        if path and path.endswith(TS_EXT) and os.path.isfile(path) and self.queue.add(path, dest_dir):
+            self.logger.info(f"Queued for remux: {path}")
+            metrics.REMUX_PENDING.set(len(self.queue.jobs))
+
+    def scan(self):
+        """Queue ``.ts`` files left behind by crashes or restarts."""
+        now = time.time()
+        for fallback_dir, external_dir in self.dirs:
+            for directory, dest_dir in ((fallback_dir, external_dir if self.migrator else None), (external_dir, None)):
+                try:
+                    names = os.listdir(directory)
+                except OSError:
+                    continue
+                pending = {n[:-len(SIDECAR_EXT)] for n in names if n.endswith(SIDECAR_EXT)}
+                for name in names:
+                    path = os.path.join(directory, name)
+                    stem, ext = os.path.splitext(name)
+                    if (ext != TS_EXT or name.startswith(".") or name in pending
+                            or SPOOL_PART_RE.search(stem) or path in self.active):
+                        continue
+                    try:
+                        if now - os.path.getmtime(path) < MIN_AGE:
+                            continue
+                    except OSError:
+                        continue
+                    self.enqueue(path, dest_dir)
+
+    # ─── Remux ──────────────────────────────────────────────────────────────────
+    def _command(self, src, tmp):
+        cmd = []
+        if self.idle_io and shutil.which("ionice"):
+            cmd += ["ionice", "-c", "3"]
+        if self.nice:
+            cmd += ["nice", "-n", str(self.nice)]
+        return cmd + [
+            self.ffmpeg, "-hide_banner", "-nostdin", "-nostats", "-loglevel", "error", "-y",
+            # Video and audio only: the mp4 muxer rejects Twitch's timed_id3 data stream
+            "-i", src, "-map", "0:v?", "-map", "0:a?", "-c", "copy", "-movflags", "+faststart",
+            "-progress", "pipe:1", "-f", "mp4", tmp,
+        ]
+
+    async def remux(self, src):
+        """Remux ``src`` next to itself. Returns the ``.mp4`` path, or None on failure or if another process has it."""
+        with open(src, "rb") as f:
+            # Every recorder process scans the same directories; only one may remux a file
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.logger.debug(f"{src} is being remuxed by another process")
+                return None
+            try:
+                current = os.stat(src).st_ino
+            except FileNotFoundError:
+                current = None
+            if current != os.fstat(f.fileno()).st_ino:
+                return None     # remuxed and removed by another process while we were opening it
+            return await self._remux(src)
+
+    async def _remux(self, src):
+        dest = os.path.splitext(src)[0] + MP4_EXT
+        tmp = os.path.join(os.path.dirname(src), f".{os.path.basename(dest)}.remux")
+        size = os.path.getsize(src)
+
+        proc = await spawn(self._command(src, tmp), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        started = last_report = time.monotonic()
+        done = 0
+
+        async def read_progress():
+            nonlocal done, last_report
+            # ffmpeg -progress writes key=value blocks; total_size is the output so far
+            while line := await proc.stdout.readline():
+                key, _, value = line.decode(errors="replace").strip().partition("=")
+                if key == "total_size" and value.isdigit():
+                    done = int(value)
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    rate = done / (last_report - started) / 1024 ** 2
+                    self.logger.info(f"Remuxing {os.path.basename(src)}: {min(done / size, 1) if size else 0:.0%} "
+                                     f"({rate:.1f} MiB/s)")
+
+        try:
+            _, stderr = await asyncio.gather(read_progress(), proc.stderr.read())
+            await proc.wait()
+        except asyncio.CancelledError:
+            if proc.returncode is None:
+                proc.terminate()
+                await proc.wait()
+            raise
+
+        if proc.returncode != 0 or not os.path.exists(tmp) or os.path.getsize(tmp) == 0:
+            self.logger.error(f"Remux of {src} failed (Code {proc.returncode}): "
+                              f"{stderr.decode(errors='replace').strip()[:200]}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return None
+
+        os.replace(tmp, dest)
+        os.remove(src)
+        elapsed = time.monotonic() - started
+        metrics.REMUX_BYTES.inc(size)
+        self.logger.info(f"Remuxed {src} -> {dest} ({size / 1024 ** 2:.0f} MiB in {elapsed:.0f}s, "
+                         f"{size / elapsed / 1024 ** 2 if elapsed > 0 else 0:.1f} MiB/s)")
+        return dest
+
+    async def _worker(self):
+        while True:
+            job = self.queue.next_ready(exclude=self.running)
+            if job is None:
+                await asyncio.sleep(30)
+                continue
+
+            src, dest_dir = job["src"], job["dest_dir"]
+            if not os.path.exists(src):
+                self.queue.remove(src)
+                continue
+            self.running.add(src)
+            try:
+                dest = await self.remux(src)
+            except OSError as e:
+                self.logger.warning(f"Remux of {src} interrupted: {e}")
+                dest = None
+            finally:
+                self.running.discard(src)
+            if dest is None:
+                self.queue.defer(src, RETRY_TIME)
+                continue
+            self.queue.remove(src)
+            metrics.REMUX_PENDING.set(len(self.queue.jobs))
+            if self.catalog is not None:
+                self.catalog.move_file(src, dest)
+            if dest_dir and self.migrator is not None:
+                self.migrator.enqueue(dest, dest_dir)
+
+    async def _rescan(self):
+        while True:
+            await asyncio.to_thread(self.scan)
+            await asyncio.sleep(RESCAN_TIME)
+
+    async def run(self):
+        tasks = [asyncio.create_task(self._rescan())]
+        tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # One worker failing takes the pool down; the caller restarts it whole
+            for task in tasks:
+                task.cancel()
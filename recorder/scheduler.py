@@ -0,0 +1,164 @@
+"""History-driven poll scheduling.
+
+The fixed ``RetryTime``/``RetryTimeKick`` loop pays the same number of
+requests at 4 a.m. as in the minutes before a streamer usually goes live,
+and still loses up to one full interval of every stream. ``PollScheduler``
+keeps the last go-live times of a channel and:
+
+* polls every ``fast_interval`` seconds inside a window around the
+  time of day the channel usually starts,
+* outside those windows backs off exponentially from ``base_interval`` up to
+  ``max_interval`` with random jitter, but never sleeps past the start of
+  the next hot window,
+* after repeated 403s backs off harder (``blocked_backoff`` per 403 in a
+  row) up to ``max_interval``; a single 403 keeps the regular pace, and the
+  first poll that isn't blocked ends the back-off.
+
+``python -m recorder.simulate`` replays schedules against it to compare
+detection latency and request counts with the fixed loop.
+"""
+import os
+import json
+import time
+import random
+
+DAY = 86400
+MIN_GAP_BETWEEN_STARTS = 3600   # go-lives closer than this are the same session
+
+
+class PollScheduler:
+    def __init__(self, base_interval, fast_interval=5, max_interval=None, window_before=1800, window_after=900,
+                 backoff=1.5, jitter=0.2, blocked_backoff=3.0, history_size=60,
+                 history_path=None, rng=None):
+        self.base_interval   = base_interval
+        self.fast_interval   = min(fast_interval, base_interval)
+        self.max_interval    = max_interval or base_interval * 4
+        self.window_before   = window_before
+        self.window_after    = window_after
+        self.backoff         = backoff
+        self.jitter          = jitter
+        self.blocked_backoff = blocked_backoff
+        self.history_size    = history_size
+        self.history_path    = history_path
+        self.rng             = rng or random.Random()
+
+        self.history       = []      # unix timestamps of past go-lives, oldest first
+        self.misses        = 0       # consecutive cold offline polls
+        self.blocked_count = 0       # consecutive 403s
+        self._load()
+
+    @classmethod
+    def from_config(cls, config, base_interval, history_path=None, suffix="", default_fast=5):
+        """Return a scheduler if ``AdaptivePolling`` is enabled, else None (fixed interval).
+
+        ``suffix`` selects per-platform keys, e.g. ``AdaptivePollingFastIntervalKick``.
+        """
+        if not config.getboolean("Settings", "AdaptivePolling", fallback=False):
+            return None
+        return cls(
+            base_interval,
+            fast_interval=config.getint("Settings", f"AdaptivePollingFastInterval{suffix}", fallback=default_fast),
+            max_interval=config.getint("Settings", f"AdaptivePollingMaxInterval{suffix}", fallback=base_interval * 4),
+            history_path=history_path,
+        )
+
+    # ─── History ────────────────────────────────────────────────────────────────
+    def _load(self):
+        if not self.history_path or not os.path.exists(self.history_path):
+            return
+        try:
+            with open(self.history_path) as f:
+                self.history = sorted(float(t) for t in json.load(f).get("go_live", []))[-self.history_size:]
+        except (OSError, ValueError, AttributeError):
+            self.history = []
+
+    def _save(self):
+        if not self.history_path:
+            return
+        tmp = self.history_path + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(self.history_path), exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump({"go_live": self.history}, f)
+            os.replace(tmp, self.history_path)
+        except OSError:
+            pass
+
+    def record_go_live(self, ts=None):
+        """Remember a go-live time. Repeats within one session are ignored."""
+        ts = time.time() if ts is None else ts
+        if self.history and abs(ts - self.history[-1]) < MIN_GAP_BETWEEN_STARTS:
+            return
+        self.history.append(ts)
+        self.history = sorted(self.history)[-self.history_size:]
+        self._save()
+
+    # ─── Windows ────────────────────────────────────────────────────────────────
+    def _offsets(self, now):
+        """Signed seconds from ``now`` to each historic start's time of day, in (-DAY/2, DAY/2]."""
+        tod = now % DAY
+        for start in self.history:
+            d = (start % DAY) - tod
+            if d > DAY / 2:
+                d -= DAY
+            elif d <= -DAY / 2:
+                d += DAY
+            yield d
+
+    def _min_hits(self):
+        # A one-off start at an odd hour shouldn't open a daily window once there is real history
+        return 1 if len(self.history) < 5 else 2
+
+    def in_hot_window(self, now=None):
+        now = time.time() if now is None else now
+        hits = sum(1 for d in self._offsets(now) if -self.window_after <= d <= self.window_before)
+        return hits >= self._min_hits()
+
+    def seconds_until_hot(self, now=None):
+        """Seconds until the next hot window opens (0 if inside one, None without history)."""
+        now = time.time() if now is None else now
+        if not self.history:
+            return None
+        if self.in_hot_window(now):
+            return 0
+        # The window opens when the min_hits-th start comes within window_before
+        waits = sorted((d - self.window_before) % DAY for d in self._offsets(now))
+        return waits[self._min_hits() - 1] if len(waits) >= self._min_hits() else None
+
+    # ─── Delays ─────────────────────────────────────────────────────────────────
+    def _jittered(self, delay):
+        return delay * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def next_delay(self, outcome, now=None):
+        """Seconds to wait before the next poll.
+
+        ``outcome`` of the poll that just finished: ``"offline"``, ``"live"``
+        (a recording just ended), ``"blocked"`` (HTTP 403) or ``"error"``.
+        """
+        now = time.time() if now is None else now
+        if outcome != "blocked":
+            self.blocked_count = 0
+            return self._regular_delay(outcome, now)
+
+        # The cookies were refreshed on the 403; only a run of them slows polling down
+        self.blocked_count += 1
+        delay = self._regular_delay("offline", now)
+        return min(delay * self.blocked_backoff ** (self.blocked_count - 1), max(delay, self.max_interval))
+
+    def _regular_delay(self, outcome, now):
+        if outcome == "live":
+            # A stream that just ended may come straight back after a crash
+            self.misses = 0
+            return self._jittered(self.base_interval)
+
+        if self.in_hot_window(now):
+            self.misses = 0
+            return self._jittered(self.fast_interval)
+
+        self.misses += 1
+        delay = min(self.max_interval, self.base_interval * self.backoff ** (self.misses - 1))
+        delay = self._jittered(delay)
+        until_hot = self.seconds_until_hot(now)
+        if until_hot is not None:
+            delay = min(delay, max(until_hot, self.fast_interval))
+        return delay
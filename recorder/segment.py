@@ -0,0 +1,177 @@
+"""Time-based segmenting of an MPEG-TS capture.
+
+With ``SegmentMinutes`` set, ``SpoolWriter`` rolls a ``.ts`` capture into
+``<name>-seg0001.ts``, ``<name>-seg0002.ts``, ... instead of one file that
+grows for the whole stream. ``TSCutter`` watches the packets going through
+and only cuts right before a video keyframe, at a packet boundary, so no
+packet is dropped and every segment starts decodable: the latest PAT/PMT are
+repeated at the top of each new segment, and concatenating the segments
+gives back the stream.
+
+Durations come from the video PTS. ``<name>.manifest.json`` lists the
+segments in order and ``python -m recorder.concat`` joins them again.
+"""
+import os
+import json
+
+TS_PACKET   = 188
+SYNC_BYTE   = 0x47
+PTS_WRAP    = 1 << 33
+PTS_HZ      = 90000
+H264        = 0x1b
+VIDEO_TYPES = {0x01, 0x02, 0x10, H264, 0x24}    # MPEG-1/2, MPEG-4 part 2, H.264, HEVC
+MANIFEST_EXT = ".manifest.json"
+
+
+def segment_name(filename, index):
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}-seg{index:04d}{ext}"
+
+
+def manifest_name(filename):
+    return os.path.splitext(filename)[0] + MANIFEST_EXT
+
+
+def _parse_pts(b):
+    return (((b[0] >> 1) & 0x07) << 30 | b[1] << 22 | (b[2] >> 1) << 15 | b[3] << 7 | b[4] >> 1)
+
+
+class TSCutter:
+    """Find keyframe cut points in a TS byte stream fed in arbitrary chunks."""
+
+    def __init__(self, segment_seconds):
+        self.segment_seconds = segment_seconds
+        self.pmt_pid    = None
+        self.video_pid  = None
+        self.video_type = None
+        self.pat        = None          # latest PAT/PMT packets, repeated at each cut
+        self.pmt        = None
+        self.start_pts  = None          # PTS of the current segment's first keyframe
+        self.last_pts   = None
+        self.broken     = False         # lost sync: pass everything through uncut
+        self._carry     = b""
+
+    def elapsed(self, pts=None):
+        pts = self.last_pts if pts is None else pts
+        if pts is None or self.start_pts is None:
+            return 0.0
+        return ((pts - self.start_pts) % PTS_WRAP) / PTS_HZ
+
+    def feed(self, chunk):
+        """Split ``chunk`` into ``[data, (header, duration), data, ...]``.
+
+        Byte strings are to be written to the current segment. A tuple means:
+        end the current segment (``duration`` seconds long) and start the
+        next one with ``header`` (PAT+PMT) before the data that follows.
+        """
+        if self.broken:
+            return [chunk]
+        data = self._carry + chunk
+        usable = len(data) - len(data) % TS_PACKET
+        self._carry = data[usable:]
+
+        out, start = [], 0
+        for pos in range(0, usable, TS_PACKET):
+            if data[pos] != SYNC_BYTE:
+                # Not (or no longer) packet-aligned TS; stop cutting rather than guess
+                self.broken = True
+                out.append(data[start:])
+                self._carry = b""
+                return out
+            pts = self._inspect(data, pos)
+            if pts is not None:
+                if self.start_pts is None:
+                    self.start_pts = pts
+                elif self.elapsed(pts) >= self.segment_seconds and self.pat and self.pmt:
+                    duration = self.elapsed(pts)
+                    if pos > start:
+                        out.append(data[start:pos])
+                    out.append((self.pat + self.pmt, duration))
+                    start = pos
+                    self.start_pts = pts
+        if usable > start:
+            out.append(data[start:usable])
+        return out
+
+    def flush(self):
+        """Bytes still held back waiting for the rest of a packet."""
+        rest, self._carry = self._carry, b""
+        return rest
+
+    def _inspect(self, data, pos):
+        """Track PAT/PMT/PTS; return the PTS if this packet starts a video keyframe."""
+        b1, b2, b3 = data[pos + 1], data[pos + 2], data[pos + 3]
+        pid = (b1 & 0x1f) << 8 | b2
+        pusi = b1 & 0x40
+        payload = pos + 4
+        rai = False
+        if b3 & 0x20:       # adaptation field
+            af_len = data[payload]
+            rai = af_len > 0 and bool(data[payload + 1] & 0x40)
+            payload += 1 + af_len
+        if not b3 & 0x10 or payload >= pos + TS_PACKET:
+            return None
+        end = pos + TS_PACKET
+
+        if pid == 0 and pusi:
+            self.pat = bytes(data[pos:end])
+            self._parse_pat(data, payload + 1 + data[payload], end)
+        elif pid == self.pmt_pid and pusi:
+            self.pmt = bytes(data[pos:end])
+            self._parse_pmt(data, payload + 1 + data[payload], end)
+        elif pid == self.video_pid and pusi:
+            pes = data[payload:end]
+            if len(pes) < 14 or pes[:3] != b"\x00\x00\x01" or not pes[7] & 0x80:
+                return None
+            pts = _parse_pts(pes[9:14])
+            self.last_pts = pts
+            if rai or (self.video_type == H264 and self._has_idr(pes[9 + pes[8]:])):
+                return pts
+        return None
+
+    def _parse_pat(self, data, sec, end):
+        if sec + 8 > end or data[sec] != 0x00:
+            return
+        section_end = min(end, sec + 3 + ((data[sec + 1] & 0x0f) << 8 | data[sec + 2]) - 4)
+        for i in range(sec + 8, section_end - 3, 4):
+            program = data[i] << 8 | data[i + 1]
+            if program:
+                self.pmt_pid = (data[i + 2] & 0x1f) << 8 | data[i + 3]
+                return
+
+    def _parse_pmt(self, data, sec, end):
+        if sec + 12 > end or data[sec] != 0x02:
+            return
+        section_end = min(end, sec + 3 + ((data[sec + 1] & 0x0f) << 8 | data[sec + 2]) - 4)
+        i = sec + 12 + ((data[sec + 10] & 0x0f) << 8 | data[sec + 11])
+        while i + 5 <= section_end:
+            stream_type = data[i]
+            if stream_type in VIDEO_TYPES:
+                self.video_pid = (data[i + 1] & 0x1f) << 8 | data[i + 2]
+                self.video_type = stream_type
+                return
+            i += 5 + ((data[i + 3] & 0x0f) << 8 | data[i + 4])
+
+    @staticmethod
+    def _has_idr(es):
+        """H.264 SPS (7) or IDR slice (5) in the first bytes of an access unit."""
+        i = es.find(b"\x00\x00\x01")
+        while i != -1 and i + 3 < len(es):
+            if (es[i + 3] & 0x1f) in (5, 7):
+                return True
+            i = es.find(b"\x00\x00\x01", i + 3)
+        return False
+
+
+def write_manifest(path, filename, segment_seconds, segments, complete):
+    """Atomically (re)write a session manifest."""
+    data = {
+        "session": filename,
+        "segment_seconds": segment_seconds,
+        "complete": complete,
+        "segments": segments,
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
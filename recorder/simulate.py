@@ -0,0 +1,138 @@
+"""Replay stream schedules against the fixed loop and the adaptive scheduler.
+
+Usage::
+
+    python -m recorder.simulate --synthetic 60 --start-hour 19 --interval 30
+    python -m recorder.simulate schedule.json --interval 120
+
+A schedule file maps channel names to lists of ``[start, end]`` pairs, as
+unix timestamps or ISO-8601 strings::
+
+    {"roflgator": [["2026-03-01T19:02:00Z", "2026-03-01T23:40:00Z"], ...]}
+
+For each policy the report shows how long after going live each stream was
+detected (median and p90) and how many polls it cost in total.
+"""
+import json
+import random
+import statistics
+from datetime import datetime, timezone
+
+from .scheduler import DAY, PollScheduler
+
+
+def _ts(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def load_schedule(path):
+    with open(path) as f:
+        raw = json.load(f)
+    return {name: sorted((_ts(s), _ts(e)) for s, e in sessions) for name, sessions in raw.items()}
+
+
+def synthetic_schedule(days, start_hour=19.0, spread_minutes=20, stream_probability=0.8,
+                       off_schedule_probability=0.1, hours=4.0, seed=1):
+    """One channel that usually starts around ``start_hour`` UTC, sometimes at random times."""
+    rng = random.Random(seed)
+    t0 = datetime(2026, 1, 1, tzinfo=timezone.utc).timestamp()
+    sessions = []
+    for day in range(days):
+        if rng.random() > stream_probability:
+            continue
+        if rng.random() < off_schedule_probability:
+            start = t0 + day * DAY + rng.uniform(8, 23) * 3600
+        else:
+            start = t0 + day * DAY + start_hour * 3600 + rng.gauss(0, spread_minutes * 60)
+        sessions.append((start, start + rng.uniform(0.5, 1.5) * hours * 3600))
+    return sessions
+
+
+def _simulate(sessions, next_delay, on_detect, block_rate, rng):
+    """Walk the timeline poll by poll. Returns (latencies, polls)."""
+    latencies, polls = [], 0
+    t = sessions[0][0] - DAY + rng.uniform(0, 60)
+    end_of_time = sessions[-1][1] + 3600
+    i = 0
+    while t < end_of_time and i < len(sessions):
+        # Skip sessions that ended while we were asleep
+        while i < len(sessions) and sessions[i][1] <= t:
+            i += 1
+        if i == len(sessions):
+            break
+        polls += 1
+        start, end = sessions[i]
+        if block_rate and rng.random() < block_rate:
+            t += next_delay("blocked", t)
+        elif start <= t < end:
+            latencies.append(t - start)
+            on_detect(start, t)
+            t = end
+            t += next_delay("live", t)
+        else:
+            t += next_delay("offline", t)
+    return latencies, polls
+
+
+def run(sessions, interval, fast_interval=5, max_interval=None, block_rate=0.0, learn_from="start", seed=1):
+    rng = random.Random(seed)
+    results = {}
+
+    latencies, polls = _simulate(sessions, lambda outcome, now: interval, lambda s, t: None, block_rate, rng)
+    results["fixed"] = (latencies, polls)
+
+    rng = random.Random(seed)
+    sched = PollScheduler(interval, fast_interval=fast_interval, max_interval=max_interval, rng=random.Random(seed))
+    learn = (lambda s, t: sched.record_go_live(s)) if learn_from == "start" else (lambda s, t: sched.record_go_live(t))
+    latencies, polls = _simulate(sessions, lambda outcome, now: sched.next_delay(outcome, now), learn, block_rate, rng)
+    results["adaptive"] = (latencies, polls)
+    return results
+
+
+def _report(name, results, days):
+    print(f"== {name} ==")
+    for policy, (latencies, polls) in results.items():
+        if latencies:
+            p90 = sorted(latencies)[int(0.9 * (len(latencies) - 1))]
+            lat = f"median {statistics.median(latencies):6.1f}s  p90 {p90:6.1f}s"
+        else:
+            lat = "no sessions detected"
+        print(f"  {policy:8} detected {len(latencies):3}  {lat}  polls {polls:7}  ({polls / max(days, 1):.0f}/day)")
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare fixed and adaptive polling on recorded or synthetic schedules.")
+    parser.add_argument("schedule", nargs="?", help="JSON schedule file")
+    parser.add_argument("--synthetic", type=int, metavar="DAYS", help="generate a synthetic schedule instead")
+    parser.add_argument("--start-hour", type=float, default=19.0, help="usual start hour (UTC) for --synthetic")
+    parser.add_argument("--interval", type=int, default=30, help="fixed interval / adaptive base interval (RetryTime)")
+    parser.add_argument("--fast-interval", type=int, default=5)
+    parser.add_argument("--max-interval", type=int, default=None)
+    parser.add_argument("--block-rate", type=float, default=0.0, help="fraction of polls answered with 403")
+    parser.add_argument("--learn-from", choices=("start", "detect"), default="start",
+                        help="learn from true start times (Twitch createdAt) or detection times (Kick)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.synthetic:
+        schedules = {"synthetic": synthetic_schedule(args.synthetic, args.start_hour, seed=args.seed)}
+    elif args.schedule:
+        schedules = load_schedule(args.schedule)
+    else:
+        parser.error("give a schedule file or --synthetic DAYS")
+
+    for name, sessions in schedules.items():
+        if not sessions:
+            continue
+        days = (sessions[-1][1] - sessions[0][0]) / DAY + 1
+        results = run(sessions, args.interval, args.fast_interval, args.max_interval,
+                      args.block_rate, args.learn_from, args.seed)
+        _report(name, results, days)
+
+
+if __name__ == "__main__":
+    main()
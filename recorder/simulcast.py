@@ -0,0 +1,350 @@
+"""Record a Twitch + Kick simulcast once.
+
+A creator streaming to both platforms at the same time is recorded twice
+(``twitch-record.py roflgator`` and ``kick-record.py roflgator``), doubling
+NAS bandwidth and disk use. ``SimulcastLinks`` ties the two channels
+together (``roflgator`` or ``twitchname=kickname``, comma-separated), and
+while both are capturing their recorders compare notes through a small
+state file per link (``state/simulcast-<twitch>-<kick>.json``, ``flock``ed,
+so separate processes and the supervisor work the same way):
+
+1. every ``SimulcastCheckInterval`` seconds a capture writes a heartbeat
+   with the file it is writing, its byte rate and when its stream started;
+2. when the other side has been live too and the two started within
+   ``SimulcastWindow`` seconds of each other, the last part of both files is
+   fingerprinted: ffmpeg decodes the audio to a 10 Hz loudness envelope, and
+   the two envelopes must correlate (``SimulcastMatchThreshold``) at some
+   offset. The platforms' delays differ, so start times alone prove
+   nothing, and a creator can be live on both with different content;
+3. once that matched, ``SimulcastPolicy`` picks the capture to keep:
+   ``twitch`` (ad-free with the OAuth token), ``kick``, or ``quality`` (higher
+   resolution, then frame rate, then bitrate). The other one is stopped and
+   stays off until the kept one ends, or with ``SimulcastLoser=backup`` is
+   restarted at ``SimulcastBackupQuality`` as a low-bitrate backup.
+
+Without a match nothing happens and both keep recording; the check is
+repeated every few minutes in case the creator switches to simulcasting.
+"""
+import os
+import re
+import json
+import time
+import array
+import fcntl
+import asyncio
+import statistics
+
+from . import metrics
+from .common import STATE_DIR
+from .migrate import parse_size
+from .remux import TS_EXT, capture_ext
+
+PLATFORMS        = ("twitch", "kick")
+POLICIES         = ("twitch", "kick", "quality")
+ENVELOPE_HZ      = 10           # loudness samples per second
+PCM_RATE         = 1000         # Hz ffmpeg resamples the audio to; plenty for a loudness envelope
+MATCH_SECONDS    = 20           # length of the compared stretch
+MAX_LAG          = 15           # seconds the platforms' delays may differ by
+RECHECK_INTERVAL = 300          # seconds before a pair that didn't match is fingerprinted again
+SIZE_RE          = re.compile(r"Video: .*?\b(\d{2,5})x(\d{2,5})\b")
+FPS_RE           = re.compile(r"Video: .*?\b([\d.]+) fps\b")
+
+
+class SimulcastHandover(Exception):
+    """The capture was stopped: the other platform records the same stream, or stopped recording it."""
+
+
+def parse_links(raw):
+    """``"a, b=c"`` -> ``[("a", "a"), ("b", "c")]`` as (twitch name, kick name) pairs."""
+    links = []
+    for item in raw.split(","):
+        twitch_name, _, kick_name = item.strip().partition("=")
+        if twitch_name.strip():
+            links.append((twitch_name.strip().lower(), (kick_name or twitch_name).strip().lower()))
+    return links
+
+
+# ─── Fingerprints ───────────────────────────────────────────────────────────────
+def envelope(pcm, rate=PCM_RATE, hz=ENVELOPE_HZ):
+    """Mean absolute amplitude of 16-bit mono ``pcm`` per 1/``hz`` second."""
+    samples = array.array("h")
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    step = rate // hz
+    return [sum(map(abs, samples[i:i + step])) / step for i in range(0, len(samples) - step + 1, step)]
+
+
+def _correlation(a, b):
+    mean_a, mean_b = statistics.fmean(a), statistics.fmean(b)
+    da = [x - mean_a for x in a]
+    db = [y - mean_b for y in b]
+    norm = (sum(x * x for x in da) * sum(y * y for y in db)) ** 0.5
+    return sum(x * y for x, y in zip(da, db)) / norm if norm else 0.0
+
+
+def match_score(a, b, seconds=MATCH_SECONDS, max_lag=MAX_LAG, hz=ENVELOPE_HZ):
+    """Best correlation of a ``seconds`` stretch of envelope ``a`` against ``b`` within ``max_lag``.
+
+    Both envelopes end at about the same wall-clock time. The stretch is
+    taken ``max_lag`` before the end of ``a`` and only looked for in the
+    last ``seconds + 2 * max_lag`` of ``b``, so ``b``'s platform may run up
+    to ``max_lag`` seconds behind or ahead, but audio from minutes earlier
+    (an intro, a replayed clip) can't match. None if there is too little
+    audio or it is (near) silent. CPU-bound; run it off the event loop.
+    """
+    window, lag = int(seconds * hz), int(max_lag * hz)
+    if len(a) < window + lag or len(b) < window:
+        return None
+    probe = a[len(a) - window - lag:len(a) - lag]
+    if statistics.pstdev(probe) < 1.0:
+        return None
+    first = max(0, len(b) - window - 2 * lag)
+    return max(_correlation(probe, b[i:i + window]) for i in range(first, len(b) - window + 1))
+
+
+async def fingerprint(path, tail_bytes, ffmpeg="ffmpeg"):
+    """(loudness envelope, (height, fps)) of the last ``tail_bytes`` of the MPEG-TS capture ``path``, or None."""
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return None
+    with f:
+        try:
+            f.seek(max(0, os.fstat(f.fileno()).st_size - tail_bytes) // 188 * 188)
+        except OSError:
+            return None
+        # ffmpeg reads the tail straight from our file handle; the capture keeps appending behind it
+        proc = await asyncio.create_subprocess_exec(
+            ffmpeg, "-hide_banner", "-nostats", "-f", "mpegts", "-i", "pipe:0",
+            "-vn", "-ac", "1", "-ar", str(PCM_RATE), "-f", "s16le", "pipe:1",
+            stdin=f, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            pcm, err = await proc.communicate()
+        except asyncio.CancelledError:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+            raise
+    if not pcm:
+        return None
+    err = err.decode(errors="replace")
+    size, fps = SIZE_RE.search(err), FPS_RE.search(err)
+    loudness = await asyncio.to_thread(envelope, pcm)
+    return loudness, (int(size.group(2)) if size else 0, float(fps.group(1)) if fps else 0.0)
+
+
+def _current_path(output):
+    if isinstance(output, str):
+        return output
+    return output.current.path if output.current else None
+
+
+class SimulcastCoordinator:
+    def __init__(self, logger, links, policy="twitch", loser="stop", backup_quality="worst", window=600,
+                 interval=30, min_overlap=60, threshold=0.8, tail_bytes=48 * 1024 ** 2, ffmpeg="ffmpeg",
+                 state_dir=STATE_DIR):
+        self.logger         = logger
+        self.links          = links             # (twitch name, kick name) pairs
+        self.policy         = policy
+        self.loser          = loser             # "stop" or "backup"
+        self.backup_quality = backup_quality
+        self.window         = window
+        self.interval       = interval
+        self.min_overlap    = min_overlap       # seconds of capture before fingerprinting
+        self.threshold      = threshold
+        self.tail_bytes     = tail_bytes
+        self.ffmpeg         = ffmpeg
+        self.state_dir      = state_dir
+        self.backups        = set()             # (state path, platform) of captures started as backups
+
+    @classmethod
+    def from_config(cls, config, logger):
+        """Return a coordinator if ``SimulcastLinks`` is set and captures are MPEG-TS, else None."""
+        links = parse_links(config.get("Settings", "SimulcastLinks", fallback=""))
+        if not links:
+            return None
+        if capture_ext(config) != TS_EXT:
+            # The tail of an mp4 that is still being written can't be decoded, so nothing would ever match
+            logger.warning("SimulcastLinks needs RecordAsTS=true to compare the recordings; not deduplicating simulcasts")
+            return None
+        policy = config.get("Settings", "SimulcastPolicy", fallback="twitch").strip().lower()
+        if policy not in POLICIES:
+            logger.warning(f"Unknown SimulcastPolicy {policy!r}, using twitch")
+            policy = "twitch"
+        return cls(
+            logger, links,
+            policy=policy,
+            loser=config.get("Settings", "SimulcastLoser", fallback="stop").strip().lower(),
+            backup_quality=config.get("Settings", "SimulcastBackupQuality", fallback="") or "worst",
+            window=config.getint("Settings", "SimulcastWindow", fallback=600),
+            interval=config.getint("Settings", "SimulcastCheckInterval", fallback=30),
+            threshold=config.getfloat("Settings", "SimulcastMatchThreshold", fallback=0.8),
+            tail_bytes=parse_size(config.get("Settings", "SimulcastSampleSize", fallback=""), 48 * 1024 ** 2),
+        )
+
+    def link_for(self, platform, name):
+        """State file path of the link ``platform:name`` belongs to, or None."""
+        index = PLATFORMS.index(platform)
+        for link in self.links:
+            if link[index] == name.lower():
+                return os.path.join(self.state_dir, f"simulcast-{link[0]}-{link[1]}.json")
+        return None
+
+    # ─── Shared state ───────────────────────────────────────────────────────────
+    def _update(self, path, change=None):
+        """Blocking: apply ``change(state)`` to the link's state file under its lock; return the state."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+            if change is not None:
+                change(state)
+                tmp = path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(state, f)
+                os.replace(tmp, path)
+        return state
+
+    def _active(self, entry):
+        return bool(entry) and time.time() - entry.get("heartbeat", 0) < 3 * self.interval
+
+    def quality_for(self, channel):
+        """Quality the next capture of ``channel`` should use: "best", the backup quality, or None to skip it.
+
+        Only a capture that lost a confirmed match while the winner is still
+        recording that same stream is held back.
+        """
+        path = self.link_for(channel.platform, channel.streamer_name)
+        if path is None:
+            return "best"
+        self.backups.discard((path, channel.platform))
+        try:
+            state = self._update(path)
+        except OSError:
+            return "best"
+        decision = state.get("decision") or {}
+        winner = decision.get("keep")
+        if not decision.get("match") or winner in (None, channel.platform):
+            return "best"
+        entry = state.get(winner)
+        if not self._active(entry) or entry.get("session") != decision["sessions"].get(winner):
+            return "best"
+        if self.loser != "backup":
+            return None
+        self.backups.add((path, channel.platform))
+        return self.backup_quality
+
+    # ─── While capturing ────────────────────────────────────────────────────────
+    def guard(self, channel, attempt):
+        """Wrap ``attempt(output)`` so it is stopped with ``SimulcastHandover`` when the other side takes over."""
+        path = self.link_for(channel.platform, channel.streamer_name)
+        if path is None:
+            return attempt
+
+        async def guarded(output):
+            task = asyncio.create_task(attempt(output))
+            session = channel.stream_started_at or time.time()
+            try:
+                await self._watch(path, channel, output, task, session)
+            finally:
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                await asyncio.to_thread(self._leave, path, channel.platform, session)
+            return task.result()
+
+        return guarded
+
+    def _leave(self, path, platform, session):
+        def change(state):
+            if (state.get(platform) or {}).get("session") == session:
+                del state[platform]
+        try:
+            self._update(path, change)
+        except OSError:
+            pass
+
+    async def _watch(self, path, channel, output, task, session):
+        platform = channel.platform
+        other = PLATFORMS[1 - PLATFORMS.index(platform)]
+        # Not from the quality: admission control may lower a primary capture too
+        role = "backup" if (path, platform) in self.backups else "primary"
+        started = last_time = time.monotonic()
+        last_bytes = 0
+        while not task.done():
+            await asyncio.wait({task}, timeout=self.interval)
+            if task.done():
+                return
+            current = _current_path(output)
+            try:
+                written = await asyncio.wait_for(asyncio.to_thread(os.path.getsize, current), self.interval)
+            except (OSError, TypeError, asyncio.TimeoutError):
+                written = last_bytes
+            now = time.monotonic()
+            rate = (written - last_bytes) / (now - last_time) if now > last_time else 0.0
+            last_bytes, last_time = written, now
+            entry = {"name": channel.streamer_name, "session": session, "path": current, "rate": rate,
+                     "role": role, "pid": os.getpid(), "heartbeat": time.time()}
+            try:
+                state = await asyncio.to_thread(self._update, path, lambda s: s.__setitem__(platform, entry))
+            except OSError as e:
+                self.logger.debug(f"Simulcast state {path} not writable: {e}")
+                continue
+            partner = state.get(other)
+            if role == "backup":
+                if not self._active(partner):
+                    raise SimulcastHandover(f"{other} stopped recording the simulcast, restarting at best quality")
+                continue
+            if now - started < self.min_overlap:
+                continue
+            if (not self._active(partner) or partner.get("role") != "primary"
+                    or abs(partner["session"] - session) > self.window):
+                continue
+            decision = await self._decide(path, state, platform, entry, other, partner)
+            if decision and decision["match"] and decision["keep"] != platform:
+                self._stop(channel, other, partner, decision)
+
+    async def _decide(self, path, state, platform, entry, other, partner):
+        """Decision for this pair of streams: reuse a fresh one from the state file, or fingerprint both."""
+        sessions = {platform: entry["session"], other: partner["session"]}
+        decision = state.get("decision") or {}
+        if decision.get("sessions") == sessions and (
+                decision.get("match") or time.time() - decision.get("checked", 0) < RECHECK_INTERVAL):
+            return decision
+
+        ours, theirs = await asyncio.gather(fingerprint(entry["path"], self.tail_bytes, self.ffmpeg),
+                                            fingerprint(partner["path"], self.tail_bytes, self.ffmpeg))
+        score = None if ours is None or theirs is None else await asyncio.to_thread(match_score, ours[0], theirs[0])
+        if score is None:
+            self.logger.debug(f"Simulcast check with {other}:{partner['name']} inconclusive (no audio to compare)")
+            return None
+        match = score >= self.threshold
+        if self.policy == "quality":
+            quality = {platform: (*ours[1], entry["rate"]), other: (*theirs[1], partner["rate"])}
+            keep = max(PLATFORMS, key=lambda p: (quality[p], p == "twitch"))
+        else:
+            keep = self.policy
+        decision = {"sessions": sessions, "match": match, "score": round(score, 3), "keep": keep,
+                    "checked": time.time()}
+        self.logger.info(f"Simulcast check with {other}:{partner['name']}: correlation {score:.2f}, "
+                         + (f"same stream, keeping {keep}" if match else "different content"))
+
+        def change(state):
+            # Another process may have decided first; its decision stands
+            current = state.get("decision") or {}
+            if not (current.get("sessions") == sessions and current.get("match")):
+                state["decision"] = decision
+        state = await asyncio.to_thread(self._update, path, change)
+        return state.get("decision")
+
+    def _stop(self, channel, other, partner, decision):
+        backup = self.loser == "backup"
+        message = (f"Simulcast of {other}:{partner['name']} (correlation {decision['score']:.2f}), "
+                   f"{'restarting as backup at ' + self.backup_quality if backup else 'stopping this capture'}")
+        metrics.SIMULCAST_DUPLICATES.inc(platform=channel.platform, action="backup" if backup else "stop")
+        if channel.session_record is not None:
+            channel.session_record.event("simulcast", message)
+        raise SimulcastHandover(message)
@@ -0,0 +1,192 @@
+"""Drive the streamlink Python API in-process instead of spawning the CLI.
+
+One ``StreamlinkSession`` per platform is kept for the life of the process, so
+its HTTP connection pool, loaded plugins, resolved plugin classes, headers and
+cookies are reused by every probe and every recording. Recordings are copied
+from the stream reader to disk through a bounded queue: a slow disk applies
+back-pressure to the reader instead of growing memory without limit.
+"""
+import os
+import queue
+import asyncio
+import threading
+from http.cookiejar import MozillaCookieJar, LoadError
+
+CHUNK_SIZE    = 64 * 1024
+BUFFER_CHUNKS = 256     # 16 MiB of buffered stream data per recording
+
+
+def pick_stream(streams, quality):
+    """The first of the comma-separated ``quality`` fallbacks in ``streams`` (like the CLI), or None."""
+    for name in quality.split(","):
+        if name.strip() in streams:
+            return streams[name.strip()]
+    return None
+
+
+class StreamlinkSession:
+    def __init__(self, logger, http_headers=None, cookies_file=None,
+                 chunk_size=CHUNK_SIZE, buffer_chunks=BUFFER_CHUNKS):
+        self.logger        = logger
+        self.http_headers  = http_headers or {}
+        self.cookies_file  = cookies_file
+        self.chunk_size    = chunk_size
+        self.buffer_chunks = buffer_chunks
+
+        self._session       = None
+        self._lock          = threading.Lock()
+        self._plugins       = {}
+        self._cookies_mtime = None
+
+    @classmethod
+    def from_config(cls, config, logger, **kwargs):
+        """Return a session if ``InProcessStreamlink`` is enabled and streamlink is importable, else None."""
+        if not config.getboolean("Settings", "InProcessStreamlink", fallback=False):
+            return None
+        try:
+            import streamlink  # noqa: F401
+        except ImportError as e:
+            logger.warning(f"InProcessStreamlink is enabled but streamlink cannot be imported ({e}); using the CLI.")
+            return None
+        return cls(logger, **kwargs)
+
+    # ─── Session state ──────────────────────────────────────────────────────────
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                from streamlink import Streamlink
+                self._session = Streamlink()
+                if self.http_headers:
+                    self._session.set_option("http-headers", self.http_headers)
+            return self._session
+
+    def _refresh_cookies(self):
+        """Load the Netscape cookie jar into the shared HTTP session whenever the file changes."""
+        if not self.cookies_file or not os.path.exists(self.cookies_file):
+            return
+        mtime = os.path.getmtime(self.cookies_file)
+        if mtime == self._cookies_mtime:
+            return
+        jar = MozillaCookieJar(self.cookies_file)
+        try:
+            jar.load(ignore_discard=True, ignore_expires=True)
+        except (LoadError, OSError) as e:
+            self.logger.warning(f"Could not load cookies from {self.cookies_file}: {e}")
+            return
+        for cookie in jar:
+            self.session.http.cookies.set_cookie(cookie)
+        self._cookies_mtime = mtime
+
+    def _resolve(self, url):
+        """Plugin resolution is cached per URL; it never changes for a channel."""
+        resolved = self._plugins.get(url)
+        if resolved is None:
+            _, plugincls, resolved_url = self.session.resolve_url(url)
+            resolved = self._plugins[url] = (plugincls, resolved_url)
+        return resolved
+
+    def streams(self, url, plugin_options=None):
+        """Blocking: return the plugin's ``{quality: stream}`` mapping (empty if offline)."""
+        from streamlink.options import Options
+
+        self._refresh_cookies()
+        plugincls, resolved_url = self._resolve(url)
+        plugin = plugincls(self.session, resolved_url, Options(plugin_options or {}))
+        return plugin.streams() or {}
+
+    # ─── Recording ──────────────────────────────────────────────────────────────
+    def record(self, url, output, quality="best", plugin_options=None, stop=None, live_restart=False):
+        """Blocking: record ``url`` to ``output``, a file path or a ``SpoolWriter``.
+
+        ``live_restart`` starts an HLS stream at the oldest segment of its
+        playlist (``--hls-live-restart``). Returns ``(returncode, message)``
+        like the CLI would.
+        """
+        from streamlink.exceptions import PluginError, NoPluginError, StreamError
+
+        stop = stop or threading.Event()
+        try:
+            streams = self.streams(url, plugin_options)
+        except NoPluginError:
+            return 1, f"No plugin can handle URL: {url}"
+        except PluginError as e:
+            return 1, f"Unable to open URL: {url} ({e})"
+        stream = pick_stream(streams, quality)
+        if stream is None:
+            return 1, f"No playable streams found on this URL: {url}"
+        if live_restart and hasattr(stream, "force_restart"):
+            stream.force_restart = True
+
+        try:
+            fd = stream.open()
+        except StreamError as e:
+            return 1, f"Could not open stream: {e}"
+
+        if isinstance(output, str):
+            error = self._copy(fd, output, stop)
+        else:
+            error = self._pump(fd, output, stop)
+        if error:
+            return 1, f"Error when writing {output}: {error}"
+        return 0, "Stream ended"
+
+    def _pump(self, fd, spool, stop):
+        """Feed a SpoolWriter, which does its own buffering and failover."""
+        try:
+            while not stop.is_set():
+                chunk = fd.read(self.chunk_size)
+                if not chunk:
+                    break
+                spool.write(chunk)
+        except OSError as e:
+            self.logger.warning(f"Stream read failed: {e}")
+        finally:
+            fd.close()
+        return spool.error
+
+    def _copy(self, fd, path, stop):
+        buf = queue.Queue(maxsize=self.buffer_chunks)
+        failed = threading.Event()
+        errors = []
+
+        def writer():
+            try:
+                with open(path, "ab") as out:
+                    while (chunk := buf.get()) is not None:
+                        out.write(chunk)
+            except OSError as e:
+                errors.append(e)
+                failed.set()
+                # Keep draining so the reader never blocks on a dead writer
+                while buf.get() is not None:
+                    pass
+
+        t = threading.Thread(target=writer, name=f"writer:{os.path.basename(path)}", daemon=True)
+        t.start()
+        try:
+            while not stop.is_set() and not failed.is_set():
+                chunk = fd.read(self.chunk_size)
+                if not chunk:
+                    break
+                buf.put(chunk)
+        except OSError as e:
+            self.logger.warning(f"Stream read failed: {e}")
+        finally:
+            buf.put(None)
+            t.join()
+            fd.close()
+        return errors[0] if errors else None
+
+    # ─── Async wrappers ─────────────────────────────────────────────────────────
+    async def probe(self, url, plugin_options=None):
+        return await asyncio.to_thread(self.streams, url, plugin_options)
+
+    async def record_async(self, url, output, quality="best", plugin_options=None, live_restart=False):
+        stop = threading.Event()
+        try:
+            return await asyncio.to_thread(self.record, url, output, quality, plugin_options, stop, live_restart)
+        except asyncio.CancelledError:
+            # Let the copy loop finish the current chunk and close the file
+            stop.set()
+            raise
@@ -0,0 +1,500 @@
+"""Spool layer between a capture and its output file.
+
+The capture (a streamlink/yt-dlp child writing to stdout, or the in-process
+session) hands chunks to ``SpoolWriter``, which owns the file. Every write to
+the current part runs on a dedicated I/O thread with a deadline, so a NAS
+write that errors, hangs or gets slow is noticed while the capture keeps
+going: the writer abandons that part, opens a new part in ``fallback_dir``
+and carries on without restarting the child.
+
+At the end the parts are reconciled back into one file. If that is not
+possible yet (NAS still gone) a ``.parts.json`` sidecar is left in
+``fallback_dir`` and ``reconcile_pending()`` finishes the job later. The
+writer keeps its sidecar ``flock``ed while it owns the parts, so the
+``reconcile_pending()`` of another channel starting up leaves a running
+capture's parts alone; after a crash the lock is gone and the last part is
+joined in full, however much of it the sidecar had seen.
+
+With ``SegmentMinutes`` a ``.ts`` capture is also rolled into fixed-length
+segments on keyframes (see ``segment.py``); every segment is its own file
+with its own parts, and is handed to ``on_segment`` as soon as it's done.
+
+NAS faults are injectable through ``opener`` (any ``open``-compatible
+callable), which is how stalls and write errors are simulated offline.
+"""
+import os
+import json
+import time
+import fcntl
+import queue
+import shutil
+import asyncio
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from . import metrics
+from .common import spawn, watch_output
+from .segment import TSCutter, manifest_name, segment_name, write_manifest
+
+CHUNK_SIZE    = 64 * 1024
+BUFFER_CHUNKS = 256
+SIDECAR_EXT   = ".parts.json"
+
+
+class _Part:
+    """One output file plus the single I/O thread that is allowed to touch it."""
+
+    def __init__(self, path, opener, timeout):
+        self.path = path
+        self.committed = 0      # bytes whose write() returned successfully
+        self.timeout = timeout
+        # Daemon thread: if the NAS hangs it may be stuck in the kernel forever,
+        # and that must not keep the process from exiting
+        self._requests = queue.SimpleQueue()
+        self.finished = threading.Event()
+        threading.Thread(target=self._io_loop, name="spool-io", daemon=True).start()
+        try:
+            # Unbuffered: a write that returned is in the kernel, not in a Python buffer
+            self.fh = self.call(opener, path, "ab", 0)
+            self.committed = self.call(self.fh.tell)
+        except BaseException:
+            self.abandon()
+            raise
+
+    def _io_loop(self):
+        while (request := self._requests.get()) is not None:
+            fn, args, fut = request
+            if not fut.set_running_or_notify_cancel():
+                continue
+            try:
+                fut.set_result(fn(*args))
+            except BaseException as e:
+                fut.set_exception(e)
+        self.finished.set()
+
+    def call(self, fn, *args):
+        """Run ``fn`` on the I/O thread; raises TimeoutError if it doesn't return in time."""
+        fut = Future()
+        self._requests.put((fn, args, fut))
+        return fut.result(timeout=self.timeout)
+
+    def write(self, chunk):
+        self.call(self.fh.write, chunk)
+        self.committed += len(chunk)
+
+    def close(self):
+        try:
+            self.call(self.fh.close)
+        finally:
+            self._requests.put(None)
+
+    def abandon(self):
+        # Don't wait for the I/O thread; it exits on its own if it ever unblocks
+        self._requests.put(None)
+
+
+class SpoolWriter:
+    def __init__(self, filename, external_dir, fallback_dir, logger, stall_timeout=15.0,
+                 slow_write_threshold=2.0, buffer_chunks=BUFFER_CHUNKS, opener=open,
+                 labels=None, on_first_byte=None, segment_seconds=0, on_segment=None):
+        self.session              = filename
+        self.filename             = segment_name(filename, 1) if segment_seconds else filename
+        self.external_dir         = external_dir
+        self.fallback_dir         = fallback_dir
+        self.logger               = logger
+        self.stall_timeout        = stall_timeout
+        self.slow_write_threshold = slow_write_threshold
+        self.opener               = opener
+        self.labels               = labels or {}      # metric labels, e.g. platform/channel
+        self.on_first_byte        = on_first_byte
+        self.on_segment           = on_segment        # called with each finished segment's path
+
+        self.parts        = []
+        self.failed_over  = False
+        self.bytes_written = 0
+        self.last_write   = None
+        self.avg_latency  = 0.0     # EWMA of write latency on the current part
+        self.error        = None
+
+        # Segmenting (SegmentMinutes): cut points, finished segments, manifest
+        self.segment_seconds = segment_seconds
+        self.cutter          = TSCutter(segment_seconds) if segment_seconds else None
+        self.segments        = []
+        self.complete        = False
+        self.manifest_path   = None
+        self._manifest_lock  = threading.Lock()
+        self._sidecar_locks  = {}           # sidecar path -> open, flocked file while this writer owns it
+
+        self._queue  = queue.Queue(maxsize=buffer_chunks)
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, config, filename, external_dir, fallback_dir, logger, **kwargs):
+        """Return a spool writer if ``MidStreamFailover`` is enabled, else None.
+
+        ``SegmentMinutes`` only applies to ``.ts`` captures; other containers
+        can't be cut on the fly.
+        """
+        if not config.getboolean("Settings", "MidStreamFailover", fallback=False):
+            return None
+        segment_minutes = config.getfloat("Settings", "SegmentMinutes", fallback=0)
+        return cls(
+            filename, external_dir, fallback_dir, logger,
+            stall_timeout=config.getfloat("Settings", "NASStallTimeout", fallback=15.0),
+            segment_seconds=segment_minutes * 60 if filename.endswith(".ts") else 0,
+            **kwargs,
+        )
+
+    # ─── Properties ─────────────────────────────────────────────────────────────
+    @property
+    def path(self):
+        """Path of the first part, which is where the reconciled file ends up."""
+        return self.parts[0].path if self.parts else None
+
+    @property
+    def current(self):
+        return self.parts[-1] if self.parts else None
+
+    # ─── Lifecycle ──────────────────────────────────────────────────────────────
+    def start(self):
+        """Start the writer thread. The first part is only created once data arrives,
+        so a capture that finds the channel offline leaves no empty file behind."""
+        self._thread = threading.Thread(target=self._run, name=f"spool:{self.filename}", daemon=True)
+        self._thread.start()
+        return self
+
+    def _open_first(self):
+        """Open the first part on the NAS if it looks usable, else in the fallback dir."""
+        target_dir = self.fallback_dir
+        if os.path.exists(self.external_dir) and os.access(self.external_dir, os.W_OK):
+            target_dir = self.external_dir
+        try:
+            self._open_part(os.path.join(target_dir, self.filename))
+        except (OSError, FutureTimeout) as e:
+            if target_dir == self.fallback_dir:
+                raise
+            self.logger.warning(f"Could not open {target_dir} for writing ({e!r}), spooling to fallback")
+            self._failover()
+        if target_dir == self.external_dir and not self.failed_over:
+            self.logger.info(f"→ Primary (NAS): {self.path}")
+        else:
+            self.logger.warning(f"→ NAS unavailable, using Fallback: {self.path}")
+
+    def write(self, chunk):
+        """Blocking enqueue (for threads). Applies back-pressure when the buffer is full."""
+        self._queue.put(chunk)
+
+    async def awrite(self, chunk):
+        """Enqueue from the event loop without blocking it."""
+        try:
+            self._queue.put_nowait(chunk)
+        except queue.Full:
+            await asyncio.to_thread(self._queue.put, chunk)
+
+    def close(self, reconcile=True):
+        """Drain the buffer, close the current part and (optionally) reconcile parts into one file.
+
+        Returns the path of the finished file (the last segment when
+        segmenting), or None while parts are still waiting to be reconciled.
+        """
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+        path = None
+        if self.parts:
+            parts = list(self.parts)
+            sidecar = self._finish_parts()
+            if self.cutter is not None:
+                self._add_segment(parts, self.cutter.elapsed())
+            path = self._settle(parts, sidecar, reconcile)
+        if self.segments:
+            self.complete = True
+            self._write_manifest()
+        return path
+
+    def _finish_parts(self):
+        """Close the current part. Returns the sidecar to reconcile when there are several parts."""
+        try:
+            self.current.close()
+        except (OSError, FutureTimeout) as e:
+            self.logger.warning(f"Closing {self.current.path} failed: {e!r}")
+        if len(self.parts) > 1:
+            self._write_sidecar()
+            return self._sidecar_path()
+        return None
+
+    def _settle(self, parts, sidecar, reconcile=True):
+        """Join ``parts`` once every abandoned one is idle. Returns the final path, or None."""
+        if sidecar is None:
+            return parts[0].path
+        try:
+            # A write stuck on the NAS could still land later and append to the
+            # reconciled file, so only join once every abandoned part is idle
+            stuck = [p for p in parts[:-1] if not p.finished.wait(self.stall_timeout)]
+            if stuck:
+                self.logger.warning(f"NAS write still hanging on {stuck[0].path}; leaving parts for later reconciliation")
+                return None
+            if not reconcile or not reconcile_sidecar(sidecar, self.logger):
+                return None
+            return parts[0].path
+        finally:
+            # Whatever is left is reconcile_pending's from now on
+            lock = self._sidecar_locks.pop(sidecar, None)
+            if lock is not None:
+                lock.close()
+
+    async def aclose(self, reconcile=True):
+        return await asyncio.to_thread(self.close, reconcile)
+
+    # ─── Segments ───────────────────────────────────────────────────────────────
+    def _add_segment(self, parts, duration):
+        with self._manifest_lock:
+            self.segments.append({
+                "file": self.filename,
+                "duration": round(duration, 3),
+                "bytes": sum(p.committed for p in parts),
+            })
+
+    def _roll(self, duration):
+        """Writer thread: finish the current segment and continue in the next one."""
+        if self.parts:
+            parts = list(self.parts)
+            sidecar = self._finish_parts()
+            self._add_segment(parts, duration)
+            self.logger.info(f"Segment {self.filename} done ({duration / 60:.1f} min)")
+            # Joining parts may take a while; the capture must not wait for it
+            threading.Thread(target=self._publish_segment, args=(parts, sidecar),
+                             name=f"spool-segment:{self.filename}", daemon=True).start()
+        self.filename = segment_name(self.session, len(self.segments) + 1)
+        self.parts, self.failed_over, self.error = [], False, None
+
+    def _publish_segment(self, parts, sidecar):
+        path = self._settle(parts, sidecar)
+        self._write_manifest()
+        if path is not None and self.on_segment is not None:
+            self.on_segment(path)
+
+    def _write_manifest(self):
+        """(Re)write ``<session>.manifest.json``: on the NAS when possible, else in fallback_dir."""
+        with self._manifest_lock:
+            if self.manifest_path is None:
+                target_dir = self.external_dir if os.access(self.external_dir, os.W_OK) else self.fallback_dir
+                self.manifest_path = os.path.join(target_dir, manifest_name(self.session))
+            args = (self.session, self.segment_seconds, list(self.segments), self.complete)
+            try:
+                write_manifest(self.manifest_path, *args)
+            except OSError as e:
+                fallback = os.path.join(self.fallback_dir, manifest_name(self.session))
+                if self.manifest_path == fallback:
+                    self.logger.error(f"Cannot write manifest {fallback}: {e}")
+                    return
+                self.logger.warning(f"Cannot write manifest {self.manifest_path} ({e}), using {fallback}")
+                self.manifest_path = fallback
+                write_manifest(fallback, *args)
+
+    # ─── Writer thread ──────────────────────────────────────────────────────────
+    def _open_part(self, path):
+        part = _Part(path, self.opener, self.stall_timeout)
+        self.parts.append(part)
+        self.avg_latency = 0.0
+        return part
+
+    def _on_fallback(self):
+        # Pure string comparison: never stat() a path on a possibly hung NAS
+        return os.path.abspath(os.path.dirname(self.current.path)) == os.path.abspath(self.fallback_dir)
+
+    def _failover(self):
+        """Abandon the current part and continue in a new part under fallback_dir."""
+        stem, ext = os.path.splitext(self.filename)
+        path = os.path.join(self.fallback_dir, f"{stem}.part{len(self.parts)}{ext}")
+        if self.current is not None:
+            self.current.abandon()
+        self.failed_over = True
+        self._open_part(path)
+        self._write_sidecar()
+        self.logger.warning(f"→ Switched output to fallback mid-stream: {path}")
+
+    def _write_one(self, chunk):
+        part = self.current
+        start = time.monotonic()
+        part.write(chunk)
+        latency = time.monotonic() - start
+        self.avg_latency = 0.8 * self.avg_latency + 0.2 * latency
+        first = self.bytes_written == 0
+        self.bytes_written += len(chunk)
+        self.last_write = time.time()
+
+        metrics.WRITE_SECONDS.observe(latency, target="fallback" if self._on_fallback() else "nas")
+        metrics.BYTES_WRITTEN.inc(len(chunk), **self.labels)
+        if first and self.on_first_byte is not None:
+            self.on_first_byte()
+        return latency
+
+    def _run(self):
+        while (chunk := self._queue.get()) is not None:
+            if self.cutter is None:
+                self._write_chunk(chunk)
+                continue
+            for piece in self.cutter.feed(chunk):
+                if isinstance(piece, tuple):
+                    # Cut before a keyframe; the next segment starts with PAT/PMT
+                    piece, duration = piece
+                    self._roll(duration)
+                self._write_chunk(piece)
+        if self.cutter is not None and (rest := self.cutter.flush()):
+            self._write_chunk(rest)
+
+    def _write_chunk(self, chunk):
+        if self.error is not None:
+            return      # fallback is broken too; drain so the capture isn't blocked
+        if not self.parts:
+            try:
+                self._open_first()
+            except (OSError, FutureTimeout) as e:
+                self.logger.error(f"Cannot open any output file: {e!r}")
+                self.error = e
+                return
+        try:
+            self._write_one(chunk)
+            if not self._on_fallback() and self.avg_latency > self.slow_write_threshold:
+                self.logger.warning(f"NAS writes averaging {self.avg_latency:.1f}s, failing over")
+                self._failover()
+        except (OSError, FutureTimeout) as e:
+            reason = "stalled" if isinstance(e, FutureTimeout) else f"failed: {e}"
+            if self._on_fallback():
+                self.logger.error(f"Fallback write {reason}; dropping data until the capture ends")
+                self.error = e
+                return
+            self.logger.warning(f"NAS write {reason}")
+            try:
+                self._failover()
+                self._write_one(chunk)
+            except (OSError, FutureTimeout) as e2:
+                self.logger.error(f"Fallback write failed too: {e2!r}")
+                self.error = e2
+
+    # ─── Sidecar ────────────────────────────────────────────────────────────────
+    def _sidecar_path(self):
+        return os.path.join(self.fallback_dir, self.filename + SIDECAR_EXT)
+
+    def _write_sidecar(self):
+        """Write the sidecar, locked before it replaces the old one, and keep it locked."""
+        path = self._sidecar_path()
+        data = {"parts": [{"path": p.path, "bytes": p.committed} for p in self.parts]}
+        tmp = path + ".tmp"
+        f = open(tmp, "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            json.dump(data, f)
+            f.flush()
+            os.replace(tmp, path)
+        except BaseException:
+            f.close()
+            raise
+        old, self._sidecar_locks[path] = self._sidecar_locks.get(path), f
+        if old is not None:
+            old.close()
+
+
+def reconcile_sidecar(sidecar, logger):
+    """Join the parts listed in ``sidecar`` into the first part. Returns True when done.
+
+    Each abandoned part is cut to the bytes that were confirmed written, so
+    a chunk that was in flight when the NAS stalled is never duplicated. The
+    last part (on fallback) is taken in full: after a crash its count in the
+    sidecar is out of date.
+    """
+    with open(sidecar) as f:
+        parts = json.load(f)["parts"]
+    first = parts[0]
+    # A missing first part usually means the NAS isn't mounted (its empty mountpoint still is);
+    # creating it here would drop part 1 for good
+    if not os.path.exists(first["path"]):
+        logger.warning(f"Could not reconcile {first['path']} yet (file missing); will retry later")
+        return False
+    try:
+        with open(first["path"], "r+b") as out:
+            keep = min(out.seek(0, os.SEEK_END), first["bytes"])
+            out.truncate(keep)
+            out.seek(keep)
+            for part in parts[1:]:
+                with open(part["path"], "rb") as src:
+                    remaining = part["bytes"]
+                    if part is parts[-1]:
+                        remaining = max(remaining, os.fstat(src.fileno()).st_size)
+                    while remaining > 0:
+                        chunk = src.read(min(CHUNK_SIZE * 16, remaining))
+                        if not chunk:
+                            break
+                        out.write(chunk)
+                        remaining -= len(chunk)
+    except OSError as e:
+        logger.warning(f"Could not reconcile {first['path']} yet ({e}); will retry later")
+        return False
+
+    for part in parts[1:]:
+        os.remove(part["path"])
+    os.remove(sidecar)
+    logger.info(f"Reconciled {len(parts)} parts into {first['path']}")
+    return True
+
+
+def reconcile_pending(fallback_dir, logger):
+    """Retry reconciliation for sessions whose NAS part was unreachable when they ended.
+
+    Sidecars still locked by a running capture (in any process) are skipped.
+    """
+    if not os.path.isdir(fallback_dir):
+        return
+    for name in sorted(os.listdir(fallback_dir)):
+        if not name.endswith(SIDECAR_EXT):
+            continue
+        path = os.path.join(fallback_dir, name)
+        try:
+            with open(path) as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                    continue        # rewritten by its writer meanwhile, so it's in use
+                reconcile_sidecar(path, logger)
+        except FileNotFoundError:
+            continue                # reconciled by its writer meanwhile
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Skipping unreadable sidecar {name}: {e}")
+
+
+async def pump_child(cmd, spool, capture_stderr=True, chunk_size=CHUNK_SIZE, abort_on=None):
+    """Run a capture child with its stdout piped into ``spool``.
+
+    Returns ``(returncode, "", stderr)`` like ``run_child``; ``abort_on``
+    terminates it early when stderr matches before its first byte of stdout.
+    Later matches (a 403 on one fragment) leave a running capture alone. The
+    child is terminated if the awaiting task is cancelled.
+    """
+    stderr = asyncio.subprocess.PIPE if capture_stderr else None
+    proc = await spawn(cmd, stdout=asyncio.subprocess.PIPE, stderr=stderr)
+    received = False
+
+    async def copy_stdout():
+        nonlocal received
+        while chunk := await proc.stdout.read(chunk_size):
+            received = True
+            await spool.awrite(chunk)
+
+    async def before_first_byte():
+        return not received
+
+    async def read_stderr():
+        return await watch_output(proc, proc.stderr, abort_on, armed=before_first_byte) if capture_stderr else b""
+
+    try:
+        _, err = await asyncio.gather(copy_stdout(), read_stderr())
+        await proc.wait()
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.terminate()
+            await proc.wait()
+        raise
+    return proc.returncode, "", err.decode(errors="replace")
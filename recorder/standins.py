@@ -0,0 +1,755 @@
+"""Local stand-ins for the platform APIs so polling can be exercised offline.
+
+Each server binds to 127.0.0.1 on a free port, runs in a background thread
+and counts requests and TCP connections::
+
+    with FakeTwitchGQL(live=["roflgator"]) as server:
+        prober = TwitchLiveProber(url=server.url)
+        ...
+        print(server.requests, server.connections)
+
+``FakeHLSOrigin`` serves synthetic live HLS streams (a sliding-window
+playlist over generated MPEG-TS segments) at ``/<channel>/index.m3u8`` for
+streamlink/yt-dlp to record, plus a cookie page for the Kick cookie refresh.
+Every channel can be offline, live, ended, forbidden (403) or slow. The
+whole stream so far is at ``/<channel>/vod.m3u8``, like a Twitch archive VOD
+(the GQL stand-in reports the channel name as its ``archiveVideo`` id).
+
+Run ``python -m recorder.standins twitch-gql --live roflgator`` or
+``python -m recorder.standins hls --live roflgator`` to keep one up for
+manual testing (point ``TwitchGQLURL`` / ``TwitchStreamURL`` /
+``KickStreamURL`` in settings.config at it). The state can be changed while
+it runs with ``POST /_control`` (``{"channel": "roflgator", "state":
+"live"}``, ``{"delay": 0.5}``), and ``GET /_stats`` returns the counters;
+``recorder.bench`` drives them that way.
+
+``FakePushServer`` (``python -m recorder.standins push``) sends go-live and
+go-offline events over WebSockets, Twitch EventSub and Kick Pusher style,
+for ``PushDetection``; ``TwitchEventSubURL`` / ``TwitchHelixURL`` /
+``KickPusherURL`` / ``KickChannelsURL`` point the recorder at it.
+"""
+import re
+import json
+import zlib
+import time
+import socket
+import threading
+import functools
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import ws
+
+ALIAS_RE = re.compile(r'(\w+):\s*user\(login:\s*"([^"]*)"\)')
+
+
+class _StandinServer:
+    """Base class: a ThreadingHTTPServer with request/connection counters."""
+
+    handler = None
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        owner = self
+
+        class Handler(self.handler):
+            protocol_version = "HTTP/1.1"
+            server_owner = owner
+
+            def setup(self):
+                super().setup()
+                with owner.lock:
+                    owner.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def control(self, **changes):
+        """Apply a ``POST /_control`` body; overridden per server."""
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "connections": self.connections}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, payload):
+        self.send_body(status, json.dumps(payload).encode(), "application/json")
+
+    def send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return None
+
+    def handle_admin(self):
+        """Serve ``/_control`` and ``/_stats``; True if the request was one of them (not counted)."""
+        server = self.server_owner
+        if self.path == "/_stats":
+            self.send_json(200, server.stats())
+        elif self.path == "/_control" and self.command == "POST":
+            body = self.read_json()
+            if not isinstance(body, dict):
+                self.send_json(400, {"error": "Bad Request"})
+                return True
+            try:
+                server.control(**body)
+            except (TypeError, ValueError) as e:
+                self.send_json(400, {"error": str(e)})
+                return True
+            self.send_json(200, server.stats())
+        else:
+            return False
+        return True
+
+
+class _TwitchGQLHandler(_JSONHandler):
+    def do_GET(self):
+        if not self.handle_admin():
+            self.send_json(404, {"error": "Not Found"})
+
+    def do_POST(self):
+        if self.handle_admin():
+            return
+        server = self.server_owner
+        server.count_request()
+        body = self.read_json()
+        if body is None:
+            return self.send_json(400, {"error": "Bad Request"})
+        if server.delay:
+            time.sleep(server.delay)
+        if server.fail_status:
+            return self.send_json(server.fail_status, {"error": "Forbidden" if server.fail_status == 403 else "Error"})
+        if not self.headers.get("Client-ID"):
+            return self.send_json(400, {"error": "Bad Request", "message": "The \"Client-ID\" header is missing"})
+
+        data = {}
+        for alias, login in ALIAS_RE.findall(body.get("query", "")):
+            login = login.lower()
+            with server.lock:
+                server.channels_queried += 1
+                stream = server.live.get(login)
+            if login in server.unknown:
+                data[alias] = None
+            elif stream:
+                data[alias] = {"stream": stream}
+            else:
+                data[alias] = {"stream": None}
+        self.send_json(200, {"data": data})
+
+
+class FakeTwitchGQL(_StandinServer):
+    """Answers aliased ``user(login:) { stream { ... } }`` GQL queries."""
+
+    handler = _TwitchGQLHandler
+
+    def __init__(self, live=(), unknown=(), delay=0.0, fail_status=0, **kwargs):
+        super().__init__(**kwargs)
+        self.live = {}
+        self.unknown = {login.lower() for login in unknown}
+        self.delay = delay                  # seconds before every answer (slow API)
+        self.fail_status = fail_status      # answer every query with this HTTP status (e.g. 403)
+        self.channels_queried = 0
+        for login in live:
+            self.set_live(login)
+
+    @property
+    def url(self):
+        return f"{self.base_url}/gql"
+
+    def set_live(self, login, created_at="2026-01-01T00:00:00Z"):
+        with self.lock:
+            self.live[login.lower()] = {"id": str(abs(hash(login))), "type": "live", "createdAt": created_at,
+                                        "archiveVideo": {"id": login.lower()}}
+
+    def set_offline(self, login):
+        with self.lock:
+            self.live.pop(login.lower(), None)
+
+    def control(self, channel=None, state=None, delay=None, status=None, channels=()):
+        for login in ([channel] if channel else []) + list(channels):
+            if state == "live":
+                self.set_live(login, time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+            elif state:
+                self.set_offline(login)
+        if delay is not None:
+            self.delay = float(delay)
+        if status is not None:
+            self.fail_status = int(status)
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats["channels_queried"] = self.channels_queried
+        return stats
+
+
+# ─── Synthetic HLS ──────────────────────────────────────────────────────────────
+TS_PACKET  = 188
+PMT_PID    = 0x1000
+VIDEO_PID  = 0x100
+PTS_HZ     = 90000
+HLS_WINDOW = 4          # segments in the live playlist (0: all of them, a DVR window)
+CHANNEL_STATES = ("offline", "live", "ended", "forbidden")
+
+
+def _crc32_mpeg(data):
+    crc = 0xffffffff
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = (crc << 1) ^ 0x04c11db7 if crc & 0x80000000 else crc << 1
+        crc &= 0xffffffff
+    return crc
+
+
+def _psi_packet(pid, section):
+    section += _crc32_mpeg(section).to_bytes(4, "big")
+    payload = b"\x00" + section        # pointer field
+    return bytes([0x47, 0x40 | pid >> 8, pid & 0xff, 0x10]) + payload + b"\xff" * (TS_PACKET - 4 - len(payload))
+
+
+def _pts_bytes(pts):
+    return bytes([
+        0x21 | (pts >> 29) & 0x0e, (pts >> 22) & 0xff, 0x01 | (pts >> 14) & 0xfe,
+        (pts >> 7) & 0xff, 0x01 | (pts << 1) & 0xfe,
+    ])
+
+
+@functools.lru_cache(maxsize=32)
+def synthetic_segment(seq, duration, bitrate):
+    """MPEG-TS segment number ``seq``: PAT, PMT and one H.264 keyframe PES padded to ``bitrate``.
+
+    Not decodable video, but structurally valid: PTS/PCR advance by
+    ``duration`` per segment and every segment starts on a random access
+    point, which is all the recorder (and ``TSCutter``) look at.
+    """
+    pat = _psi_packet(0, bytes([0x00, 0xb0, 13, 0, 1, 0xc1, 0, 0, 0, 1, 0xe0 | PMT_PID >> 8, PMT_PID & 0xff]))
+    pmt = _psi_packet(PMT_PID, bytes([
+        0x02, 0xb0, 18, 0, 1, 0xc1, 0, 0, 0xe0 | VIDEO_PID >> 8, VIDEO_PID & 0xff, 0xf0, 0,
+        0x1b, 0xe0 | VIDEO_PID >> 8, VIDEO_PID & 0xff, 0xf0, 0,
+    ]))
+    pts = int(seq * duration * PTS_HZ) % (1 << 33)
+    # Adaptation field: random access indicator + PCR
+    pcr = bytes([(pts >> 25) & 0xff, (pts >> 17) & 0xff, (pts >> 9) & 0xff, (pts >> 1) & 0xff,
+                 (pts & 1) << 7 | 0x7e, 0])
+    adaptation = bytes([1 + len(pcr), 0x50]) + pcr
+    pes = b"\x00\x00\x01\xe0\x00\x00\x80\x80\x05" + _pts_bytes(pts)
+    es = b"\x00\x00\x00\x01\x09\xf0\x00\x00\x00\x01\x67\x64\x00\x28\x00\x00\x00\x01\x65"
+    first_payload = pes + es
+    first = bytes([0x47, 0x40 | VIDEO_PID >> 8, VIDEO_PID & 0xff, 0x30]) + adaptation + first_payload
+    first += b"\xff" * (TS_PACKET - len(first))
+
+    packets = max(3, int(bitrate * duration / 8 / TS_PACKET))
+    body = [pat, pmt, first]
+    filler = b"\x00" * (TS_PACKET - 4)
+    cc_start = (seq * (packets - 2)) % 16
+    for i in range(1, packets - 2):
+        cc = (cc_start + i) % 16
+        body.append(bytes([0x47, VIDEO_PID >> 8, VIDEO_PID & 0xff, 0x10 | cc]) + filler)
+    return b"".join(body)
+
+
+class _HLSHandler(_JSONHandler):
+    def do_POST(self):
+        if not self.handle_admin():
+            self.send_json(404, {"error": "Not Found"})
+
+    def do_GET(self):
+        if self.handle_admin():
+            return
+        server = self.server_owner
+        server.count_request()
+        if server.delay:
+            time.sleep(server.delay)
+
+        if self.path == "/":
+            # Cookie page for the Kick cookie refresh
+            self.send_response(200)
+            self.send_header("Set-Cookie", f"session=standin{int(time.time())}; Max-Age=3600; Path=/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if len(parts) != 2:
+            return self.send_body(404, b"Not Found", "text/plain")
+        channel, name = parts[0].lower(), parts[1]
+        state, since, until = server.channel_state(channel)
+        if state == "ended" and time.monotonic() - until > 2 * server.segment_seconds:
+            # Players have seen the ENDLIST by now; afterwards the stream is simply gone
+            state = "offline"
+        if state == "forbidden":
+            return self.send_body(403, b"Forbidden", "text/plain")
+        if state == "offline":
+            return self.send_body(404, b"Not Found", "text/plain")
+
+        available = int(((until or time.monotonic()) - since) / server.segment_seconds) + 1
+        if name in ("index.m3u8", "vod.m3u8"):
+            vod = name == "vod.m3u8"
+            first = max(0, available - server.window) if server.window and not vod else 0
+            lines = [
+                "#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{int(server.segment_seconds + 0.999)}",
+                f"#EXT-X-MEDIA-SEQUENCE:{first}",
+            ]
+            if vod or not server.window:
+                lines.append("#EXT-X-PLAYLIST-TYPE:EVENT")
+            went_live = time.time() - (time.monotonic() - since)
+            for seq in range(first, available):
+                if not vod:
+                    # Live playlists carry wall-clock times, Twitch VODs don't
+                    date = datetime.fromtimestamp(went_live + seq * server.segment_seconds, timezone.utc)
+                    lines.append(f"#EXT-X-PROGRAM-DATE-TIME:{date.isoformat(timespec='milliseconds')}")
+                lines += [f"#EXTINF:{server.segment_seconds:.3f},", f"{seq}.ts"]
+            if state == "ended":
+                lines.append("#EXT-X-ENDLIST")
+            return self.send_body(200, ("\n".join(lines) + "\n").encode(), "application/vnd.apple.mpegurl")
+
+        seq = name[:-3] if name.endswith(".ts") else ""
+        if not seq.isdigit() or int(seq) >= available:
+            return self.send_body(404, b"Not Found", "text/plain")
+        body = synthetic_segment(int(seq), server.segment_seconds, server.bitrate)
+        server.count_segment(channel, len(body))
+        self.send_body(200, body, "video/mp2t")
+
+
+class FakeHLSOrigin(_StandinServer):
+    """Serves synthetic live streams at ``/<channel>/index.m3u8``; unknown channels are offline."""
+
+    handler = _HLSHandler
+
+    def __init__(self, live=(), segment_seconds=2.0, bitrate=3_000_000, delay=0.0, window=HLS_WINDOW, **kwargs):
+        super().__init__(**kwargs)
+        self.segment_seconds = segment_seconds
+        self.bitrate = bitrate
+        self.delay = delay
+        self.window = window                # segments in the live playlist, 0 for the whole stream
+        self.channels = {}                  # name -> (state, went live (monotonic), ended (monotonic) or None)
+        self.bytes_served = 0
+        self.segments_served = 0
+        self.first_segment = {}             # name -> seconds from going live to its first segment being served
+        for name in live:
+            self.set_state(name, "live")
+
+    def url(self, channel):
+        return f"{self.base_url}/{channel.lower()}/index.m3u8"
+
+    def channel_state(self, channel):
+        with self.lock:
+            return self.channels.get(channel, ("offline", 0.0, None))
+
+    def set_state(self, channel, state):
+        if state not in CHANNEL_STATES:
+            raise ValueError(f"state must be one of {', '.join(CHANNEL_STATES)}")
+        channel = channel.lower()
+        now = time.monotonic()
+        with self.lock:
+            old, since, _ = self.channels.get(channel, ("offline", now, None))
+            if state == "live" and old != "live":
+                since = now
+                self.first_segment.pop(channel, None)
+            self.channels[channel] = (state, since, now if state == "ended" else None)
+
+    def count_segment(self, channel, size):
+        with self.lock:
+            self.bytes_served += size
+            self.segments_served += 1
+            if channel not in self.first_segment:
+                self.first_segment[channel] = time.monotonic() - self.channels[channel][1]
+
+    def control(self, channel=None, state=None, delay=None, channels=()):
+        for name in ([channel] if channel else []) + list(channels):
+            self.set_state(name, state)
+        if delay is not None:
+            self.delay = float(delay)
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats.update(bytes_served=self.bytes_served, segments_served=self.segments_served,
+                         first_segment=dict(self.first_segment))
+        return stats
+
+
+# ─── Push events ────────────────────────────────────────────────────────────────
+def _standin_id(name):
+    return zlib.crc32(name.lower().encode()) % 10 ** 8 + 1
+
+
+def _read_exactly(rfile, n):
+    data = rfile.read(n)
+    if len(data) < n:
+        raise ConnectionError("client went away")
+    return data
+
+
+class _PushConnection:
+    """One WebSocket client of ``FakePushServer``: server side framing over the handler's socket."""
+
+    def __init__(self, handler, kind):
+        self.handler = handler
+        self.kind = kind                    # "eventsub" or "pusher"
+        self.session_id = f"standin-{id(self):x}"
+        self.topics = set()                 # broadcaster user ids (EventSub) or "channel.<id>" (Pusher)
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, payload):
+        frame = ws.encode_frame(ws.OP_TEXT, json.dumps(payload).encode(), mask=False)
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.handler.wfile.write(frame)
+                self.handler.wfile.flush()
+            except OSError:
+                self.closed = True
+
+    def close(self):
+        self.closed = True
+        try:
+            self.handler.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def recv(self):
+        """Next text message from the client; answers pings, None once it closed."""
+        rfile = self.handler.rfile
+        while True:
+            b0, b1 = _read_exactly(rfile, 2)
+            n = ws.payload_length(b1, _read_exactly(rfile, ws.extended_length_size(b1)))
+            key = _read_exactly(rfile, 4) if b1 & 0x80 else None
+            payload = _read_exactly(rfile, n)
+            payload = ws.apply_mask(payload, key) if key else payload
+            opcode = b0 & 0x0f
+            if opcode == ws.OP_CLOSE:
+                with self.lock:
+                    if not self.closed:
+                        self.handler.wfile.write(ws.encode_frame(ws.OP_CLOSE, payload[:2], mask=False))
+                    self.closed = True
+                return None
+            if opcode == ws.OP_PING:
+                with self.lock:
+                    self.handler.wfile.write(ws.encode_frame(ws.OP_PONG, payload, mask=False))
+                continue
+            if opcode == ws.OP_TEXT:
+                return payload.decode()
+
+
+class _PushHandler(_JSONHandler):
+    def do_POST(self):
+        if self.handle_admin():
+            return
+        server = self.server_owner
+        server.count_request()
+        if self.path.split("?", 1)[0] != "/helix/eventsub/subscriptions":
+            return self.send_json(404, {"error": "Not Found"})
+        if not self.headers.get("Authorization", "").startswith("Bearer ") or not self.headers.get("Client-Id"):
+            return self.send_json(401, {"error": "Unauthorized", "message": "OAuth token is missing"})
+        body = self.read_json() or {}
+        user_id = str((body.get("condition") or {}).get("broadcaster_user_id", ""))
+        session_id = (body.get("transport") or {}).get("session_id")
+        connection = server.connection(session_id)
+        if connection is None or body.get("type") not in ("stream.online", "stream.offline") or not user_id:
+            return self.send_json(400, {"error": "Bad Request", "message": "invalid subscription"})
+        with server.lock:
+            connection.topics.add(user_id)
+            server.subscriptions += 1
+        self.send_json(202, {"data": [{"id": f"sub-{user_id}-{body['type']}", "status": "enabled",
+                                       "type": body["type"], "condition": body["condition"]}]})
+
+    def do_GET(self):
+        if self.handle_admin():
+            return
+        server = self.server_owner
+        server.count_request()
+        path, _, query = self.path.partition("?")
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+            if path == "/eventsub":
+                # A reconnect carries the old session's subscriptions over, as on Twitch
+                previous = server.connection(query.partition("from=")[2]) if "from=" in query else None
+                return self.serve_websocket("eventsub", previous)
+            if path.startswith("/app/"):
+                return self.serve_websocket("pusher")
+            return self.send_json(404, {"error": "Not Found"})
+        if path == "/helix/users":
+            logins = [value for key, _, value in (p.partition("=") for p in query.split("&")) if key == "login"]
+            users = [{"id": str(_standin_id(login)), "login": login.lower(), "display_name": login}
+                     for login in logins if login.lower() not in server.unknown]
+            return self.send_json(200, {"data": users})
+        if path.startswith("/api/v2/channels/"):
+            slug = path.rsplit("/", 1)[1].lower()
+            if slug in server.unknown:
+                return self.send_json(404, {"message": "Not found"})
+            return self.send_json(200, {"id": _standin_id(slug), "slug": slug, "livestream": None})
+        self.send_json(404, {"error": "Not Found"})
+
+    def serve_websocket(self, kind, previous=None):
+        server = self.server_owner
+        key = self.headers.get("Sec-WebSocket-Key", "")
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", ws.accept_key(key))
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        connection = _PushConnection(self, kind)
+        if previous is not None:
+            connection.topics = set(previous.topics)
+        server.add_connection(connection)
+        try:
+            if kind == "eventsub":
+                connection.send(server.eventsub_message("session_welcome", {"session": {
+                    "id": connection.session_id, "status": "connected",
+                    "keepalive_timeout_seconds": server.keepalive, "reconnect_url": None}}))
+                threading.Thread(target=self.send_keepalives, args=(connection,), daemon=True).start()
+            else:
+                connection.send({"event": "pusher:connection_established", "data": json.dumps(
+                    {"socket_id": connection.session_id, "activity_timeout": server.keepalive})})
+            while (message := connection.recv()) is not None:
+                if kind == "pusher":
+                    self.handle_pusher(connection, message)
+        except (OSError, ConnectionError, ValueError):
+            pass
+        finally:
+            connection.closed = True
+            server.remove_connection(connection)
+
+    def send_keepalives(self, connection):
+        server = self.server_owner
+        while not connection.closed:
+            time.sleep(server.keepalive / 2)
+            connection.send(server.eventsub_message("session_keepalive", {}))
+
+    def handle_pusher(self, connection, message):
+        try:
+            message = json.loads(message)
+        except ValueError:
+            return
+        event, data = message.get("event"), message.get("data") or {}
+        if event == "pusher:ping":
+            connection.send({"event": "pusher:pong", "data": "{}"})
+        elif event == "pusher:subscribe" and isinstance(data, dict) and data.get("channel"):
+            with self.server_owner.lock:
+                connection.topics.add(data["channel"])
+                self.server_owner.subscriptions += 1
+            connection.send({"event": "pusher_internal:subscription_succeeded", "data": "{}",
+                             "channel": data["channel"]})
+
+
+class FakePushServer(_StandinServer):
+    """Go-live/go-offline events over WebSockets, Twitch EventSub and Kick Pusher style.
+
+    ``ws://.../eventsub`` plus the Helix ``/helix/users`` and
+    ``/helix/eventsub/subscriptions`` endpoints stand in for Twitch,
+    ``ws://.../app/<key>`` plus ``/api/v2/channels/<slug>`` for Kick. Setting
+    a channel's state to live/offline sends the event to every connection
+    subscribed to it, ``delay`` seconds later.
+    """
+
+    handler = _PushHandler
+
+    def __init__(self, unknown=(), delay=0.0, keepalive=10, **kwargs):
+        super().__init__(**kwargs)
+        self.unknown = {name.lower() for name in unknown}
+        self.delay = delay                  # seconds between a state change and its event
+        self.keepalive = keepalive
+        self.clients = []                   # open _PushConnections
+        self.subscriptions = 0
+        self.events_sent = 0
+        self.live = {}                      # name -> went live (unix)
+
+    @property
+    def eventsub_url(self):
+        return self.base_url.replace("http://", "ws://") + "/eventsub"
+
+    @property
+    def pusher_url(self):
+        return self.base_url.replace("http://", "ws://") + "/app/standin?protocol=7&client=js&version=8.4.0"
+
+    def add_connection(self, connection):
+        with self.lock:
+            self.clients.append(connection)
+
+    def remove_connection(self, connection):
+        with self.lock:
+            if connection in self.clients:
+                self.clients.remove(connection)
+
+    def connection(self, session_id):
+        with self.lock:
+            return next((c for c in self.clients if c.session_id == session_id), None)
+
+    @staticmethod
+    def eventsub_message(kind, payload, subscription_type=None):
+        metadata = {"message_id": f"{time.monotonic_ns():x}", "message_type": kind,
+                    "message_timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+        if subscription_type:
+            metadata.update(subscription_type=subscription_type, subscription_version="1")
+        return {"metadata": metadata, "payload": payload}
+
+    def _messages(self, name, live, started):
+        """(EventSub message, Pusher message) announcing ``name`` going live or offline."""
+        channel_id = _standin_id(name)
+        kind = "stream.online" if live else "stream.offline"
+        event = {"broadcaster_user_id": str(channel_id), "broadcaster_user_login": name, "broadcaster_user_name": name}
+        if live:
+            event.update(id=str(int(started)), type="live",
+                         started_at=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started)))
+            data = {"livestream": {"id": int(started), "channel_id": channel_id, "session_title": "standin",
+                                   "created_at": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(started))}}
+        else:
+            data = {"livestream": {"id": int(started), "channel": {"id": channel_id, "is_banned": False}}}
+        eventsub = self.eventsub_message("notification", {
+            "subscription": {"type": kind, "version": "1", "condition": {"broadcaster_user_id": str(channel_id)}},
+            "event": event}, subscription_type=kind)
+        pusher = {"event": "App\\Events\\StreamerIsLive" if live else "App\\Events\\StopStreamBroadcast",
+                  "data": json.dumps(data), "channel": f"channel.{channel_id}"}
+        return str(channel_id), eventsub, pusher
+
+    def _emit(self, name, live, started):
+        user_id, eventsub, pusher = self._messages(name, live, started)
+        with self.lock:
+            targets = [(c, eventsub if c.kind == "eventsub" else pusher) for c in self.clients
+                       if user_id in c.topics or pusher["channel"] in c.topics]
+            self.events_sent += len(targets)
+        for connection, message in targets:
+            connection.send(message)
+
+    def set_state(self, name, state):
+        name = name.lower()
+        live = state == "live"
+        with self.lock:
+            if live == (name in self.live):
+                return
+            if live:
+                started = self.live[name] = time.time()
+            else:
+                started = self.live.pop(name)
+        if self.delay:
+            threading.Timer(self.delay, self._emit, (name, live, started)).start()
+        else:
+            self._emit(name, live, started)
+
+    def reconnect(self):
+        """Ask every EventSub client to move to a new connection (``session_reconnect``)."""
+        with self.lock:
+            clients = [c for c in self.clients if c.kind == "eventsub"]
+        for connection in clients:
+            connection.send(self.eventsub_message("session_reconnect", {"session": {
+                "id": connection.session_id, "status": "reconnecting",
+                "reconnect_url": f"{self.eventsub_url}?from={connection.session_id}"}}))
+
+    def drop(self):
+        """Cut every WebSocket connection, like a network failure."""
+        with self.lock:
+            clients = list(self.clients)
+        for connection in clients:
+            connection.close()
+
+    def control(self, channel=None, state=None, delay=None, channels=(), reconnect=False, drop=False):
+        if delay is not None:
+            self.delay = float(delay)
+        for name in ([channel] if channel else []) + list(channels):
+            if state:
+                self.set_state(name, state)
+        if reconnect:
+            self.reconnect()
+        if drop:
+            self.drop()
+
+    def stop(self):
+        self.drop()
+        super().stop()
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats.update(open_connections=len(self.clients), subscriptions=self.subscriptions,
+                         events_sent=self.events_sent)
+        return stats
+
+
+def main(argv=None):
+    import time
+    import argparse
+
+    from .migrate import parse_size
+
+    parser = argparse.ArgumentParser(description="Run a local platform API stand-in.")
+    sub = parser.add_subparsers(dest="kind", required=True)
+    gql = sub.add_parser("twitch-gql", help="Twitch GQL live-status stand-in")
+    gql.add_argument("--live", nargs="*", default=[], help="logins to report as live")
+    gql.add_argument("--port", type=int, default=0)
+    hls = sub.add_parser("hls", help="synthetic live HLS origin (and Kick cookie page)")
+    hls.add_argument("--live", nargs="*", default=[], help="channels that are live from the start")
+    hls.add_argument("--segment-seconds", type=float, default=2.0)
+    hls.add_argument("--bitrate", default="3M", help="stream bitrate in bits/s (K/M suffixes)")
+    hls.add_argument("--window", type=int, default=HLS_WINDOW,
+                     help="segments in the live playlist (0: the whole stream, a DVR window)")
+    hls.add_argument("--port", type=int, default=0)
+    push = sub.add_parser("push", help="go-live events over WebSockets (Twitch EventSub / Kick Pusher)")
+    push.add_argument("--delay", type=float, default=0.0, help="seconds between a state change and its event")
+    push.add_argument("--port", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.kind == "hls":
+        server = FakeHLSOrigin(live=args.live, segment_seconds=args.segment_seconds,
+                               bitrate=parse_size(args.bitrate), window=args.window, port=args.port).start()
+        print(f"HLS stand-in listening on {server.base_url}/<channel>/index.m3u8", flush=True)
+    elif args.kind == "push":
+        server = FakePushServer(delay=args.delay, port=args.port).start()
+        print(f"Push stand-in listening on {server.base_url}", flush=True)
+    else:
+        server = FakeTwitchGQL(live=args.live, port=args.port).start()
+        print(f"Twitch GQL stand-in listening on {server.url}", flush=True)
+    try:
+        while True:
+            time.sleep(60)
+            print(f"requests={server.requests} connections={server.connections}", flush=True)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,284 @@
+"""Disk space management for the recording directories.
+
+``fallback_dir`` fills up without limit while the NAS is down, and a full
+local disk kills every recording on the box at once. ``StorageManager``
+(one per process, shared by all channels) keeps an eye on the free space
+of every ``external_dir`` and ``fallback_dir``:
+
+* before a capture: a NAS with less than ``MinFreeSpace`` left is skipped in
+  favour of the fallback dir, and if that is low too (after retention) the
+  capture is refused with ``StorageFull`` instead of filling the disk;
+* while recording, every ``interval`` seconds: retention deletes the oldest
+  finished recordings in the fallback dirs when ``RetentionPolicy=oldest``
+  and the disk is low, a dir is over ``FallbackQuota``, or a channel is over
+  ``ChannelQuota``. Files written to in the last ``ACTIVE_AGE`` seconds are
+  left alone: another recorder process may still be capturing into them. A
+  capture whose disk is still low after that is told so (``on_low``) and
+  restarted where there is room, or stopped (see ``run_watched``);
+* active recordings get ``PreallocateSize`` of disk reserved ahead of their
+  end with ``fallocate(FALLOC_FL_KEEP_SIZE)``, so files grow in large
+  extents (less fragmentation and metadata churn on spinning disks) without
+  the reported size changing. The unused tail is released when the file is
+  finished.
+"""
+import os
+import re
+import time
+import shutil
+import ctypes
+import asyncio
+import ctypes.util
+
+from . import metrics
+from .migrate import SPOOL_PART_RE, parse_size
+from .spool import SIDECAR_EXT
+
+FALLOC_FL_KEEP_SIZE = 0x01
+CHANNEL_RE = re.compile(r"^(.+?)-\d{8}-\d{6}")      # <streamer>-<YYYYmmdd-HHMMSS>...
+STAT_TIMEOUT = 5
+ACTIVE_AGE   = 300      # seconds since the last write before a file counts as finished
+
+
+class StorageFull(OSError):
+    """No recording directory has enough free space for a new capture."""
+
+
+def _load_fallocate():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fallocate = libc.fallocate
+    except (OSError, AttributeError, TypeError):
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+    return fallocate
+
+
+_fallocate = _load_fallocate()
+
+
+def reserve(path, offset, length):
+    """Allocate ``length`` bytes at ``offset`` without changing the file size. False if unsupported."""
+    if _fallocate is None:
+        return False
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        if _fallocate(fd, FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+    finally:
+        os.close(fd)
+    return True
+
+
+def release(path):
+    """Free blocks reserved past the end of ``path``."""
+    os.truncate(path, os.path.getsize(path))
+
+
+class StorageManager:
+    def __init__(self, logger, dirs=(), min_free=5 * 1024 ** 3, retention="none", fallback_quota=0,
+                 channel_quota=0, preallocate=0, interval=30):
+        self.logger         = logger
+        self.dirs           = list(dirs)        # (fallback_dir, external_dir) pairs
+        self.min_free       = min_free
+        self.retention      = retention
+        self.fallback_quota = fallback_quota
+        self.channel_quota  = channel_quota
+        self.preallocate    = preallocate if _fallocate is not None else 0
+        self.interval       = interval
+        self.active         = {}                # key -> callable returning the path being written now
+        self.on_low         = {}                # key -> callable telling that capture its disk is low
+        self.reserved       = {}                # path -> offset up to which space is reserved
+        self.protected      = []                # sets of paths other components still need (migrator, remuxer)
+        self.catalog        = None
+
+    @classmethod
+    def from_config(cls, config, logger, dirs=(), migrator=None, remuxer=None):
+        """Return a storage manager if ``MinFreeSpace``, a quota or preallocation is configured, else None.
+
+        Files the migrator or remuxer are working on are never deleted.
+        """
+        get = lambda key: parse_size(config.get("Settings", key, fallback=""))
+        manager = cls(
+            logger, dirs,
+            min_free=get("MinFreeSpace"),
+            retention=config.get("Settings", "RetentionPolicy", fallback="none").strip().lower(),
+            fallback_quota=get("FallbackQuota"),
+            channel_quota=get("ChannelQuota"),
+            preallocate=get("PreallocateSize"),
+        )
+        if not (manager.min_free or manager.fallback_quota or manager.channel_quota or manager.preallocate):
+            return None
+        if migrator is not None:
+            manager.protected.append(migrator.active)
+        if remuxer is not None:
+            manager.protected += [remuxer.active, remuxer.running]
+        return manager
+
+    # ─── Free space ─────────────────────────────────────────────────────────────
+    async def free_bytes(self, path):
+        """Free bytes on ``path``'s filesystem, or None if it's missing or doesn't answer in time."""
+        try:
+            usage = await asyncio.wait_for(asyncio.to_thread(shutil.disk_usage, path), STAT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        metrics.FREE_BYTES.set(usage.free, path=path)
+        return usage.free
+
+    async def choose(self, external_dir, fallback_dir):
+        """Directory a new capture should go to: ``external_dir`` if it has room, else ``fallback_dir``.
+
+        Raises ``StorageFull`` when neither has ``min_free`` left after retention.
+        """
+        if not self.min_free:
+            return external_dir
+        free = await self.free_bytes(external_dir)
+        if free is not None and free >= self.min_free:
+            return external_dir
+        if free is not None and external_dir != fallback_dir:
+            self.logger.warning(f"Only {free / 1024 ** 3:.1f} GiB free on {external_dir}, recording to {fallback_dir}")
+
+        free = await self.free_bytes(fallback_dir)
+        if free is not None and free < self.min_free:
+            await asyncio.to_thread(self.apply_retention)
+            free = await self.free_bytes(fallback_dir)
+        if free is None or free < self.min_free:
+            metrics.CAPTURES_REFUSED.inc()
+            raise StorageFull(f"Less than {self.min_free / 1024 ** 3:.1f} GiB free on {fallback_dir}")
+        return fallback_dir
+
+    # ─── Retention ──────────────────────────────────────────────────────────────
+    def _busy(self, path):
+        return (path in self.reserved or any(path == get() for get in self.active.values())
+                or any(path in paths for paths in self.protected))
+
+    def _finished_files(self, directory):
+        """Deletable recordings in ``directory``, oldest first."""
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+        # Per-channel recorder processes share the directory; their captures are only visible as recent writes
+        recent = time.time() - ACTIVE_AGE
+        pending = {n[:-len(SIDECAR_EXT)] for n in names if n.endswith(SIDECAR_EXT)}
+        files = []
+        for name in names:
+            path = os.path.join(directory, name)
+            stem = os.path.splitext(name)[0]
+            if (name.startswith(".") or name.endswith((SIDECAR_EXT, ".tmp", ".json")) or name in pending
+                    or SPOOL_PART_RE.search(stem) or not CHANNEL_RE.match(name) or self._busy(path)):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_mtime < recent:
+                files.append((st.st_mtime, st.st_size, path))
+        return sorted(files)
+
+    def _delete(self, path, size, reason):
+        try:
+            os.remove(path)
+        except OSError as e:
+            self.logger.warning(f"Retention could not delete {path}: {e}")
+            return 0
+        self.logger.warning(f"Retention ({reason}): deleted {path} ({size / 1024 ** 2:.0f} MiB)")
+        metrics.RETENTION_DELETED.inc(reason=reason)
+        if self.catalog is not None:
+            self.catalog.remove_file(path)
+        return size
+
+    def apply_retention(self):
+        """Blocking: delete the oldest finished fallback recordings until every rule is met."""
+        if self.retention != "oldest":
+            return
+        for fallback_dir, _ in self.dirs:
+            files = self._finished_files(fallback_dir)
+
+            if self.channel_quota:
+                per_channel = {}
+                for mtime, size, path in files:
+                    per_channel.setdefault(CHANNEL_RE.match(os.path.basename(path)).group(1), []).append((size, path))
+                for channel, entries in per_channel.items():
+                    used = sum(size for size, _ in entries)
+                    for size, path in entries:
+                        if used <= self.channel_quota:
+                            break
+                        used -= self._delete(path, size, f"channel quota {channel}")
+
+            files = self._finished_files(fallback_dir)
+            used = sum(size for _, size, _ in files)
+            for _, size, path in files:
+                over_quota = self.fallback_quota and used > self.fallback_quota
+                try:
+                    low = self.min_free and shutil.disk_usage(fallback_dir).free < self.min_free
+                except OSError:
+                    low = False
+                if not (over_quota or low):
+                    break
+                used -= self._delete(path, size, "quota" if over_quota else "low disk")
+
+    # ─── Active recordings ──────────────────────────────────────────────────────
+    def register(self, key, current_path, on_low=None):
+        """Track a running capture; ``current_path()`` returns the file it writes now (or None).
+
+        ``on_low()`` is called once if that file's disk drops below ``min_free``.
+        """
+        self.active[key] = current_path
+        if on_low is not None:
+            self.on_low[key] = on_low
+
+    def unregister(self, key):
+        self.active.pop(key, None)
+        self.on_low.pop(key, None)
+
+    async def _check_active(self):
+        """Tell captures writing to a disk that is still low after retention."""
+        for key, on_low in list(self.on_low.items()):
+            current = self.active.get(key)
+            path = current and current()
+            if not path:
+                continue
+            free = await self.free_bytes(os.path.dirname(path) or ".")
+            if free is not None and free < self.min_free and self.on_low.pop(key, None) is not None:
+                self.logger.warning(f"Only {free / 1024 ** 3:.1f} GiB left under {path}")
+                on_low()
+
+    def _preallocate(self):
+        """Blocking: keep ``preallocate`` bytes reserved ahead of every active file; release finished ones."""
+        current = {path for get in list(self.active.values()) if (path := get())}
+        for path in list(self.reserved):
+            if path not in current:
+                del self.reserved[path]
+                try:
+                    release(path)
+                except OSError:
+                    pass
+        for path in current:
+            try:
+                size = os.path.getsize(path)
+                if self.reserved.get(path, 0) - size < self.preallocate // 2:
+                    reserve(path, size, self.preallocate)
+                    self.reserved[path] = size + self.preallocate
+            except OSError as e:
+                # Filesystem without fallocate support (e.g. some NAS mounts), or the file is gone
+                self.logger.debug(f"Preallocation on {path} failed: {e}")
+                self.reserved.setdefault(path, 0)
+
+    async def run(self):
+        while True:
+            for fallback_dir, external_dir in self.dirs:
+                for directory in (external_dir, fallback_dir):
+                    free = await self.free_bytes(directory)
+                    if free is not None and self.min_free and free < self.min_free:
+                        self.logger.warning(f"Low disk space on {directory}: {free / 1024 ** 3:.1f} GiB free")
+            await asyncio.to_thread(self.apply_retention)
+            if self.min_free:
+                await self._check_active()
+            if self.preallocate:
+                # The NAS may hang; don't let that hold up the next round forever
+                try:
+                    await asyncio.wait_for(asyncio.to_thread(self._preallocate), self.interval)
+                except asyncio.TimeoutError:
+                    self.logger.warning("Preallocation is hanging (NAS not responding?)")
+            await asyncio.sleep(self.interval)
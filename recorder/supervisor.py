@@ -0,0 +1,317 @@
+"""One process, one asyncio event loop, many channels.
+
+Each channel runs the same ``record_stream()`` coroutine that the single-channel
+scripts use; the supervisor only adds a shared cap on concurrent recordings and
+spreads the first poll of every channel across its retry interval so the
+pollers don't all wake up at once. Twitch channels sharing a batched live
+prober are the exception: they poll on a common tick so one request covers
+all of them.
+
+Edits to the channel list and settings.config are applied without a restart
+(see ``reload``), and SIGTERM lets running recordings finish first.
+"""
+import os
+import signal
+import asyncio
+import logging
+
+from . import kick, logs, metrics, twitch
+from .twitch_live import TwitchLiveProber
+from .sl_session import StreamlinkSession
+from .migrate import Migrator
+from .remux import Remuxer
+from .storage import StorageManager
+from .catalog import Catalog
+from .push import KickPusher, TwitchEventSub
+from .simulcast import SimulcastCoordinator
+from .admission import AdmissionController
+from .backfill import StartRecovery
+from .reload import ConfigReloader, drain_timeout, retire
+from .common import BASE_DIR, CONFIG_PATH, ensure_dirs, setup_logging, load_config
+
+LOG_DIR       = "/tmp/record-supervisor-logs"
+CHANNELS_PATH = os.path.join(BASE_DIR, "channels.txt")
+LOG_FORMAT    = '%(asctime)s - %(levelname)s - [%(name)s] %(message)s'
+
+PLATFORMS = {
+    "twitch": twitch.TwitchChannel,
+    "kick":   kick.KickChannel,
+}
+
+
+def parse_channel_spec(spec):
+    """Parse ``twitch:name``, ``kick:name`` or ``twitch name`` into (platform, name)."""
+    parts = spec.replace(":", " ").split()
+    if len(parts) != 2 or parts[0].lower() not in PLATFORMS:
+        raise ValueError(f"Invalid channel entry {spec!r}, expected e.g. 'twitch:roflgator' or 'kick roflgator'")
+    return parts[0].lower(), parts[1]
+
+
+def read_channel_list(path):
+    """Read a channel list file: one ``platform:name`` per line, '#' starts a comment."""
+    channels = []
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                channels.append(parse_channel_spec(line))
+    return channels
+
+
+class Supervisor:
+    def __init__(self, channels, config, max_recordings=0, config_path=CONFIG_PATH, channels_path=None,
+                 fixed_channels=()):
+        self.config = config
+        self.max_recordings = max_recordings
+        self.config_path = config_path
+        self.channels_path = channels_path      # channel list watched for changes
+        self.fixed_channels = list(fixed_channels)  # from the command line, always kept
+        self.channels = []
+        self.tasks = {}                         # task name -> task
+        self.jobs = {}                          # task name -> (coroutine factory, delay before a restart)
+        self.wanted = set()                     # (platform, name) the channel list currently asks for
+        self.retiring = set()                   # _retire() tasks of channels removed from the list
+        self.slots = None
+        self._changed = asyncio.Event()         # tasks were added, or SIGTERM
+        self.stopping = False
+        # One batched live-status prober shared by every Twitch channel
+        self.live_prober = TwitchLiveProber.from_config(config)
+        # One long-lived in-process streamlink session per platform (None = use the CLI)
+        self.sl_sessions = {
+            "twitch": StreamlinkSession.from_config(config, logging.getLogger("twitch")),
+            "kick":   StreamlinkSession.from_config(config, logging.getLogger("kick"),
+                                                    http_headers={"User-Agent": kick.STREAMLINK_UA},
+                                                    cookies_file=kick.COOKIES_FILE),
+        }
+        dirs = [
+            (twitch.FALLBACK_DIR, twitch.EXTERNAL_DIR),
+            (kick.FALLBACK_DIR, kick.EXTERNAL_DIR),
+        ]
+        # One background NAS migrator for both platforms (RecordLocalFirst)
+        self.migrator = Migrator.from_config(config, logging.getLogger("migrate"), "supervisor", dirs=dirs)
+        # One bounded remux pool for both platforms (RecordAsTS)
+        self.remuxer = Remuxer.from_config(config, logging.getLogger("remux"), "supervisor", dirs=dirs,
+                                           migrator=self.migrator)
+        # One disk space manager for every recording directory
+        self.storage = StorageManager.from_config(config, logging.getLogger("storage"), dirs=dirs,
+                                                  migrator=self.migrator, remuxer=self.remuxer)
+        # One catalog of every recorded session
+        self.catalog = Catalog.from_config(config, logging.getLogger("catalog"), migrator=self.migrator,
+                                           remuxer=self.remuxer, storage=self.storage)
+        # One go-live push connection per platform (PushDetection)
+        self.push = {
+            "twitch": TwitchEventSub.from_config(config, logging.getLogger("push.twitch")),
+            "kick":   KickPusher.from_config(config, logging.getLogger("push.kick"), cookies_file=kick.COOKIES_FILE),
+        }
+        # Twitch/Kick channel pairs recorded only once while they simulcast
+        self.simulcast = SimulcastCoordinator.from_config(config, logging.getLogger("simulcast"))
+        # One bandwidth budget for every capture (AdmissionControl)
+        self.admission = AdmissionController.from_config(config, logging.getLogger("admission"))
+        # Live-restart and backfill of the stream start (CaptureFromStart)
+        self.recovery = StartRecovery.from_config(config, logging.getLogger("backfill"))
+        for platform, name in channels:
+            if (platform, name) not in self.wanted:
+                self.wanted.add((platform, name))
+                self.channels.append(self._make_channel(platform, name))
+
+    def _make_channel(self, platform, name):
+        logger = logging.getLogger(f"{platform}.{name}")
+        shared = {"sl_session": self.sl_sessions[platform], "migrator": self.migrator, "remuxer": self.remuxer,
+                  "storage": self.storage, "catalog": self.catalog, "push": self.push[platform],
+                  "simulcast": self.simulcast, "admission": self.admission, "recovery": self.recovery}
+        if platform == "twitch":
+            shared["live_prober"] = self.live_prober
+        return PLATFORMS[platform](name, self.config, logger, **shared)
+
+    async def _run_channel(self, channel, start_delay, slots):
+        if start_delay:
+            await asyncio.sleep(start_delay)
+        await channel.record_stream(slots)
+
+    def _start(self, name, coro, factory, restart_delay):
+        self.jobs[name] = (factory, restart_delay)
+        self.tasks[name] = asyncio.create_task(coro, name=name)
+        self._changed.set()
+
+    def _start_channel(self, channel, start_delay=0):
+        name = f"{channel.platform}:{channel.streamer_name}"
+        self._start(name, self._run_channel(channel, start_delay, self.slots),
+                    lambda: self._run_channel(channel, 0, self.slots), channel.retry_time)
+
+    # ─── Live changes ───────────────────────────────────────────────────────────
+    def apply_config(self, config):
+        """Hand a reloaded settings.config to everything that keeps settings in attributes."""
+        logs.apply_config(config)
+        for channel in self.channels:
+            channel.apply_config(config)
+        if self.live_prober is not None:
+            self.live_prober.apply_config(config)
+        if self.push["twitch"] is not None:
+            self.push["twitch"].apply_config(config)
+
+    async def reload_channels(self):
+        """Start channels added to the channel list; retire removed ones once their recording ends."""
+        logger = logging.getLogger("supervisor")
+        try:
+            listed = read_channel_list(self.channels_path) if os.path.isfile(self.channels_path) else []
+        except (OSError, ValueError) as e:
+            logger.error(f"Not reloading {self.channels_path}: {e}")
+            return
+        self.wanted = set(self.fixed_channels) | set(listed)
+        current = {(c.platform, c.streamer_name): c for c in self.channels}
+        for platform, name in self.fixed_channels + listed:
+            if (platform, name) in current:
+                continue
+            logger.info(f"Channel added: {platform}:{name}")
+            channel = self._make_channel(platform, name)
+            current[(platform, name)] = channel
+            self.channels.append(channel)
+            self._start_channel(channel)
+        for key, channel in current.items():
+            if key not in self.wanted and not channel.retiring:
+                logger.info(f"Channel removed: {key[0]}:{key[1]}")
+                task = asyncio.create_task(self._retire(channel))
+                self.retiring.add(task)
+                task.add_done_callback(self.retiring.discard)
+
+    async def _retire(self, channel, timeout=None):
+        name = f"{channel.platform}:{channel.streamer_name}"
+        self.jobs.pop(name, None)               # a finished task isn't restarted
+        if name in self.tasks:
+            await retire(channel, self.tasks[name], timeout)
+        if channel in self.channels:
+            self.channels.remove(channel)
+        if not self.stopping and (channel.platform, channel.streamer_name) in self.wanted:
+            # Listed again while it was finishing its recording
+            channel = self._make_channel(channel.platform, channel.streamer_name)
+            self.channels.append(channel)
+            self._start_channel(channel)
+
+    async def drain(self):
+        """SIGTERM: stop polling everywhere, give captures ``DrainTimeout`` seconds, then stop the rest."""
+        logger = logging.getLogger("supervisor")
+        timeout = drain_timeout(self.config)
+        recording = sum(c.capturing for c in self.channels)
+        logger.info(f"SIGTERM received, draining {recording} recording(s) (at most {timeout}s)")
+        await asyncio.gather(*(self._retire(c, timeout) for c in list(self.channels)))
+        # Removed channels were stopped above too; let their own _retire() finish
+        await asyncio.gather(*self.retiring, return_exceptions=True)
+        for task in self.tasks.values():
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        logger.info("Stopped")
+
+    def _sigterm(self):
+        self.stopping = True
+        self._changed.set()
+
+    # ─── Main loop ──────────────────────────────────────────────────────────────
+    async def run(self):
+        logger = logging.getLogger("supervisor")
+        self.slots = asyncio.Semaphore(self.max_recordings) if self.max_recordings > 0 else None
+        logger.info(
+            f"Supervising {len(self.channels)} channel(s), "
+            f"max concurrent recordings: {self.max_recordings or 'unlimited'}"
+        )
+
+        # Spread first polls evenly over each platform's retry interval
+        per_platform = {}
+        for channel in self.channels:
+            per_platform.setdefault(channel.platform, []).append(channel)
+
+        for group in per_platform.values():
+            for i, channel in enumerate(group):
+                # Batched Twitch checks want the opposite: everyone on the same tick
+                batched = getattr(channel, "live_prober", None) is not None
+                self._start_channel(channel, 0 if batched else i * channel.retry_time / len(group))
+        for name, component in (("migrator", self.migrator), ("remuxer", self.remuxer), ("storage", self.storage)):
+            if component is not None:
+                self._start(name, component.run(), component.run, 60)
+        for platform, push in self.push.items():
+            # Channels may be added later, so the connection runs even without any yet
+            if push is not None:
+                self._start(f"push:{platform}", push.run(), push.run, 60)
+        reloader = ConfigReloader(logging.getLogger("reload"), self.config, self.config_path, [self.apply_config],
+                                  channels_path=self.channels_path,
+                                  on_channels=self.reload_channels if self.channels_path else None)
+        self._start("reload", reloader.run(), reloader.run, 60)
+
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGTERM, self._sigterm)
+        try:
+            # A crashed channel should be logged and restarted, not take down the others
+            while True:
+                self._changed.clear()
+                changed = asyncio.create_task(self._changed.wait())
+                await asyncio.wait({changed, *self.tasks.values()}, return_when=asyncio.FIRST_COMPLETED)
+                changed.cancel()
+                if self.stopping:
+                    await self.drain()
+                    return
+                for name, task in list(self.tasks.items()):
+                    if not task.done():
+                        continue
+                    del self.tasks[name]
+                    if name not in self.jobs:
+                        continue                # retired channel
+                    factory, delay = self.jobs[name]
+                    error = task.exception() if not task.cancelled() else "cancelled"
+                    logger.error(f"{name} stopped unexpectedly: {error!r}. Restarting.")
+                    self.tasks[name] = asyncio.create_task(self._restart_later(factory, delay), name=name)
+        finally:
+            loop.remove_signal_handler(signal.SIGTERM)
+
+    @staticmethod
+    async def _restart_later(factory, delay):
+        await asyncio.sleep(delay)
+        await factory()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Record many Twitch and Kick channels from one process.")
+    parser.add_argument("channels", nargs="*", help="channels as platform:name, e.g. twitch:roflgator kick:roflgator")
+    parser.add_argument("-f", "--channel-file", help=f"channel list file (default: {CHANNELS_PATH} if it exists)")
+    parser.add_argument("--max-recordings", type=int, default=None,
+                        help="cap on concurrent recordings (default: MaxConcurrentRecordings from settings.config)")
+    parser.add_argument("--debug", action="store_true", help="log at DEBUG level")
+    args = parser.parse_args(argv)
+
+    ensure_dirs(twitch.FALLBACK_DIR, LOG_DIR)
+    ensure_dirs(kick.FALLBACK_DIR, LOG_DIR)
+    logger = setup_logging(
+        os.path.join(LOG_DIR, "supervisor.log"),
+        level=logging.DEBUG if args.debug else logging.INFO,
+        file_level=logging.INFO,
+        fmt=LOG_FORMAT,
+    )
+    logger.info("=== Starting record-supervisor ===")
+
+    config = load_config(logger)
+
+    try:
+        fixed = [parse_channel_spec(spec) for spec in args.channels]
+        channel_file = args.channel_file or (CHANNELS_PATH if os.path.isfile(CHANNELS_PATH) else None)
+        channels = fixed + (read_channel_list(channel_file) if channel_file else [])
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if not channels and not channel_file:
+        parser.error("no channels given")
+
+    if args.max_recordings is not None:
+        max_recordings = args.max_recordings
+    else:
+        max_recordings = config.getint("Settings", "MaxConcurrentRecordings", fallback=0)
+
+    metrics.start_exporters(config, logger, "supervisor")
+    # The channel list is watched even if it doesn't exist yet: creating it adds its channels
+    supervisor = Supervisor(channels, config, max_recordings, channels_path=args.channel_file or CHANNELS_PATH,
+                            fixed_channels=fixed)
+    if any(c.platform == "twitch" for c in supervisor.channels):
+        twitch.prepare_external_storage(logging.getLogger("twitch"))
+
+    try:
+        asyncio.run(supervisor.run())
+    except KeyboardInterrupt:
+        logger.info("Stopped by user")
@@ -0,0 +1,473 @@
+import os
+import json
+import time
+import asyncio
+import contextlib
+
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from . import metrics
+from .admission import AdmissionHandover, CaptureLimits, channel_priority
+from .common import BASE_DIR, STATE_DIR, get_timestamp, run_child
+from .logs import ChannelLogger, argv
+from .push import wait_for_poll
+from .remux import capture_ext
+from .scheduler import PollScheduler
+from .simulcast import SimulcastHandover
+from .sl_session import pick_stream
+from .spool import SpoolWriter, pump_child, reconcile_pending
+from .storage import StorageFull
+from .watchdog import CaptureWatchdog, run_watched
+
+# ─── Paths ──────────────────────────────────────────────────────────────────────
+# Logs go to /tmp with rotation to limit size
+LOG_DIR      = "/tmp/twitch-record-logs"
+EXTERNAL_DIR = "/mnt/NAS/Videos/Twitch"
+FALLBACK_DIR = os.path.join(BASE_DIR, "twitch")
+
+# ``TwitchStreamURL`` overrides this, e.g. to point at the local HLS stand-in
+STREAM_URL = "https://www.twitch.tv/{name}"
+
+
+def prepare_external_storage(logger, external_dir=EXTERNAL_DIR):
+    """Detect external storage availability."""
+    try:
+        os.makedirs(external_dir, exist_ok=True)
+        logger.info(f"External storage OK: {external_dir}")
+        return True
+    except Exception as e:
+        logger.warning(f"Unable to use external storage, falling back: {e}")
+        return False
+
+
+class TwitchChannel:
+    """Polling and recording loop for a single Twitch channel."""
+
+    platform = "twitch"
+
+    def __init__(self, streamer_name, config, logger, external_dir=EXTERNAL_DIR, fallback_dir=FALLBACK_DIR,
+                 live_prober=None, sl_session=None, migrator=None, remuxer=None, storage=None,
+                 catalog=None, push=None, simulcast=None, admission=None, recovery=None):
+        self.streamer_name = streamer_name
+        self.config        = config
+        self.logger        = ChannelLogger(logger, {"channel": streamer_name, "platform": self.platform})
+        self.live_prober   = live_prober
+        self.sl_session    = sl_session
+        self.migrator      = migrator
+        self.remuxer       = remuxer
+        self.storage       = storage
+        self.catalog       = catalog
+        self.push          = push
+        self.simulcast     = simulcast
+        self.admission     = admission
+        self.recovery      = recovery
+        self.live_restart  = False              # set by StartRecovery.guard until the session's first data
+        self.backend       = "streamlink" if sl_session is None else "streamlink-api"
+        self.quality       = "best"             # lowered for a simulcast backup or by admission control
+        self.session_record = None
+        self.retiring      = False              # set by retire(): stop polling, finish the current capture
+        self.capturing     = False
+        self.external_dir  = external_dir
+        self.fallback_dir  = fallback_dir
+        self.stream_started_at = None
+        self.apply_config(config)
+        if push is not None:
+            push.watch(streamer_name)
+
+    def apply_config(self, config):
+        """(Re)read the settings kept in attributes; called again when settings.config changes."""
+        streamer_name = self.streamer_name
+        self.priority      = channel_priority(config, self.platform, streamer_name)
+        self.limits        = CaptureLimits.from_config(config)
+        self.ext           = capture_ext(config)
+        self.watchdog      = CaptureWatchdog.from_config(
+            config, self.logger, labels={"platform": self.platform, "channel": streamer_name})
+
+        twitch_token    = config.get("Settings", "TwitchToken", fallback=None)
+        client_id       = config.get("Settings", "ClientID",    fallback=None)
+        self.retry_time = config.getint("Settings", "RetryTime", fallback=30)
+        extra_args      = config.get("Settings", "ExtraArgs",   fallback="") or ""
+
+        # Parse optional quality-check settings
+        target_qualities_raw = config.get("Settings", "RestartStreamIfBetterQualityIsAvailable", fallback="").strip()
+        self.target_qualities    = [q.strip().lower() for q in target_qualities_raw.split(",") if q.strip()] if target_qualities_raw else []
+        self.quality_check_delay = config.getint("Settings", "RestartStreamIfBetterQualityCheckDelayTime", fallback=60)
+        self.upgrade_while_recording = config.getboolean("Settings", "UpgradeQualityWhileRecording", fallback=False)
+        self.upgrade_overlap         = config.getint("Settings", "UpgradeQualityOverlap", fallback=10)
+
+        if extra_args.strip() and self.sl_session is not None:
+            self.logger.warning("ExtraArgs only apply to the streamlink CLI and are ignored with InProcessStreamlink.")
+
+        # Same OAuth/Client-ID headers as --twitch-api-header, for the in-process session
+        self.plugin_options = {"api-header": []}
+        if twitch_token:
+            self.plugin_options["api-header"].append(("Authorization", f"OAuth {twitch_token}"))
+        if twitch_token and client_id:
+            self.plugin_options["api-header"].append(("Client-ID", client_id))
+
+        if twitch_token and client_id:
+            extra_args += (
+                f' --twitch-api-header "Authorization=OAuth {twitch_token}"'
+                f' --twitch-api-header "Client-ID={client_id}"'
+            )
+        elif twitch_token:
+            extra_args += f' --twitch-api-header "Authorization=OAuth {twitch_token}"'
+        self.extra_args = extra_args
+
+        # Go-live history is in its state file, so a rebuilt scheduler keeps it
+        self.scheduler = PollScheduler.from_config(
+            config, self.retry_time, os.path.join(STATE_DIR, f"schedule-twitch-{streamer_name}.json"))
+
+        stream_url = (config.get("Settings", "TwitchStreamURL", fallback="") or STREAM_URL).format(name=streamer_name)
+        if stream_url != getattr(self, "stream_url", None):
+            self.stream_url = stream_url
+            self.logger.info(f"Stream URL: {self.stream_url}")
+
+    async def check_target_quality_available(self):
+        """Queries Streamlink JSON metadata to verify if any target resolution is live."""
+        if not self.target_qualities:
+            return True, "online"
+
+        labels = {"platform": self.platform, "channel": self.streamer_name}
+        probe_started = time.monotonic()
+        with metrics.PROBE_SECONDS.time(kind="quality", **labels):
+            has_target, status = await self._probe_target_quality()
+        metrics.PROBES.inc(kind="quality", outcome=status, **labels)
+        self.logger.debug(f"Quality probe: {status}, target {'' if has_target else 'not '}available",
+                          extra={"backend": self.backend, "latency": round(time.monotonic() - probe_started, 3)})
+        return has_target, status
+
+    async def _probe_target_quality(self):
+        if self.sl_session is not None:
+            return await self._check_target_quality_in_process()
+
+        cmd = f'streamlink --json {self.stream_url} {self.extra_args}'
+        try:
+            returncode, stdout, _ = await run_child(cmd, capture_output=True)
+            if returncode != 0 or not stdout.strip():
+                return False, "offline"
+
+            data = json.loads(stdout)
+            streams = data.get("streams", {})
+            if not streams:
+                return False, "offline"
+
+            # Match any quality key against the target qualities list
+            has_target = any(
+                any(q in key.lower() for q in self.target_qualities)
+                for key in streams.keys()
+            )
+            return has_target, "online"
+        except Exception as e:
+            self.logger.warning(f"Failed to parse Streamlink JSON metadata: {e}")
+            return False, "error"
+
+    async def _check_target_quality_in_process(self):
+        from streamlink.exceptions import PluginError
+
+        try:
+            streams = await self.sl_session.probe(self.stream_url, self.plugin_options)
+        except PluginError:
+            return False, "offline"
+        except Exception as e:
+            self.logger.warning(f"Failed to fetch Streamlink stream metadata: {e}")
+            return False, "error"
+        if not streams:
+            return False, "offline"
+        has_target = any(
+            any(q in key.lower() for q in self.target_qualities)
+            for key in streams.keys()
+        )
+        return has_target, "online"
+
+    async def playlist_url(self, url=None):
+        """HLS media playlist of ``url`` (default: the live stream) at the capture quality, or None."""
+        url = url or self.stream_url
+        if urlsplit(url).path.endswith(".m3u8"):
+            return url
+        if self.sl_session is not None:
+            stream = pick_stream(await self.sl_session.probe(url, self.plugin_options), self.quality)
+            return getattr(stream, "url", None)
+        returncode, stdout, _ = await run_child(f'streamlink --stream-url {url} {self.quality} {self.extra_args}',
+                                                capture_output=True)
+        return stdout.strip().splitlines()[-1] if returncode == 0 and stdout.strip() else None
+
+    async def run_streamlink(self, output):
+        """Record to ``output``: a file path, or a SpoolWriter fed from streamlink's stdout."""
+        spooled = isinstance(output, SpoolWriter)
+        # CaptureFromStart: begin at the oldest segment the playlist still has (new sessions only)
+        live_restart = self.live_restart
+        if self.sl_session is not None:
+            self.logger.info(f"Recording in-process: {self.stream_url} {self.quality} -> {output.filename if spooled else output}")
+            returncode, message = await self.sl_session.record_async(self.stream_url, output, self.quality,
+                                                                     self.plugin_options, live_restart)
+            self.logger.info(f"Streamlink: {message}")
+            return returncode
+
+        restart = " --hls-live-restart" if live_restart else ""
+        if spooled:
+            cmd = f'streamlink {self.stream_url} {self.quality} -O{restart} {self.extra_args}'
+        else:
+            cmd = f'streamlink {self.stream_url} {self.quality} -o "{output}"{restart} {self.extra_args}'
+        if self.limits is not None:
+            cmd = self.limits.wrap(cmd, self.priority)
+        self.logger.info(f"Running streamlink ({self.quality})", extra={"backend": self.backend, "cmd": argv(cmd)})
+        if spooled:
+            returncode, _, _ = await pump_child(cmd, output, capture_stderr=False)
+        else:
+            returncode, _, _ = await run_child(cmd)
+        return returncode
+
+    async def capture(self, filename, recover=True):
+        """Run one recording session to the NAS, fallback, spool or local disk as configured.
+
+        With ``recover`` (and ``CaptureFromStart``) the part of the stream before
+        the capture is backfilled.
+        """
+        attempt = self.run_streamlink
+        if recover and self.recovery is not None:
+            attempt = self.recovery.guard(self, attempt)
+        if self.simulcast is not None:
+            attempt = self.simulcast.guard(self, attempt)
+        if self.admission is not None:
+            attempt = self.admission.guard(self, attempt)
+        return await run_watched(self, filename, attempt)
+
+    async def capture_with_upgrade(self, filename, recover=True):
+        """Record best available quality now and hand over to a target-quality capture later.
+
+        The session is written as ordered parts ``<name>-part1.<ext>``, ``<name>-part2.<ext>``, ...
+        Every ``quality_check_delay`` seconds the stream is probed in the
+        background; once a target quality shows up a second capture starts,
+        both run side by side for ``upgrade_overlap`` seconds, and only then
+        is the low-quality capture stopped, so no footage is lost at the cut.
+        """
+        stem, ext = os.path.splitext(filename)
+        part = 1
+        current = asyncio.create_task(self.capture(f"{stem}-part{part}{ext}", recover))
+        upgraded = None
+        try:
+            while True:
+                done, _ = await asyncio.wait({current}, timeout=self.quality_check_delay)
+                if done:
+                    # Stream ended (or capture failed) before the target quality appeared
+                    return current.result()
+
+                has_quality, status = await self.check_target_quality_available()
+                if status != "online" or not has_quality:
+                    continue
+
+                self.logger.info(f"Target quality available, starting overlapping capture for {self.upgrade_overlap}s")
+                part += 1
+                upgraded = asyncio.create_task(self.capture(f"{stem}-part{part}{ext}", recover=False))
+                done, _ = await asyncio.wait({upgraded}, timeout=self.upgrade_overlap)
+                if done:
+                    self.logger.warning(f"Upgraded capture exited early (code {upgraded.result()}), keeping current one")
+                    continue
+
+                current.cancel()
+                await asyncio.gather(current, return_exceptions=True)
+                self.logger.info("Switched recording to target quality.")
+                current = upgraded
+                if self.session_record is not None:
+                    self.session_record.event("upgrade", f"switched to part {part}")
+                return await current
+        finally:
+            # Cancelled during the overlap: the upgraded capture is running too
+            for pending in (current, upgraded):
+                if pending is not None and not pending.done():
+                    pending.cancel()
+                    await asyncio.gather(pending, return_exceptions=True)
+
+    def next_poll_delay(self, outcome="offline"):
+        """Seconds until the next check, from the adaptive scheduler if enabled.
+
+        With a shared live prober the wake-up is rounded down to a common
+        wall-clock grid so every channel's check lands in the same batch.
+        With push detection connected the check is only a safety net and
+        runs every ``PushSafetyInterval`` seconds.
+        """
+        if self.scheduler is not None:
+            delay = self.scheduler.next_delay(outcome)
+            grid = self.scheduler.fast_interval
+        else:
+            delay = grid = self.retry_time
+        if self.push is not None and outcome in ("live", "offline"):
+            delay = self.push.poll_delay(self.streamer_name, delay)
+            if self.push.recently_live(self.streamer_name):
+                return delay        # quick retry after a go-live event, off the batch grid
+        if self.live_prober is not None:
+            delay -= (time.time() + delay) % grid
+        return max(delay, 0)
+
+    async def check_live(self):
+        """Batched live check. Returns True/False, or None if it could not be determined."""
+        labels = {"platform": self.platform, "channel": self.streamer_name}
+        try:
+            with metrics.PROBE_SECONDS.time(kind="live", **labels):
+                stream = await self.live_prober.get_stream(self.streamer_name)
+        except Exception:
+            metrics.PROBES.inc(kind="live", outcome="error", **labels)
+            return None
+        metrics.PROBES.inc(kind="live", outcome="online" if stream else "offline", **labels)
+        self.stream_started_at = None
+        if stream and stream.get("createdAt"):
+            try:
+                self.stream_started_at = datetime.fromisoformat(stream["createdAt"].replace("Z", "+00:00")).timestamp()
+            except ValueError:
+                pass
+        return stream is not None
+
+    async def record_stream(self, slots=None):
+        """Main loop. ``slots`` optionally caps concurrent recordings across channels.
+
+        Returns once ``retiring`` is set (see ``reload.retire``).
+        """
+        if slots is None:
+            slots = contextlib.nullcontext()
+        waited_for_quality = False
+        handover = None
+
+        if self.config.getboolean("Settings", "MidStreamFailover", fallback=False):
+            await asyncio.to_thread(reconcile_pending, self.fallback_dir, self.logger)
+
+        while not self.retiring:
+            upgrade = False
+
+            # A go-live event is ahead of the GQL status: go straight to streamlink
+            pushed = self.push is not None and self.push.recently_live(self.streamer_name)
+            if pushed:
+                self.stream_started_at = self.push.started_at(self.streamer_name)
+
+            # Cheap batched live check first: only live channels pay for a streamlink probe
+            if self.live_prober is not None and not pushed:
+                live = await self.check_live()
+                if live is False:
+                    delay = self.next_poll_delay("offline")
+                    self.logger.info(f"Stream is offline. Sleeping {delay:.0f}s")
+                    waited_for_quality = False
+                    await wait_for_poll(self.push, self.streamer_name, delay)
+                    continue
+                elif live is None:
+                    self.logger.warning("Batched live check failed, falling back to streamlink probe.")
+
+            # Check target quality if configured and we haven't already waited once
+            if self.target_qualities and not waited_for_quality:
+                has_quality, status = await self.check_target_quality_available()
+
+                if status == "offline":
+                    delay = self.next_poll_delay("offline")
+                    self.logger.info(f"Stream is offline. Sleeping {delay:.0f}s")
+                    waited_for_quality = False
+                    await wait_for_poll(self.push, self.streamer_name, delay)
+                    continue
+                elif status == "error":
+                    delay = self.next_poll_delay("error")
+                    self.logger.warning(f"Error checking stream metadata. Sleeping {delay:.0f}s")
+                    await asyncio.sleep(delay)
+                    continue
+
+                if not has_quality and self.upgrade_while_recording:
+                    self.logger.warning(
+                        f"Stream is live, but target quality ({', '.join(self.target_qualities)}) is unavailable. "
+                        f"Recording best available now and switching over once it appears."
+                    )
+                    upgrade = True
+                elif not has_quality:
+                    self.logger.warning(
+                        f"Stream is live, but target quality ({', '.join(self.target_qualities)}) is unavailable. "
+                        f"Waiting {self.quality_check_delay}s to re-check before recording anyway..."
+                    )
+                    await asyncio.sleep(self.quality_check_delay)
+                    waited_for_quality = True
+
+                    # Re-check once after the delay
+                    has_quality_now, status_after_delay = await self.check_target_quality_available()
+                    if status_after_delay == "offline":
+                        delay = self.next_poll_delay("offline")
+                        self.logger.info(f"Stream went offline during delay. Sleeping {delay:.0f}s")
+                        waited_for_quality = False
+                        await wait_for_poll(self.push, self.streamer_name, delay)
+                        continue
+
+                    if has_quality_now:
+                        self.logger.info("Target quality became available during delay!")
+                    else:
+                        self.logger.warning("Target quality still unavailable after delay. Proceeding to record best available quality.")
+
+            # The other platform may already be recording this stream (SimulcastLinks)
+            self.quality = self.simulcast.quality_for(self) if self.simulcast is not None else "best"
+            if self.quality is None:
+                delay = self.next_poll_delay("live")
+                self.logger.info(f"Simulcast is recorded from Kick. Sleeping {delay:.0f}s")
+                await wait_for_poll(self.push, self.streamer_name, delay)
+                continue
+
+            # Waits for bandwidth, and may lower self.quality (AdmissionControl)
+            admission = self.admission.admit(self) if self.admission is not None else contextlib.nullcontext()
+            # After a handover the stream's start is already in the previous session
+            recover = handover is None
+            async with slots, admission:
+                if self.retiring:
+                    return
+                self.capturing = True
+                started = time.time()
+                handover = None
+                # Determine target output name and run streamlink recording
+                ts = get_timestamp()
+                filename = f"{self.streamer_name}-{ts}{self.ext}"
+                record = self.session_record = self.catalog and self.catalog.session(
+                    self.platform, self.streamer_name, filename, started)
+                if record:
+                    record.backend = self.backend
+                    record.quality = self.quality
+                try:
+                    if upgrade:
+                        returncode = await self.capture_with_upgrade(filename, recover)
+                    else:
+                        returncode = await self.capture(filename, recover)
+                except asyncio.CancelledError:
+                    # Stopped (SIGTERM drain): the output is already closed, close the catalog entry too
+                    if record:
+                        record.finish("stopped")
+                    raise
+                except StorageFull as e:
+                    self.logger.error(f"Not recording: {e}")
+                    returncode = None
+                except SimulcastHandover as e:
+                    self.logger.warning(str(e))
+                    returncode, handover = None, "simulcast"
+                except AdmissionHandover as e:
+                    self.logger.warning(str(e))
+                    returncode, handover = None, "downgrade"
+                finally:
+                    self.capturing = False
+
+            # Reset flag for the next stream session once recording stops
+            waited_for_quality = False
+
+            # Handle recording completion
+            if handover:
+                outcome = handover
+            elif returncode == 0:
+                self.logger.info("Recording finished successfully.", extra={"backend": self.backend, "exit_code": 0})
+                if self.scheduler is not None:
+                    self.scheduler.record_go_live(self.stream_started_at or started)
+                outcome = "live"
+            elif returncode is None:
+                outcome = "error"
+            else:
+                self.logger.info(f"Streamlink exited with code {returncode}. (likely offline)",
+                                 extra={"backend": self.backend, "exit_code": returncode})
+                outcome = "offline"
+
+            if record:
+                record.finish(outcome)
+                self.session_record = None
+            if handover:
+                continue        # straight back: held off, or restarted at another quality
+
+            delay = self.next_poll_delay(outcome)
+            self.logger.info(f"Sleeping {delay:.0f}s")
+            await wait_for_poll(self.push, self.streamer_name, delay)
@@ -0,0 +1,203 @@
+"""Batched Twitch live-status checks over one keep-alive connection.
+
+Instead of spawning ``streamlink --json`` for every channel on every poll,
+all channels that want a status within ``batch_window`` seconds are folded
+into a single aliased GQL query::
+
+    query { u0: user(login: "a") { stream { id type createdAt } } u1: ... }
+
+Only channels reported live go on to the (expensive) streamlink quality probe.
+"""
+import json
+import time
+import asyncio
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+from . import metrics
+
+GQL_URL = "https://gql.twitch.tv/gql"
+# Public client ID used by the twitch.tv web player (and by streamlink's twitch plugin)
+WEB_CLIENT_ID = "kimne78kx3ncx6brgo4mv6wki5h1ko"
+
+
+def build_query(logins):
+    aliases = " ".join(
+        f'u{i}: user(login: {json.dumps(login)}) {{ stream {{ id type createdAt }} }}'
+        for i, login in enumerate(logins)
+    )
+    return f"query {{ {aliases} }}"
+
+
+def parse_response(logins, payload):
+    """Map each login to its stream dict, or None if offline/unknown."""
+    data = payload.get("data") or {}
+    result = {}
+    for i, login in enumerate(logins):
+        user = data.get(f"u{i}")
+        stream = (user or {}).get("stream")
+        result[login] = stream if stream and stream.get("type", "live") == "live" else None
+    return result
+
+
+class TwitchLiveProber:
+    """Coalesces ``is_live()`` calls from many channels into batched GQL requests.
+
+    ``requests_made`` and ``connections_opened`` are kept so the cost per poll
+    can be compared against the one-subprocess-per-channel approach.
+    """
+
+    def __init__(self, url=GQL_URL, client_id=WEB_CLIENT_ID, oauth_token=None,
+                 batch_window=0.25, max_batch=100, timeout=10):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.path = parts.path or "/"
+        self.headers = {"Client-ID": client_id, "Content-Type": "application/json"}
+        if oauth_token:
+            self.headers["Authorization"] = f"OAuth {oauth_token}"
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.timeout = timeout
+
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._pending = {}
+        self._flush_handle = None
+
+        self.requests_made = 0
+        self.connections_opened = 0
+        self.channels_checked = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a prober from settings.config, or return None if batched checks are disabled."""
+        if not config.getboolean("Settings", "BatchedLiveCheck", fallback=False):
+            return None
+        return cls(
+            url=config.get("Settings", "TwitchGQLURL", fallback=GQL_URL) or GQL_URL,
+            oauth_token=config.get("Settings", "TwitchToken", fallback=None) or None,
+        )
+
+    def apply_config(self, config):
+        """Use a changed ``TwitchToken`` from the next batch on."""
+        token = config.get("Settings", "TwitchToken", fallback=None) or None
+        headers = {k: v for k, v in self.headers.items() if k != "Authorization"}
+        if token:
+            headers["Authorization"] = f"OAuth {token}"
+        self.headers = headers
+
+    # ─── Blocking HTTP side (runs in a worker thread) ───────────────────────────
+    def _connection(self):
+        if self._conn is None:
+            conn_cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            self._conn = conn_cls(self.host, timeout=self.timeout)
+            self.connections_opened += 1
+        return self._conn
+
+    def _post(self, body):
+        # One retry on a fresh connection covers keep-alive sockets the server already closed
+        for attempt in (1, 2):
+            conn = self._connection()
+            try:
+                conn.request("POST", self.path, body=body, headers=self.headers)
+                resp = conn.getresponse()
+                data = resp.read()
+                self.requests_made += 1
+                if resp.status != 200:
+                    raise RuntimeError(f"GQL HTTP {resp.status}")
+                return json.loads(data)
+            except (http.client.HTTPException, ConnectionError, OSError):
+                conn.close()
+                self._conn = None
+                if attempt == 2:
+                    raise
+
+    def fetch_live(self, logins):
+        """Blocking: return {login: stream-or-None} for all ``logins``."""
+        result = {}
+        with self._conn_lock:
+            for start in range(0, len(logins), self.max_batch):
+                chunk = logins[start:start + self.max_batch]
+                body = json.dumps({"query": build_query(chunk)})
+                result.update(parse_response(chunk, self._post(body)))
+                self.channels_checked += len(chunk)
+        return result
+
+    def close(self):
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    # ─── Async side ─────────────────────────────────────────────────────────────
+    async def is_live(self, login):
+        """Return True/False, or None if the status could not be determined."""
+        try:
+            return await self.get_stream(login) is not None
+        except Exception:
+            return None
+
+    async def get_stream(self, login):
+        """Return the stream dict, or None if the channel is offline."""
+        loop = asyncio.get_running_loop()
+        login = login.lower()
+        fut = self._pending.get(login)
+        if fut is None:
+            fut = self._pending[login] = loop.create_future()
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, lambda: asyncio.ensure_future(self._flush()))
+        return await asyncio.shield(fut)
+
+    async def _flush(self):
+        pending, self._pending = self._pending, {}
+        self._flush_handle = None
+        if not pending:
+            return
+        try:
+            with metrics.PROBE_SECONDS.time(kind="gql_batch", platform="twitch", channel=""):
+                result = await asyncio.to_thread(self.fetch_live, list(pending))
+        except Exception as e:
+            for fut in pending.values():
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for login, fut in pending.items():
+            if not fut.done():
+                fut.set_result(result.get(login))
+
+
+def _bench(argv=None):
+    """Offline cost-per-poll check against the local stand-in GQL server."""
+    import argparse
+    from .standins import FakeTwitchGQL
+
+    parser = argparse.ArgumentParser(description="Measure batched live-status polling against a local stand-in API.")
+    parser.add_argument("--channels", type=int, default=40)
+    parser.add_argument("--live", type=int, default=3, help="how many of the channels are live")
+    parser.add_argument("--polls", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    logins = [f"channel{i}" for i in range(args.channels)]
+    with FakeTwitchGQL(live=logins[:args.live]) as server:
+        prober = TwitchLiveProber(url=server.url, batch_window=0.01)
+
+        async def poll():
+            return await asyncio.gather(*(prober.is_live(login) for login in logins))
+
+        start = time.perf_counter()
+        for _ in range(args.polls):
+            statuses = asyncio.run(poll())
+        elapsed = time.perf_counter() - start
+        prober.close()
+
+    print(f"channels={args.channels} live={sum(statuses)} polls={args.polls}")
+    print(f"http requests={server.requests} connections={server.connections} "
+          f"({server.requests / args.polls:.1f} requests/poll)")
+    print(f"wall time per poll: {elapsed / args.polls * 1000:.1f} ms "
+          f"({elapsed / args.polls / args.channels * 1e6:.0f} us/channel)")
+
+
+if __name__ == "__main__":
+    _bench()
@@ -0,0 +1,131 @@
+"""Output stall watchdog.
+
+A streamlink/yt-dlp child can stay alive while nothing reaches the output
+(hung HLS fetch, blocked NAS write, ...), and without this the recorder
+would wait for it until the streamer goes offline. ``CaptureWatchdog``
+samples how fast every running capture's output grows and, once the rate
+has stayed below ``StallMinRate`` for ``StallTimeout`` seconds, stops the
+capture. ``run_watched`` then restarts it into a new file
+(``<name>-resume2.ts``, ...), which also picks the storage target again, so
+a dead NAS is left for the fallback directory.
+
+Only captures that already produced data are judged: before the first byte
+the child may just be finding out the channel is offline.
+"""
+import os
+import time
+import asyncio
+import collections
+
+from . import metrics
+from .migrate import parse_size
+from .output import bytes_written, capture_output
+
+
+class CaptureWatchdog:
+    def __init__(self, logger, min_rate=16 * 1024, stall_seconds=60, interval=5, labels=None):
+        self.logger        = logger
+        self.min_rate      = min_rate           # bytes/s below which the capture counts as stalled
+        self.stall_seconds = stall_seconds
+        self.interval      = interval
+        self.labels        = labels or {}
+        self.samples       = collections.deque(maxlen=120)     # (unix time, bytes/s) of recent samples
+
+    @classmethod
+    def from_config(cls, config, logger, labels=None):
+        """Return a watchdog if ``StallWatchdog`` is enabled, else None."""
+        if not config.getboolean("Settings", "StallWatchdog", fallback=False):
+            return None
+        return cls(
+            logger,
+            min_rate=parse_size(config.get("Settings", "StallMinRate", fallback=""), 16 * 1024),
+            stall_seconds=config.getint("Settings", "StallTimeout", fallback=60),
+            interval=config.getint("Settings", "StallSampleInterval", fallback=5),
+            labels=labels,
+        )
+
+    async def watch(self, output, task, stalled_at=None):
+        """Sample ``output`` until ``task`` ends. Cancels it and returns True if it stalled.
+
+        ``stalled_at`` (monotonic) marks a restart after a stall; the time until
+        this capture's first data is reported as the recovery time.
+        """
+        last_bytes, last_time = 0, time.monotonic()
+        low_since = None
+        while not task.done():
+            await asyncio.wait({task}, timeout=self.interval)
+            if task.done():
+                break
+            now = time.monotonic()
+            written = await bytes_written(output, self.interval)
+            if written is None:         # stat hung or failed: no progress we can see
+                written = last_bytes
+            rate = (written - last_bytes) / (now - last_time) if now > last_time else 0.0
+            self.samples.append((time.time(), rate))
+            metrics.CAPTURE_RATE.set(rate, **self.labels)
+
+            if written and not last_bytes and stalled_at is not None:
+                recovery = now - stalled_at
+                self.logger.info(f"Capture recovered from stall in {recovery:.1f}s")
+                metrics.STALL_RECOVERY_SECONDS.observe(recovery, **self.labels)
+            last_bytes, last_time = written, now
+
+            if not written or rate >= self.min_rate:
+                low_since = None
+                continue
+            low_since = low_since or now
+            if now - low_since >= self.stall_seconds:
+                self.logger.warning(f"Capture stalled: under {self.min_rate / 1024:.0f} KiB/s for "
+                                    f"{now - low_since:.0f}s ({written / 1024 ** 2:.0f} MiB written), restarting")
+                metrics.STALLS.inc(**self.labels)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                return True
+        metrics.CAPTURE_RATE.set(0, **self.labels)
+        return False
+
+
+async def run_watched(channel, filename, attempt, fallback_msg="NAS unavailable, using Fallback"):
+    """Run ``attempt(output)`` in ``capture_output``, restarting it into a new file whenever it stalls.
+
+    With ``channel.storage`` it is also restarted when the disk it writes to
+    runs low: the new file goes to wherever ``StorageManager.choose`` says
+    there is room, or the capture ends with ``StorageFull`` if nowhere has.
+    """
+    watchdog = channel.watchdog
+    if watchdog is None and channel.storage is None:
+        async with capture_output(channel, filename, fallback_msg) as output:
+            return await attempt(output)
+
+    stem, ext = os.path.splitext(filename)
+    restarts = 1
+    stalled_at = None
+    while True:
+        low_disk = asyncio.Event()
+        async with capture_output(channel, filename, fallback_msg, on_low=low_disk.set) as output:
+            task = asyncio.create_task(attempt(output))
+            watcher = asyncio.create_task(watchdog.watch(output, task, stalled_at) if watchdog is not None
+                                          else asyncio.wait({task}))
+            low = asyncio.create_task(low_disk.wait())
+            try:
+                await asyncio.wait({watcher, low}, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise
+            finally:
+                low.cancel()
+            if low_disk.is_set() and not task.done():
+                channel.logger.warning("Disk running full under the capture, restarting it elsewhere")
+                task.cancel()
+                await asyncio.gather(task, watcher, return_exceptions=True)
+                reason = "low disk"
+            elif await watcher is True:
+                reason = "stall"
+                stalled_at = time.monotonic()
+            else:
+                return task.result()
+        restarts += 1
+        filename = f"{stem}-resume{restarts}{ext}"
+        if channel.session_record is not None:
+            channel.session_record.event(reason, f"restarting as {filename}")
@@ -0,0 +1,167 @@
+"""Minimal WebSocket (RFC 6455) client for asyncio.
+
+Just what the push listeners need: text messages in both directions,
+ping/pong and close, no extensions. Like the ``http.client`` GQL prober this
+keeps the recorder free of another dependency. The framing helpers are also
+used by the stand-in push server.
+"""
+import os
+import ssl
+import base64
+import struct
+import asyncio
+import hashlib
+from urllib.parse import urlsplit
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONT, OP_TEXT, OP_BINARY, OP_CLOSE, OP_PING, OP_PONG = 0x0, 0x1, 0x2, 0x8, 0x9, 0xA
+MAX_MESSAGE = 16 * 1024 * 1024
+
+
+class ConnectionClosed(ConnectionError):
+    """The peer closed the connection, or it broke."""
+
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + GUID).encode()).digest()).decode()
+
+
+def apply_mask(data, key):
+    n = len(data)
+    pad = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(data, "big") ^ int.from_bytes(pad, "big")).to_bytes(n, "big")
+
+
+def encode_frame(opcode, payload, mask):
+    """One final frame. Clients must ``mask``, servers must not."""
+    head = bytearray([0x80 | opcode])
+    bit = 0x80 if mask else 0
+    n = len(payload)
+    if n < 126:
+        head.append(bit | n)
+    elif n < 1 << 16:
+        head += bytes([bit | 126]) + struct.pack("!H", n)
+    else:
+        head += bytes([bit | 127]) + struct.pack("!Q", n)
+    if mask:
+        key = os.urandom(4)
+        head += key
+        payload = apply_mask(payload, key)
+    return bytes(head) + payload
+
+
+def payload_length(b1, extended):
+    """Payload length from the second header byte and the 0/2/8 extended length bytes after it."""
+    n = b1 & 0x7f
+    if n == 126:
+        return struct.unpack("!H", extended)[0]
+    if n == 127:
+        return struct.unpack("!Q", extended)[0]
+    return n
+
+
+def extended_length_size(b1):
+    return {126: 2, 127: 8}.get(b1 & 0x7f, 0)
+
+
+async def read_frame(reader):
+    """(fin, opcode, payload) of the next frame on an asyncio stream."""
+    b0, b1 = await reader.readexactly(2)
+    n = payload_length(b1, await reader.readexactly(extended_length_size(b1)))
+    if n > MAX_MESSAGE:
+        raise ConnectionClosed(f"frame of {n} bytes")
+    key = await reader.readexactly(4) if b1 & 0x80 else None
+    payload = await reader.readexactly(n)
+    return bool(b0 & 0x80), b0 & 0x0f, apply_mask(payload, key) if key else payload
+
+
+class WebSocket:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.closed = False
+
+    async def recv(self):
+        """Next message (``str`` for text). Pings are answered; raises ConnectionClosed at the end."""
+        parts, opcode = [], OP_TEXT
+        while True:
+            try:
+                fin, op, payload = await read_frame(self.reader)
+            except (asyncio.IncompleteReadError, OSError) as e:
+                self.closed = True
+                raise ConnectionClosed(f"connection lost: {e!r}") from e
+            if op == OP_PING:
+                await self._send(OP_PONG, payload)
+                continue
+            if op == OP_PONG:
+                continue
+            if op == OP_CLOSE:
+                code = struct.unpack("!H", payload[:2])[0] if len(payload) >= 2 else 1005
+                await self.close(code)
+                raise ConnectionClosed(f"closed by peer (code {code})")
+            if op != OP_CONT:
+                parts, opcode = [], op
+            parts.append(payload)
+            if sum(map(len, parts)) > MAX_MESSAGE:
+                raise ConnectionClosed("message too large")
+            if fin:
+                data = b"".join(parts)
+                return data.decode() if opcode == OP_TEXT else data
+
+    async def send(self, text):
+        await self._send(OP_TEXT, text.encode())
+
+    async def _send(self, opcode, payload):
+        if self.closed:
+            raise ConnectionClosed("connection is closed")
+        try:
+            self.writer.write(encode_frame(opcode, payload, mask=True))
+            await self.writer.drain()
+        except OSError as e:
+            self.closed = True
+            raise ConnectionClosed(f"connection lost: {e!r}") from e
+
+    async def close(self, code=1000):
+        if not self.closed:
+            try:
+                await self._send(OP_CLOSE, struct.pack("!H", code))
+            except ConnectionClosed:
+                pass
+            self.closed = True
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+async def connect(url, headers=None, timeout=10):
+    """Open a ``ws://`` or ``wss://`` connection and complete the handshake."""
+    parts = urlsplit(url)
+    secure = parts.scheme == "wss"
+    port = parts.port or (443 if secure else 80)
+    context = ssl.create_default_context() if secure else None
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port, ssl=context), timeout)
+
+    key = base64.b64encode(os.urandom(16)).decode()
+    path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+    lines = [
+        f"GET {path} HTTP/1.1", f"Host: {parts.netloc}", "Upgrade: websocket", "Connection: Upgrade",
+        f"Sec-WebSocket-Key: {key}", "Sec-WebSocket-Version: 13",
+    ] + [f"{name}: {value}" for name, value in (headers or {}).items()]
+    try:
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, OSError) as e:
+        writer.close()
+        raise ConnectionClosed(f"handshake with {parts.netloc} failed: {e!r}") from e
+
+    status, *header_lines = head.decode(errors="replace").split("\r\n")
+    response = {}
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        response[name.strip().lower()] = value.strip()
+    if " 101 " not in f"{status} " or response.get("sec-websocket-accept") != accept_key(key):
+        writer.close()
+        raise ConnectionClosed(f"handshake with {parts.netloc} refused: {status}")
+    return WebSocket(reader, writer)
@@ -0,0 +1,33 @@
+import asyncio
+import types
+
+from recorder.backfill import StartRecovery
+
+
+def test_only_the_first_attempt_of_a_session_uses_live_restart():
+    recovery = StartRecovery.__new__(StartRecovery)
+    recovered = []
+
+    async def recover(channel, output):
+        recovered.append(output)
+
+    recovery.recover = recover
+    channel = types.SimpleNamespace(live_restart=False)
+    restarts = []
+
+    async def attempt(output):
+        restarts.append(channel.live_restart)
+        output.bytes_written = 1000
+        await asyncio.sleep(1.2)
+
+    async def session():
+        guarded = recovery.guard(channel, attempt)
+        first, resumed = types.SimpleNamespace(bytes_written=0), types.SimpleNamespace(bytes_written=0)
+        await guarded(first)
+        await guarded(resumed)          # e.g. a restart after a stall
+        return first
+
+    first = asyncio.run(session())
+    assert restarts == [True, False]
+    assert recovered == [first]
+    assert channel.live_restart is False
@@ -0,0 +1,41 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+
+from recorder.cookies import CookieJar
+
+logger = logging.getLogger("test")
+
+
+def refresher(tmp_path):
+    """``build_cmd`` for CookieJar.refresh: a slow refresh that counts its runs."""
+    runs = tmp_path / "runs"
+
+    def build_cmd(jar):
+        expires = int(time.time()) + 3600
+        return ["sh", "-c", f"echo run >> {runs}; sleep 0.5; "
+                            f"printf '.kick.com\\tTRUE\\t/\\tTRUE\\t{expires}\\tsession\\tx\\n' > {jar}"]
+    return build_cmd, runs
+
+
+def refresh_all(path, build_cmd, since, count):
+    async def run():
+        jars = [CookieJar(str(path), logger) for _ in range(count)]
+        return await asyncio.gather(*(jar.refresh("curl", build_cmd, since) for jar in jars))
+    return asyncio.run(run())
+
+
+def test_channels_blocked_together_refresh_once(tmp_path):
+    path = tmp_path / "cookies.txt"
+    build_cmd, runs = refresher(tmp_path)
+    since = time.time() - 1     # every channel got its 403 on the old jar
+
+    other = multiprocessing.get_context("fork").Process(target=refresh_all, args=(path, build_cmd, since, 2))
+    other.start()
+    assert refresh_all(path, build_cmd, since, 4) == [True] * 4
+    other.join(10)
+
+    assert other.exitcode == 0
+    assert runs.read_text() == "run\n"
+    assert CookieJar(str(path), logger).expires_at() > time.time() + 3000
@@ -0,0 +1,84 @@
+import asyncio
+import configparser
+import logging
+import time
+
+from recorder.backends import BackendMemory
+from recorder.common import run_child
+from recorder.kick import BACKENDS, FORBIDDEN_RE, KickChannel
+from recorder.spool import SpoolWriter, pump_child
+
+logger = logging.getLogger("test")
+BLOCKED = ["sh", "-c", "echo 'HTTP Error 403: Forbidden' >&2; exec sleep 5"]
+FRAGMENT_403 = "printf data; sleep 0.2; echo 'Failed to fetch segment: 403 Client Error' >&2; sleep 0.3; printf more"
+
+
+def spool(tmp_path):
+    nas, fallback = tmp_path / "nas", tmp_path / "fallback"
+    nas.mkdir(), fallback.mkdir()
+    return SpoolWriter("a.ts", str(nas), str(fallback), logger).start()
+
+
+def test_early_403_stops_the_child(tmp_path):
+    output = spool(tmp_path)
+    start = time.monotonic()
+    code, _, stderr = asyncio.run(pump_child(BLOCKED, output, abort_on=FORBIDDEN_RE))
+    output.close()
+    assert code != 0 and "403" in stderr
+    assert time.monotonic() - start < 2
+
+
+def test_403_after_the_first_byte_keeps_recording(tmp_path):
+    output = spool(tmp_path)
+    code, _, _ = asyncio.run(pump_child(["sh", "-c", FRAGMENT_403], output, abort_on=FORBIDDEN_RE))
+    assert code == 0
+    assert output.close() == str(tmp_path / "nas" / "a.ts")
+    assert (tmp_path / "nas" / "a.ts").read_bytes() == b"datamore"
+
+
+def test_403_after_the_child_wrote_its_file_keeps_recording(tmp_path):
+    path = tmp_path / "a.ts"
+
+    async def has_no_data():
+        return not path.exists() or path.stat().st_size == 0
+
+    cmd = FRAGMENT_403.replace("printf data", f"printf data > {path}").replace("printf more", f"printf more >> {path}")
+    code, _, _ = asyncio.run(run_child(["sh", "-c", cmd], capture_output=True, abort_on=FORBIDDEN_RE, armed=has_no_data))
+    assert code == 0 and path.read_bytes() == b"datamore"
+
+
+def channel(tmp_path, results):
+    config = configparser.ConfigParser()
+    config.read_string("[Settings]\n")
+    kick = KickChannel("alpha", config, logger, external_dir=str(tmp_path), fallback_dir=str(tmp_path))
+    kick.backends = BackendMemory(BACKENDS)
+    refreshed = []
+
+    def run(backend):
+        async def attempt(output):
+            if results[backend] == "data":
+                (tmp_path / output).write_bytes(b"data")
+                return 1, "", "error: 403 Client Error on a segment"
+            return results[backend]
+        return attempt
+
+    async def refresh(since=None):
+        refreshed.append(since)
+
+    kick.run_streamlink, kick.run_ytdlp = run("streamlink"), run("yt-dlp")
+    kick.refresh_cookies_curl = kick.refresh_cookies_ytdlp = refresh
+    return kick, refreshed
+
+
+def test_backend_that_last_worked_goes_first(tmp_path):
+    kick, refreshed = channel(tmp_path, {"streamlink": (1, "", "403 Client Error: Forbidden"), "yt-dlp": (0, "", "")})
+    assert asyncio.run(kick._attempt("a.ts")) == "live"
+    assert len(refreshed) == 1
+    assert kick.backends.order() == ["yt-dlp", "streamlink"]
+
+
+def test_late_403_is_not_a_block(tmp_path):
+    kick, refreshed = channel(tmp_path, {"streamlink": "data", "yt-dlp": (0, "", "")})
+    assert asyncio.run(kick._attempt(str(tmp_path / "a.ts"))) == "live"
+    assert refreshed == []
+    assert kick.backends.order() == ["streamlink", "yt-dlp"] and kick.backends.score("streamlink") > 0
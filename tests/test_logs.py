@@ -0,0 +1,32 @@
+import configparser
+import io
+import json
+import logging
+
+from recorder.logs import HIDDEN, ChannelLogger, LogPipeline, argv
+
+TOKEN = "abcdef0123456789"
+
+
+def test_cmd_headers_and_token_are_redacted():
+    out = io.StringIO()
+    pipeline = LogPipeline([logging.StreamHandler(out)])
+    config = configparser.ConfigParser()
+    config.read_string(f"[Settings]\nTwitchToken={TOKEN}\n")
+    pipeline.apply_config(config)
+    logger = ChannelLogger(logging.getLogger("test"), {"channel": "alpha", "platform": "twitch"})
+    try:
+        cmd = (f'streamlink --twitch-api-header "Authorization=OAuth {TOKEN}" --http-header=Cookie=session=s3cr3t '
+               f'-H "Proxy-Authorization: Basic dXNlcjpwYXNz" --http-header "User-Agent=Mozilla/5.0" twitch.tv/alpha best')
+        logger.info(f"Running streamlink with token {TOKEN}", extra={"cmd": argv(cmd), "cookie": "session=s3cr3t"})
+    finally:
+        pipeline.stop()
+
+    event = json.loads(out.getvalue())
+    assert event["message"] == f"Running streamlink with token {HIDDEN}"
+    assert event["cmd"] == [
+        "streamlink", "--twitch-api-header", f"Authorization={HIDDEN}", f"--http-header=Cookie={HIDDEN}",
+        "-H", f"Proxy-Authorization:{HIDDEN}", "--http-header", "User-Agent=Mozilla/5.0", "twitch.tv/alpha", "best",
+    ]
+    assert event["cookie"] == HIDDEN and event["channel"] == "alpha"
+    assert TOKEN not in out.getvalue() and "s3cr3t" not in out.getvalue()
@@ -0,0 +1,49 @@
+import logging
+import os
+
+from recorder.migrate import PARTIAL_EXT, MigrationQueue, Migrator
+
+logger = logging.getLogger("test")
+DATA = os.urandom(100_000)
+
+
+def setup(tmp_path, partial=b""):
+    local, nas = tmp_path / "local", tmp_path / "nas"
+    local.mkdir(), nas.mkdir()
+    src = local / "a.ts"
+    src.write_bytes(DATA)
+    if partial:
+        (nas / ("a.ts" + PARTIAL_EXT)).write_bytes(partial)
+    return Migrator(MigrationQueue(str(tmp_path / "state" / "migrate.json")), logger, chunk_size=4096), src, nas
+
+
+def test_interrupted_copy_resumes_at_the_partial(tmp_path):
+    migrator, src, nas = setup(tmp_path, partial=DATA[:60_000])
+    assert migrator.migrate(str(src), str(nas)) is True
+    assert migrator.bytes_copied == 40_000
+    assert (nas / "a.ts").read_bytes() == DATA
+    assert not src.exists() and not (nas / ("a.ts" + PARTIAL_EXT)).exists()
+
+
+def test_checksum_mismatch_keeps_the_source_and_starts_over(tmp_path):
+    migrator, src, nas = setup(tmp_path, partial=b"\0" * 60_000)      # the NAS garbled what it had
+    assert migrator.migrate(str(src), str(nas)) is False
+    assert src.read_bytes() == DATA
+    assert not (nas / "a.ts").exists() and not (nas / ("a.ts" + PARTIAL_EXT)).exists()
+
+    assert migrator.migrate(str(src), str(nas)) is True
+    assert (nas / "a.ts").read_bytes() == DATA
+
+
+def test_queue_survives_a_restart(tmp_path):
+    path = str(tmp_path / "state" / "migrate.json")
+    queue = MigrationQueue(path)
+    assert queue.add("a.ts", "/nas") and queue.add("b.ts", "/nas")
+    queue.defer(os.path.abspath("a.ts"), 300)
+
+    restarted = MigrationQueue(path)
+    assert not restarted.add("b.ts", "/nas")
+    assert restarted.next_ready()["src"] == os.path.abspath("b.ts")
+    restarted.remove(os.path.abspath("b.ts"))
+    assert MigrationQueue(path).next_ready() is None
+    assert [job["src"] for job in MigrationQueue(path).jobs] == [os.path.abspath("a.ts")]
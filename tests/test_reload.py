@@ -0,0 +1,42 @@
+import asyncio
+import configparser
+import logging
+
+from recorder.reload import LIVE_KEYS, ConfigReloader
+from recorder.twitch import TwitchChannel
+
+logger = logging.getLogger("test")
+SETTINGS = """[Settings]
+RetryTime=0
+RestartStreamIfBetterQualityIsAvailable={qualities}
+"""
+
+
+def test_reload_applies_target_qualities_to_a_running_channel(tmp_path):
+    path = tmp_path / "settings.config"
+    path.write_text(SETTINGS.format(qualities=""))
+    config = configparser.ConfigParser()
+    config.read(path)
+    channel = TwitchChannel("alpha", config, logger, external_dir=str(tmp_path / "nas"), fallback_dir=str(tmp_path))
+    reloader = ConfigReloader(logger, config, str(path), [channel.apply_config])
+    probed = []
+
+    async def capture(filename, recover=True):
+        if channel.target_qualities:
+            channel.retiring = True     # the loop kept capturing without ever probing
+            return 1
+        path.write_text(SETTINGS.format(qualities="1080p60, 720p60"))
+        assert reloader.reload() == {"restartstreamifbetterqualityisavailable"}
+        return 1                        # "offline": back to polling
+
+    async def check_target_quality_available():
+        probed.append(list(channel.target_qualities))
+        channel.retiring = True
+        return True, "online"
+
+    channel.capture = capture
+    channel.check_target_quality_available = check_target_quality_available
+    asyncio.run(asyncio.wait_for(channel.record_stream(), 10))
+
+    assert "restartstreamifbetterqualityisavailable" in LIVE_KEYS
+    assert probed == [["1080p60", "720p60"]]
@@ -0,0 +1,57 @@
+import asyncio
+import logging
+
+from recorder.remux import Remuxer
+from recorder.standins import synthetic_segment
+
+FAKE_FFMPEG = """#!/bin/sh
+for arg; do out=$arg; done
+while [ $# -gt 0 ]; do [ "$1" = "-i" ] && src=$2; shift; done
+sleep 0.5
+cp "$src" "$out"
+"""
+
+
+def test_one_process_remuxes_a_file(tmp_path):
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(FAKE_FFMPEG)
+    ffmpeg.chmod(0o755)
+    src = tmp_path / "alpha-20260101-190000.ts"
+    src.write_bytes(b"x" * 1000)
+
+    def remuxer(name):
+        return Remuxer(None, logging.getLogger(name), nice=0, idle_io=False, ffmpeg=str(ffmpeg))
+
+    async def both():
+        # Two recorder processes finding the same .ts in their scans
+        return await asyncio.gather(remuxer("a").remux(str(src)), remuxer("b").remux(str(src)))
+
+    results = asyncio.run(both())
+    assert set(results) == {None, str(tmp_path / "alpha-20260101-190000.mp4")}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["alpha-20260101-190000.mp4", "ffmpeg"]
+
+
+# Like the real mp4 muxer: a data stream in the output is an error
+STRICT_FFMPEG = """#!/bin/sh
+for arg; do out=$arg; done
+while [ $# -gt 0 ]; do
+    case $1 in
+        -i) src=$2 ;;
+        -map) case $2 in 0|0:d*) grep -q ID3 "$src" && { echo "Could not find tag for codec timed_id3" >&2; exit 1; } ;; esac ;;
+    esac
+    shift
+done
+cp "$src" "$out"
+"""
+
+
+def test_remux_drops_the_timed_id3_stream(tmp_path):
+    ffmpeg = tmp_path / "ffmpeg"
+    ffmpeg.write_text(STRICT_FFMPEG)
+    ffmpeg.chmod(0o755)
+    src = tmp_path / "alpha-20260101-190000.ts"
+    src.write_bytes(synthetic_segment(0, 2.0, 200_000) + b"ID3")     # stand-in for Twitch's metadata PES
+
+    remuxer = Remuxer(None, logging.getLogger("test"), nice=0, idle_io=False, ffmpeg=str(ffmpeg))
+    assert asyncio.run(remuxer.remux(str(src))) == str(tmp_path / "alpha-20260101-190000.mp4")
+    assert not src.exists()
@@ -0,0 +1,26 @@
+import random
+
+from recorder.scheduler import DAY, PollScheduler
+
+
+def scheduler(**kwargs):
+    sched = PollScheduler(120, fast_interval=20, jitter=0, rng=random.Random(1), **kwargs)
+    for day in range(5):
+        sched.record_go_live(day * DAY + 19 * 3600)
+    return sched
+
+
+def test_single_403_keeps_the_hot_window_pace():
+    sched = scheduler()
+    hot = 10 * DAY + 19 * 3600 - 60
+    assert sched.next_delay("offline", hot) == 20
+    assert sched.next_delay("blocked", hot) == 20
+
+
+def test_403_backoff_is_capped_and_reset():
+    sched = scheduler(max_interval=480)
+    hot = 10 * DAY + 19 * 3600 - 60
+    delays = [sched.next_delay("blocked", hot) for _ in range(6)]
+    assert delays == [20, 60, 180, 480, 480, 480]
+    assert sched.next_delay("offline", hot) == 20
+    assert sched.next_delay("blocked", hot) == 20
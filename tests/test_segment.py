@@ -0,0 +1,61 @@
+import json
+import logging
+
+from recorder import concat
+from recorder.segment import TS_PACKET, TSCutter
+from recorder.spool import SpoolWriter
+from recorder.standins import synthetic_segment
+
+logger = logging.getLogger("test")
+SEGMENT = 2.0                           # seconds per stand-in HLS segment, each starting on a keyframe
+
+
+def stream(count):
+    return b"".join(synthetic_segment(seq, SEGMENT, 200_000) for seq in range(count))
+
+
+def chunks(data, size=1000):
+    # Not packet-aligned on purpose
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def header():
+    return synthetic_segment(0, SEGMENT, 200_000)[:2 * TS_PACKET]     # PAT + PMT
+
+
+def is_keyframe(packet):
+    return packet[0] == 0x47 and packet[3] & 0x20 and packet[5] & 0x40      # random access indicator
+
+
+def test_cutter_cuts_before_keyframes():
+    cutter = TSCutter(4)
+    pieces = [piece for chunk in chunks(stream(6)) for piece in cutter.feed(chunk)] + [cutter.flush()]
+
+    cuts = [i for i, piece in enumerate(pieces) if isinstance(piece, tuple)]
+    assert [pieces[i][1] for i in cuts] == [4.0, 4.0]
+    for i in cuts:
+        assert pieces[i][0] == header()
+        assert is_keyframe(pieces[i + 1][:TS_PACKET])
+
+
+def test_segments_concat_back_to_the_stream(tmp_path):
+    nas, fallback = tmp_path / "nas", tmp_path / "fallback"
+    nas.mkdir(), fallback.mkdir()
+    data = stream(6)
+    spool = SpoolWriter("a.ts", str(nas), str(fallback), logger, segment_seconds=4).start()
+    for chunk in chunks(data):
+        spool.write(chunk)
+    spool.close()
+
+    manifest = json.loads((nas / "a.manifest.json").read_text())
+    assert manifest["complete"]
+    assert [s["file"] for s in manifest["segments"]] == ["a-seg0001.ts", "a-seg0002.ts", "a-seg0003.ts"]
+    assert [s["duration"] for s in manifest["segments"][:2]] == [4.0, 4.0]
+    for segment in manifest["segments"][1:]:
+        start = (nas / segment["file"]).read_bytes()
+        assert start.startswith(header()) and is_keyframe(start[2 * TS_PACKET:3 * TS_PACKET])
+
+    out = tmp_path / "joined.ts"
+    concat.main([str(nas / "a.manifest.json"), "-o", str(out)])
+    # Every cut repeats PAT + PMT in front of the stand-in's own; nothing else differs
+    assert out.read_bytes().replace(header() * 2, header()) == data
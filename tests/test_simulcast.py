@@ -0,0 +1,32 @@
+import configparser
+import logging
+import random
+
+from recorder.simulcast import ENVELOPE_HZ, MAX_LAG, SimulcastCoordinator, match_score
+
+random.seed(1)
+AUDIO = [random.uniform(0, 100) for _ in range(4000)]
+LAG = MAX_LAG * ENVELOPE_HZ
+
+
+def test_match_within_max_lag_either_way():
+    ours = AUDIO[:3840]
+    assert match_score(ours, AUDIO[:3840 - LAG + 10]) > 0.99        # their platform runs behind
+    assert match_score(ours, AUDIO[LAG - 10:3840]) > 0.99           # or ahead
+
+
+def test_audio_from_minutes_earlier_does_not_match():
+    ours = AUDIO[:3840]
+    clip = ours[-350:-150]                  # what match_score probes, replayed long before
+    theirs = clip + [random.uniform(0, 100) for _ in range(3640)]
+    assert match_score(ours, theirs) < 0.5
+
+
+def test_dedup_needs_ts_captures(caplog):
+    config = configparser.ConfigParser()
+    config.read_string("[Settings]\nSimulcastLinks=roflgator\nRecordAsTS=false\n")
+    assert SimulcastCoordinator.from_config(config, logging.getLogger("test")) is None
+    assert "RecordAsTS" in caplog.text
+
+    config.set("Settings", "RecordAsTS", "true")
+    assert SimulcastCoordinator.from_config(config, logging.getLogger("test")).links == [("roflgator", "roflgator")]
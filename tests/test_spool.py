@@ -0,0 +1,151 @@
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from recorder.spool import SIDECAR_EXT, SpoolWriter, reconcile_pending, reconcile_sidecar
+
+logger = logging.getLogger("test")
+CHUNKS = [bytes([i]) * 1000 for i in range(10)]
+
+
+def write_sidecar(fallback, name, parts):
+    sidecar = fallback / (name + SIDECAR_EXT)
+    sidecar.write_text(json.dumps({"parts": [{"path": str(p), "bytes": n} for p, n in parts]}))
+    return sidecar
+
+
+def test_reconcile_joins_committed_bytes(tmp_path):
+    nas, fallback = tmp_path / "nas", tmp_path / "fallback"
+    nas.mkdir(), fallback.mkdir()
+    first, second = nas / "a.ts", fallback / "a.part1.ts"
+    first.write_bytes(b"1" * 100 + b"in flight")      # the tail never got confirmed
+    second.write_bytes(b"2" * 50)
+    sidecar = write_sidecar(fallback, "a.ts", [(first, 100), (second, 50)])
+
+    assert reconcile_sidecar(str(sidecar), logger) is True
+    assert first.read_bytes() == b"1" * 100 + b"2" * 50
+    assert not second.exists() and not sidecar.exists()
+
+
+def test_reconcile_keeps_parts_when_first_part_is_missing(tmp_path):
+    # NAS unmounted: its mountpoint directory is still there, the file isn't
+    nas, fallback = tmp_path / "nas", tmp_path / "fallback"
+    nas.mkdir(), fallback.mkdir()
+    first, second = nas / "a.ts", fallback / "a.part1.ts"
+    second.write_bytes(b"2" * 50)
+    sidecar = write_sidecar(fallback, "a.ts", [(first, 100), (second, 50)])
+
+    assert reconcile_sidecar(str(sidecar), logger) is False
+    assert not first.exists()
+    assert second.read_bytes() == b"2" * 50 and sidecar.exists()
+
+
+class FlakyNAS:
+    """Opener for SpoolWriter: files under ``nas`` fail (or hang) after ``good_writes`` writes."""
+
+    def __init__(self, nas, good_writes, hang=None):
+        self.nas = str(nas)
+        self.good_writes = good_writes
+        self.hang = hang                # an Event the failing write waits on, instead of raising
+
+    def __call__(self, path, mode, buffering):
+        fh = open(path, mode, buffering)
+        return _FlakyFile(fh, self) if path.startswith(self.nas) else fh
+
+
+class _FlakyFile:
+    def __init__(self, fh, nas):
+        self.fh, self.nas = fh, nas
+
+    def write(self, chunk):
+        if self.nas.good_writes <= 0:
+            if self.nas.hang is None:
+                raise OSError(5, "Input/output error")
+            self.nas.hang.wait()
+        self.nas.good_writes -= 1
+        return self.fh.write(chunk)
+
+    def tell(self):
+        return self.fh.tell()
+
+    def close(self):
+        self.fh.close()
+
+
+def test_spool_fails_over_and_reconciles(tmp_path):
+    nas, fallback = tmp_path / "nas", tmp_path / "fallback"
+    nas.mkdir(), fallback.mkdir()
+    spool = SpoolWriter("a.ts", str(nas), str(fallback), logger, opener=FlakyNAS(nas, good_writes=4)).start()
+    for chunk in CHUNKS:
+        spool.write(chunk)
+
+    assert spool.close() == str(nas / "a.ts")
+    assert spool.failed_over
+    assert (nas / "a.ts").read_bytes() == b"".join(CHUNKS)
+    assert sorted(p.name for p in fallback.iterdir()) == []
+
+
+def test_spool_hung_nas_is_reconciled_later_without_duplicates(tmp_path):
+    nas, fallback = tmp_path / "nas", tmp_path / "fallback"
+    nas.mkdir(), fallback.mkdir()
+    hang = threading.Event()
+    spool = SpoolWriter("a.ts", str(nas), str(fallback), logger, stall_timeout=0.2,
+                        opener=FlakyNAS(nas, good_writes=4, hang=hang)).start()
+    for chunk in CHUNKS:
+        spool.write(chunk)
+
+    # The hung write is still stuck at the end: the parts wait for reconciliation
+    assert spool.close() is None
+    assert (fallback / ("a.ts" + SIDECAR_EXT)).exists()
+
+    hang.set()          # the NAS comes back; the stuck chunk lands there late
+    spool.parts[0].finished.wait(5)
+    reconcile_pending(str(fallback), logger)
+    assert (nas / "a.ts").read_bytes() == b"".join(CHUNKS)
+    assert sorted(p.name for p in fallback.iterdir()) == []
+
+
+def test_reconcile_pending_skips_a_running_capture(tmp_path):
+    # Another channel starting up reconciles the shared fallback_dir
+    nas, fallback = tmp_path / "nas", tmp_path / "fallback"
+    nas.mkdir(), fallback.mkdir()
+    spool = SpoolWriter("a.ts", str(nas), str(fallback), logger, opener=FlakyNAS(nas, good_writes=4)).start()
+    for chunk in CHUNKS:
+        spool.write(chunk)
+    wait_for(lambda: spool.bytes_written == len(b"".join(CHUNKS)))
+
+    reconcile_pending(str(fallback), logger)
+    assert (fallback / "a.part1.ts").exists() and (fallback / ("a.ts" + SIDECAR_EXT)).exists()
+    assert spool.close() == str(nas / "a.ts")
+    assert (nas / "a.ts").read_bytes() == b"".join(CHUNKS)
+
+
+def crash_after_failover(nas, fallback):
+    spool = SpoolWriter("a.ts", nas, fallback, logger, opener=FlakyNAS(nas, good_writes=4)).start()
+    for chunk in CHUNKS:
+        spool.write(chunk)
+    wait_for(lambda: spool.bytes_written == len(b"".join(CHUNKS)))
+    os._exit(0)         # killed mid-stream: no close(), the sidecar still says 0 bytes on fallback
+
+
+def test_crash_mid_failover_is_reconciled_in_full(tmp_path):
+    nas, fallback = tmp_path / "nas", tmp_path / "fallback"
+    nas.mkdir(), fallback.mkdir()
+    child = multiprocessing.get_context("fork").Process(target=crash_after_failover, args=(str(nas), str(fallback)))
+    child.start()
+    child.join(10)
+    assert child.exitcode == 0
+
+    reconcile_pending(str(fallback), logger)
+    assert (nas / "a.ts").read_bytes() == b"".join(CHUNKS)
+    assert sorted(p.name for p in fallback.iterdir()) == []
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
@@ -0,0 +1,20 @@
+import os
+import time
+import logging
+
+from recorder.storage import ACTIVE_AGE, StorageManager
+
+logger = logging.getLogger("test")
+
+
+def test_retention_spares_files_other_processes_may_be_writing(tmp_path):
+    old, live = tmp_path / "alpha-20260101-190000.ts", tmp_path / "beta-20260102-190000.ts"
+    old.write_bytes(b"x" * 100)
+    live.write_bytes(b"x" * 100)
+    stale = time.time() - ACTIVE_AGE - 60
+    os.utime(old, (stale, stale))
+
+    StorageManager(logger, [(str(tmp_path), str(tmp_path / "nas"))], retention="oldest",
+                   fallback_quota=1).apply_retention()
+    assert not old.exists()
+    assert live.exists()
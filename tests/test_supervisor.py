@@ -0,0 +1,49 @@
+import asyncio
+import configparser
+import logging
+
+from recorder.supervisor import Supervisor
+
+
+class Recording:
+    """Stand-in channel that is always in the middle of a capture."""
+
+    retry_time = 60
+
+    def __init__(self, platform, name):
+        self.platform, self.streamer_name = platform, name
+        self.logger = logging.getLogger(f"{platform}.{name}")
+        self.retiring = False
+        self.capturing = True
+        self.stopped = asyncio.Event()
+
+    async def record_stream(self, slots=None):
+        try:
+            await asyncio.sleep(3600)
+        finally:
+            self.capturing = False
+            self.stopped.set()
+
+
+def test_shutdown_waits_for_removed_channels(tmp_path):
+    channels = tmp_path / "channels.txt"
+    channels.write_text("twitch:alpha\n")
+    config = configparser.ConfigParser()
+    config.read_string("[Settings]\nDrainTimeout=0\n")
+    supervisor = Supervisor([], config, channels_path=str(channels))
+    supervisor._make_channel = Recording
+
+    async def remove_then_stop():
+        await supervisor.reload_channels()
+        alpha = supervisor.channels[0]
+        channels.write_text("")
+        await supervisor.reload_channels()      # retired once its recording ends
+        await asyncio.sleep(0.1)
+        assert len(supervisor.retiring) == 1 and alpha.retiring
+        supervisor.stopping = True
+        await supervisor.drain()
+        return alpha
+
+    alpha = asyncio.run(asyncio.wait_for(remove_then_stop(), 10))
+    assert alpha.stopped.is_set()
+    assert supervisor.retiring == set() and supervisor.channels == []
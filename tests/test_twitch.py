@@ -0,0 +1,39 @@
+import asyncio
+import configparser
+import logging
+
+from recorder.twitch import TwitchChannel
+
+logger = logging.getLogger("test")
+
+
+def test_cancel_during_upgrade_overlap_stops_both_captures(tmp_path):
+    config = configparser.ConfigParser()
+    config.read_string("[Settings]\n")
+    channel = TwitchChannel("alpha", config, logger, external_dir=str(tmp_path), fallback_dir=str(tmp_path))
+    channel.quality_check_delay, channel.upgrade_overlap = 0.05, 10
+    running = set()
+
+    async def capture(filename, recover=True):
+        running.add(filename)
+        try:
+            await asyncio.sleep(10)
+        finally:
+            running.discard(filename)
+
+    async def check_target_quality_available():
+        return True, "online"
+
+    channel.capture = capture
+    channel.check_target_quality_available = check_target_quality_available
+
+    async def stop_during_overlap():
+        task = asyncio.create_task(channel.capture_with_upgrade("alpha.ts"))
+        while len(running) < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0.05)
+        return set(running)
+
+    assert asyncio.run(asyncio.wait_for(stop_during_overlap(), 5)) == set()
@@ -0,0 +1,33 @@
+import asyncio
+
+from recorder.standins import FakeTwitchGQL
+from recorder.twitch_live import TwitchLiveProber
+
+LOGINS = [f"channel{i}" for i in range(250)]
+
+
+def poll(prober, logins):
+    async def run():
+        return await asyncio.gather(*(prober.is_live(login) for login in logins))
+    return asyncio.run(run())
+
+
+def test_channels_polled_together_share_batched_requests():
+    with FakeTwitchGQL(live=["channel1", "Channel200"], unknown=["channel3"]) as server:
+        prober = TwitchLiveProber(url=server.url, batch_window=0.05, max_batch=100)
+        for _ in range(2):
+            statuses = poll(prober, LOGINS)
+        prober.close()
+
+    assert [login for login, live in zip(LOGINS, statuses) if live] == ["channel1", "channel200"]
+    assert statuses[3] is False
+    assert server.requests == 6 and server.connections == 1     # 3 batches of <= 100 per poll, one keep-alive
+    assert prober.channels_checked == 500
+
+
+def test_failed_batch_leaves_every_status_unknown():
+    with FakeTwitchGQL(live=["channel1"], fail_status=403) as server:
+        prober = TwitchLiveProber(url=server.url, batch_window=0.05)
+        statuses = poll(prober, LOGINS[:10])
+        prober.close()
+    assert statuses == [None] * 10